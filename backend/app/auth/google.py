@@ -0,0 +1,169 @@
+"""
+Local verification of Google ID tokens.
+
+Tokens are checked against Google's published signing keys (JWKS) instead
+of a round-trip to the tokeninfo endpoint per login. The key set is fetched
+with a shared, pooled HTTP client and refreshed in the background as its
+Cache-Control max-age runs out, or on demand when a token names an unknown
+key id. Verified tokens are cached for ``TOKEN_CACHE_TTL`` seconds or until
+they expire, whichever comes first.
+
+Point ``GOOGLE_JWKS_URL`` (or pass ``http_client``) at a local stand-in to
+verify self-signed tokens in development.
+
+httpx and joserfc (with cryptography behind it) are the heaviest imports
+of the app, so they are loaded when the verifier is first used rather than
+with ``app.main``; the background refresh loads them off the event loop.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+from app.utils.security import LRUCache
+
+if TYPE_CHECKING:
+    import httpx
+    from joserfc.jwk import KeySet
+
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
+GOOGLE_JWKS_URL = os.getenv("GOOGLE_JWKS_URL", "https://www.googleapis.com/oauth2/v3/certs")
+GOOGLE_ISSUERS = ["accounts.google.com", "https://accounts.google.com"]
+# Refresh interval when the JWKS response carries no max-age
+JWKS_REFRESH_INTERVAL = float(os.getenv("GOOGLE_JWKS_REFRESH_INTERVAL", "3600"))
+# Minimum seconds between on-demand refreshes triggered by unknown key ids
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv("GOOGLE_JWKS_MIN_REFRESH_INTERVAL", "30"))
+# Verified tokens remembered, and for how long at most
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+MAX_AGE = re.compile(r"max-age=(\d+)")
+
+logger = logging.getLogger("app.auth.google")
+
+
+class InvalidToken(Exception):
+    def __init__(self, detail: str, status_code: int = 401):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def _load_dependencies():
+    import httpx  # noqa: F401
+    import joserfc.jwt  # noqa: F401
+
+
+class GoogleTokenVerifier:
+    def __init__(self, client_id: Optional[str] = GOOGLE_CLIENT_ID, jwks_url: str = GOOGLE_JWKS_URL,
+                 http_client: Optional["httpx.AsyncClient"] = None,
+                 cache_size: int = TOKEN_CACHE_SIZE, cache_ttl: float = TOKEN_CACHE_TTL):
+        self.client_id = client_id
+        self.jwks_url = jwks_url
+        self.http_client = http_client
+        self.key_set: Optional["KeySet"] = None
+        self.key_ids = frozenset()
+        self.refreshes = 0
+        self.token_cache = LRUCache(cache_size)
+        self.cache_ttl = cache_ttl
+        self._expires_at = 0.0
+        self._last_refresh = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Fetch the keys in the background and keep them fresh; logins before that fetch on demand"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+
+    async def refresh(self, if_older_than: float = 0):
+        """Fetch the current signing keys, unless they were fetched less than ``if_older_than`` seconds ago"""
+        import httpx
+        from joserfc.jwk import KeySet
+
+        async with self._refresh_lock:
+            if self.key_set is not None and time.monotonic() - self._last_refresh < if_older_than:
+                return
+            if self.http_client is None:
+                # Shared by every refresh; only key fetches go over the network
+                self.http_client = httpx.AsyncClient(
+                    timeout=10, limits=httpx.Limits(max_connections=4, max_keepalive_connections=2)
+                )
+            response = await self.http_client.get(self.jwks_url)
+            response.raise_for_status()
+            keys = response.json()
+            self.key_set = KeySet.import_key_set(keys)
+            self.key_ids = frozenset(key.get("kid") for key in keys["keys"])
+            match = MAX_AGE.search(response.headers.get("cache-control", ""))
+            max_age = int(match.group(1)) if match else JWKS_REFRESH_INTERVAL
+            self._last_refresh = time.monotonic()
+            self._expires_at = self._last_refresh + max_age
+            self.refreshes += 1
+
+    async def verify(self, token: str) -> Dict:
+        """Return the claims of a valid Google ID token for this client, or raise InvalidToken"""
+        cached = self.token_cache.get(token, None)
+        if cached is not None:
+            return cached
+
+        import httpx
+        from joserfc import jwt
+        from joserfc.errors import JoseError
+        from joserfc.jws import extract_compact
+
+        try:
+            kid = extract_compact(token.encode()).headers().get("kid")
+        except (JoseError, ValueError):
+            raise InvalidToken("Invalid token")
+        if kid not in self.key_ids:
+            # Google rotated its keys (or we never got them); refresh at most every so often
+            try:
+                await self.refresh(if_older_than=JWKS_MIN_REFRESH_INTERVAL)
+            except (httpx.HTTPError, JoseError, ValueError):
+                raise InvalidToken("Could not fetch signing keys", status_code=503)
+            if kid not in self.key_ids:
+                raise InvalidToken("Invalid token")
+
+        try:
+            claims = jwt.decode(token, self.key_set, algorithms=["RS256"]).claims
+            jwt.JWTClaimsRegistry(
+                iss={"essential": True, "values": GOOGLE_ISSUERS},
+                exp={"essential": True},
+                sub={"essential": True},
+            ).validate(claims)
+        except (JoseError, ValueError):
+            raise InvalidToken("Invalid token")
+        if claims.get("aud") != self.client_id:
+            raise InvalidToken("Invalid audience", status_code=403)
+
+        # Never serve a cached token past its own expiry
+        ttl = min(self.cache_ttl, claims["exp"] - time.time())
+        if ttl > 0:
+            self.token_cache.set(token, claims, ttl=ttl)
+        return claims
+
+    async def _refresh_loop(self):
+        await asyncio.to_thread(_load_dependencies)
+        # A login may have fetched the keys while the libraries were loading
+        if_older_than = JWKS_MIN_REFRESH_INTERVAL
+        while True:
+            try:
+                await self.refresh(if_older_than)
+                if_older_than = 0
+            except Exception as e:
+                logger.warning("Google signing key refresh failed: %s", e)
+                self._expires_at = time.monotonic() + JWKS_MIN_REFRESH_INTERVAL
+            await asyncio.sleep(max(1.0, self._expires_at - time.monotonic()))
+
+
+google_verifier = GoogleTokenVerifier()
@@ -0,0 +1,110 @@
+"""
+In-memory cache of user profiles.
+
+WebSocket connects look users up by id and logins by google_id; both are
+served from here. ``/auth/login`` refreshes the entry, and only writes to
+the database when the name or avatar actually changed. Entries expire after
+``PROFILE_CACHE_TTL`` seconds so edits made on another worker show up
+eventually.
+"""
+import os
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import AsyncSessionLocal, upsert
+from app.models.user import User
+from app.utils.security import LRUCache
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+
+
+class UserProfile(NamedTuple):
+    id: int
+    google_id: str
+    name: str
+    avatar_url: Optional[str]
+
+    def as_dict(self) -> Dict:
+        return self._asdict()
+
+
+class ProfileCache:
+    def __init__(self, maxsize: int = PROFILE_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL):
+        self.by_id = LRUCache(maxsize, ttl)
+        # google_id -> id; resolved through by_id so both views agree
+        self.ids_by_google_id = LRUCache(maxsize, ttl)
+        self.writes = 0
+        self.skipped_writes = 0
+
+    def put(self, profile: UserProfile):
+        self.by_id.set(str(profile.id), profile)
+        self.ids_by_google_id.set(profile.google_id, profile.id)
+
+    def invalidate(self, user_id: int):
+        profile = self.by_id.get(str(user_id), None)
+        self.by_id.delete(str(user_id))
+        if profile is not None:
+            self.ids_by_google_id.delete(profile.google_id)
+
+    async def get(self, user_id: int) -> Optional[UserProfile]:
+        """Profile for ``user_id``, loading it on a miss; None if there is no such user"""
+        profile = self.by_id.get(str(user_id), None)
+        if profile is None:
+            async with AsyncSessionLocal() as db:
+                user = await db.get(User, user_id)
+            if user is None:
+                return None
+            profile = _profile(user)
+            self.put(profile)
+        return profile
+
+    async def login(self, db: AsyncSession, google_id: str, name: str,
+                    avatar_url: Optional[str]) -> UserProfile:
+        """Create or update the user behind a Google login, writing only when something changed"""
+        user_id = self.ids_by_google_id.get(google_id, None)
+        profile = self.by_id.get(str(user_id), None) if user_id is not None else None
+        if profile is None:
+            user = await db.scalar(select(User).filter_by(google_id=google_id))
+            profile = _profile(user) if user is not None else None
+
+        if profile is not None and profile.name == name and profile.avatar_url == avatar_url:
+            self.skipped_writes += 1
+            self.put(profile)
+            return profile
+
+        stmt = upsert(db, User).values(google_id=google_id, name=name, avatar_url=avatar_url)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.google_id],
+            set_={"name": stmt.excluded.name, "avatar_url": stmt.excluded.avatar_url},
+            # Another worker may have written the same values already
+            where=or_(
+                User.name.is_distinct_from(stmt.excluded.name),
+                User.avatar_url.is_distinct_from(stmt.excluded.avatar_url),
+            ),
+        )
+        user_id = await db.scalar(stmt.returning(User.id))
+        await db.commit()
+        if user_id is None:
+            user_id = await db.scalar(select(User.id).filter_by(google_id=google_id))
+        self.writes += 1
+        profile = UserProfile(user_id, google_id, name, avatar_url)
+        self.put(profile)
+        return profile
+
+    def stats(self) -> Dict:
+        return {
+            "by_id": self.by_id.stats(),
+            "by_google_id": self.ids_by_google_id.stats(),
+            "login_writes": self.writes,
+            "login_writes_skipped": self.skipped_writes,
+        }
+
+
+def _profile(user: User) -> UserProfile:
+    return UserProfile(user.id, user.google_id, user.name, user.avatar_url)
+
+
+profile_cache = ProfileCache()
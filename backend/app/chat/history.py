@@ -0,0 +1,90 @@
+"""
+Conversation history queries.
+
+History is read with keyset pagination over ``(timestamp, id)``. Each
+direction of the conversation is a separate branch that walks
+``ix_messages_conversation`` in order, and the two branches are merged,
+so a page costs O(limit) index reads however long the conversation is.
+On a table partitioned by month (``app.db.partitions``) the newest pages
+are read from the newest partitions first, and cursor pages skip the
+partitions on the wrong side of the cursor.
+"""
+from typing import Optional
+
+from sqlalchemy import Select, select, tuple_, union_all
+
+from app.models.message import Message
+
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 1000
+
+# Plain columns rather than ORM entities so large pages are not materialized as objects
+HISTORY_COLUMNS = (
+    Message.id,
+    Message.from_id,
+    Message.to_id,
+    Message.content,
+    Message.timestamp,
+    Message.delivered_at,
+    Message.seen_at,
+)
+
+
+def conversation_query(
+    user1_id: int,
+    user2_id: int,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None,
+    newest_first: bool = False,
+) -> Select:
+    """
+    Messages exchanged between two users, ordered by ``(timestamp, id)``.
+
+    ``before``/``after`` are message ids used as exclusive keyset cursors.
+    With ``newest_first`` the rows come back in descending order, which is
+    what "latest page" and ``before`` queries need before being reversed.
+    """
+    def order(subquery=None):
+        columns = subquery.c if subquery is not None else Message
+        if newest_first:
+            return (columns.timestamp.desc(), columns.id.desc())
+        return (columns.timestamp.asc(), columns.id.asc())
+
+    def branch(sender: int, receiver: int):
+        query = select(*HISTORY_COLUMNS).where(Message.from_id == sender, Message.to_id == receiver)
+        key = tuple_(Message.timestamp, Message.id)
+        # The plain bound on ``timestamp`` repeats the keyset condition in a form
+        # Postgres can prune monthly partitions with once the cursor is known
+        if before is not None:
+            cursor = select(Message.timestamp).where(Message.id == before).scalar_subquery()
+            query = query.where(Message.timestamp <= cursor, key < tuple_(cursor, before))
+        if after is not None:
+            cursor = select(Message.timestamp).where(Message.id == after).scalar_subquery()
+            query = query.where(Message.timestamp >= cursor, key > tuple_(cursor, after))
+        query = query.order_by(*order())
+        if limit is not None:
+            query = query.limit(limit)
+        # Wrapped so per-branch ORDER BY/LIMIT is valid inside UNION ALL on every backend
+        return select(query.subquery())
+
+    if user1_id == user2_id:
+        merged = branch(user1_id, user2_id).subquery()
+    else:
+        merged = union_all(branch(user1_id, user2_id), branch(user2_id, user1_id)).subquery()
+    query = select(merged).order_by(*order(merged))
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def history_row(row) -> dict:
+    return {
+        "id": row.id,
+        "from": row.from_id,
+        "to": row.to_id,
+        "message": row.content,
+        "timestamp": row.timestamp.isoformat(),
+        "delivered_at": row.delivered_at.isoformat() if row.delivered_at else None,
+        "seen_at": row.seen_at.isoformat() if row.seen_at else None,
+    }
@@ -0,0 +1,336 @@
+"""
+In-memory tails of recently read conversations, serving ``GET /history``.
+
+Each cached conversation holds its newest ``HISTORY_CACHE_TAIL`` messages in
+``conversation_query`` order, ``(timestamp, id)``. A conversation enters the
+cache when its latest page is read from the database. From then on, the
+write pipeline and the pending drain keep it current after each commit as
+messages are inserted, delivered and seen. A request the tail answers
+exactly (the latest page, or a ``before``/``after`` page inside the tail)
+never touches the database; older pages and misses fall through to it.
+Conversations are evicted least recently used first.
+
+The cache only sees writes made by this process. It is therefore off by
+default when ``CHAT_ROUTING_BACKEND=redis`` spreads chat over several
+workers. Archival is the exception: whichever worker archives a month, every
+worker's cache drops that month's rows when ``MESSAGE_RETENTION_MONTHS``
+puts it out of the window, by the clock, before answering a page.
+
+``HistoryCache.verify`` compares what the cache would serve with the
+database, page by page. It is served at ``/cache-stats/history/consistency``
+and run by ``benchmarks.history_cache`` after its chat traffic.
+"""
+import os
+import sys
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import UTC, datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.chat.history import HISTORY_PAGE_SIZE, conversation_query, history_row
+from app.chat.routing import ROUTING_BACKEND
+from app.db.database import async_engine
+from app.db.partitions import MESSAGE_RETENTION_MONTHS, add_months, month_start
+
+# Conversations kept (0 disables the cache); off by default with several workers, whose writes it cannot see
+HISTORY_CACHE_CONVERSATIONS = int(os.getenv(
+    "HISTORY_CACHE_CONVERSATIONS", "10000" if ROUTING_BACKEND == "local" else "0"
+))
+# Newest messages kept per conversation
+HISTORY_CACHE_TAIL = int(os.getenv("HISTORY_CACHE_TAIL", str(HISTORY_PAGE_SIZE)))
+
+Key = Tuple[int, int]
+
+
+class CachedMessage:
+    """One message, with the attributes ``history_row`` reads"""
+
+    __slots__ = ("id", "from_id", "to_id", "content", "timestamp", "delivered_at", "seen_at")
+
+    def __init__(self, id: int, from_id: int, to_id: int, content: str, timestamp: datetime,
+                 delivered_at: Optional[datetime] = None, seen_at: Optional[datetime] = None):
+        self.id = id
+        self.from_id = from_id
+        self.to_id = to_id
+        self.content = content
+        self.timestamp = timestamp
+        self.delivered_at = delivered_at
+        self.seen_at = seen_at
+
+
+def _order(row) -> tuple:
+    return (row.timestamp, row.id)
+
+
+# The row object, its three datetimes and its id -> row index entry; content is added per row
+_ROW_OVERHEAD = (
+    sys.getsizeof(CachedMessage(0, 0, 0, "", datetime.now(UTC)))
+    + 3 * sys.getsizeof(datetime.now(UTC))
+    + 100
+)
+
+
+class _Tail:
+    __slots__ = ("rows", "complete")
+
+    def __init__(self, rows: List[CachedMessage], complete: bool):
+        self.rows = rows
+        # The rows are the whole conversation, not just its newest part
+        self.complete = complete
+
+
+class HistoryCache:
+    def __init__(self, maxsize: int = HISTORY_CACHE_CONVERSATIONS, tail: int = HISTORY_CACHE_TAIL,
+                 retention_months: int = MESSAGE_RETENTION_MONTHS):
+        self.maxsize = max(0, maxsize)
+        self.tail = max(1, tail)
+        # Only Postgres archives expired months
+        self.retention_months = retention_months if async_engine.dialect.name == "postgresql" else 0
+        # Month the cutoff was last computed for, and the oldest timestamp kept
+        self._expired_through: Optional[datetime] = None
+        self._cutoff: Optional[datetime] = None
+        self.conversations: "OrderedDict[Key, _Tail]" = OrderedDict()
+        # message id -> cached row, for delivered/seen updates that only carry ids
+        self.index: Dict[int, CachedMessage] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+        self.discarded_loads = 0
+        # Conversations being read from the database, and those written meanwhile
+        self._loading: Dict[Key, int] = {}
+        self._dirty: Set[Key] = set()
+        # SQLite hands timestamps back without a timezone; cached values must match what a read returns
+        self._naive = async_engine.dialect.name == "sqlite"
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    @staticmethod
+    def key(user1_id: int, user2_id: int) -> Key:
+        return (user1_id, user2_id) if user1_id <= user2_id else (user2_id, user1_id)
+
+    def page(self, user1_id: int, user2_id: int, before: Optional[int] = None,
+             after: Optional[int] = None, limit: int = HISTORY_PAGE_SIZE) -> Optional[List[CachedMessage]]:
+        """The page ``conversation_query`` would return, or None if the tail cannot answer it exactly"""
+        if not self.enabled:
+            return None
+        if self.retention_months > 0:
+            self.expire()
+        key = self.key(user1_id, user2_id)
+        entry = self.conversations.get(key)
+        rows = self._slice(entry, before, after, limit) if entry is not None else None
+        if rows is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conversations.move_to_end(key)
+        return rows
+
+    def _slice(self, entry: _Tail, before: Optional[int], after: Optional[int],
+               limit: int) -> Optional[List[CachedMessage]]:
+        rows = entry.rows
+        if after is not None:
+            position = self._position(rows, after)
+            # Everything newer than a cached row is cached
+            return None if position is None else rows[position + 1:position + 1 + limit]
+        end = len(rows)
+        if before is not None:
+            end = self._position(rows, before)
+            if end is None:
+                return None
+        if end < limit and not entry.complete:
+            return None
+        return rows[max(0, end - limit):end]
+
+    def _position(self, rows: List[CachedMessage], message_id: int) -> Optional[int]:
+        row = self.index.get(message_id)
+        if row is None:
+            return None
+        position = bisect_left(rows, _order(row), key=_order)
+        return position if position < len(rows) and rows[position] is row else None
+
+    async def load_latest(self, db: AsyncSession, user1_id: int, user2_id: int, limit: int) -> List:
+        """Read the latest page from the database and cache the conversation's tail"""
+        key = self.key(user1_id, user2_id)
+        fetch = max(limit, self.tail)
+        self._loading[key] = self._loading.get(key, 0) + 1
+        try:
+            rows = (await db.execute(
+                conversation_query(user1_id, user2_id, limit=fetch, newest_first=True)
+            )).all()
+            rows.reverse()
+            if key in self._dirty:
+                # A write landed while reading; the rows may already be stale
+                self.discarded_loads += 1
+            else:
+                self._store(key, rows[-self.tail:], complete=len(rows) < fetch and len(rows) <= self.tail)
+        finally:
+            self._loading[key] -= 1
+            if not self._loading[key]:
+                del self._loading[key]
+                self._dirty.discard(key)
+        return rows[-limit:]
+
+    def _store(self, key: Key, rows: List, complete: bool):
+        self._drop(key)
+        if self._cutoff is not None and rows and rows[0].timestamp < self._cutoff:
+            # Read before its month was archived
+            rows = [row for row in rows if row.timestamp >= self._cutoff]
+            complete = False
+        cached = [
+            CachedMessage(row.id, row.from_id, row.to_id, row.content, row.timestamp, row.delivered_at, row.seen_at)
+            for row in rows
+        ]
+        for row in cached:
+            self.index[row.id] = row
+            self.bytes += _ROW_OVERHEAD + sys.getsizeof(row.content)
+        self.conversations[key] = _Tail(cached, complete)
+        self.loads += 1
+        while len(self.conversations) > self.maxsize:
+            self._drop(next(iter(self.conversations)))
+            self.evictions += 1
+
+    def expire(self, now: Optional[datetime] = None):
+        """
+        Drop rows older than the retention window, once per month.
+
+        Their partitions are archived by whichever worker holds the archive
+        lock; the tails that lost rows are marked incomplete, so pages
+        reaching past them read the database instead.
+        """
+        this_month = month_start(now or datetime.now(UTC))
+        if this_month == self._expired_through:
+            return
+        self._expired_through = this_month
+        self._cutoff = cutoff = self._stored(add_months(this_month, -self.retention_months))
+        for entry in self.conversations.values():
+            if not entry.rows or entry.rows[0].timestamp >= cutoff:
+                continue
+            expired = bisect_left(entry.rows, cutoff, key=lambda row: row.timestamp)
+            for row in entry.rows[:expired]:
+                self._forget(row)
+            del entry.rows[:expired]
+            entry.complete = False
+
+    def _drop(self, key: Key):
+        entry = self.conversations.pop(key, None)
+        if entry is not None:
+            for row in entry.rows:
+                self._forget(row)
+
+    def _forget(self, row: CachedMessage):
+        self.index.pop(row.id, None)
+        self.bytes -= _ROW_OVERHEAD + sys.getsizeof(row.content)
+
+    def _stored(self, value: datetime) -> datetime:
+        return value.astimezone(UTC).replace(tzinfo=None) if self._naive and value.tzinfo else value
+
+    def add_messages(self, rows: Iterable):
+        """Committed inserts (``id``, ``from_id``, ``to_id``, ``content``, ``timestamp``)"""
+        if not self.enabled:
+            return
+        for row in rows:
+            key = self.key(row.from_id, row.to_id)
+            if key in self._loading:
+                self._dirty.add(key)
+            entry = self.conversations.get(key)
+            if entry is None or row.id in self.index:
+                continue
+            if entry.rows and _order(row) < _order(entry.rows[0]) and not entry.complete:
+                # Older than the cached tail, so it belongs to the uncached part
+                continue
+            cached = CachedMessage(row.id, row.from_id, row.to_id, row.content, row.timestamp)
+            insort(entry.rows, cached, key=_order)
+            self.index[cached.id] = cached
+            self.bytes += _ROW_OVERHEAD + sys.getsizeof(cached.content)
+            if len(entry.rows) > self.tail:
+                self._forget(entry.rows.pop(0))
+                entry.complete = False
+
+    def set_delivered(self, message_ids: Iterable[int], delivered_at: datetime):
+        """Committed ``delivered_at`` updates"""
+        self._update(message_ids, "delivered_at", delivered_at)
+
+    def set_seen(self, message_ids: Iterable[int], seen_at: datetime):
+        """Committed ``seen_at`` updates (only the rows that changed)"""
+        self._update(message_ids, "seen_at", seen_at)
+
+    def _update(self, message_ids: Iterable[int], field: str, value: datetime):
+        if not self.enabled:
+            return
+        value = self._stored(value)
+        for message_id in message_ids:
+            row = self.index.get(message_id)
+            if row is not None:
+                setattr(row, field, value)
+            elif self._loading:
+                # Its conversation is unknown and may be mid-load
+                self._dirty.update(self._loading)
+
+    async def verify(self, db: AsyncSession, limit: int = 20, report: int = 10) -> Dict:
+        """
+        Compare every cached conversation with the database.
+
+        For each one, the latest page, the page before its newest message and
+        the page after its oldest cached message are read from the tail and
+        from the database and compared field by field. Writes committed while
+        it runs can show up as mismatches, so run it when traffic is quiet.
+        Hit and miss counters are left alone.
+        """
+        checked = 0
+        mismatched: List[Key] = []
+        for key in list(self.conversations):
+            entry = self.conversations.get(key)
+            latest = self._slice(entry, None, None, limit) if entry is not None else None
+            if latest is None:
+                continue
+            cursors = [{}]
+            if latest:
+                cursors += [{"before": latest[-1].id}, {"after": latest[0].id}]
+            for cursor in cursors:
+                cached = self._slice(entry, cursor.get("before"), cursor.get("after"), limit)
+                if cached is None:
+                    continue
+                newest_first = "after" not in cursor
+                rows = (await db.execute(
+                    conversation_query(*key, limit=limit, newest_first=newest_first, **cursor)
+                )).all()
+                if newest_first:
+                    rows.reverse()
+                checked += 1
+                if [history_row(row) for row in cached] != [history_row(row) for row in rows]:
+                    mismatched.append(key)
+        return {
+            "conversations": len(self.conversations),
+            "pages_checked": checked,
+            "mismatches": len(mismatched),
+            "mismatched": [list(key) for key in mismatched[:report]],
+        }
+
+    def clear(self):
+        self.conversations.clear()
+        self.index.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "conversations": len(self.conversations),
+            "maxsize": self.maxsize,
+            "messages": len(self.index),
+            "approx_bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "loads": self.loads,
+            "discarded_loads": self.discarded_loads,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+history_cache = HistoryCache()
@@ -0,0 +1,185 @@
+"""
+Per-user conversation summaries ("inbox").
+
+``conversation_summaries`` holds one row per (user, peer) with the latest
+message and the user's unread count. The write paths keep it current
+incrementally inside the same transaction as the message writes, so reading
+an inbox costs O(conversations) instead of scanning ``messages``.
+
+Rebuild every summary from the messages table with::
+
+    python -m app.chat.inbox --rebuild
+"""
+import argparse
+import asyncio
+import sys
+from collections import Counter
+from typing import Dict, Iterable, List
+
+from sqlalchemy import bindparam, case, delete, func, insert, literal, select, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import upsert
+from app.models.conversation import ConversationSummary
+from app.models.message import Message
+from app.models.user import User
+
+
+async def record_messages(db: AsyncSession, messages: Iterable) -> None:
+    """
+    Fold newly inserted messages into both participants' summaries.
+
+    ``messages`` need ``id``, ``from_id``, ``to_id``, ``content`` and ``timestamp``.
+    The receiver's unread count goes up by one per message.
+    """
+    latest: Dict[tuple, object] = {}
+    unread = Counter()
+    for message in messages:
+        views = {(message.from_id, message.to_id): False}
+        if message.to_id != message.from_id:
+            views[(message.to_id, message.from_id)] = True
+        for key, received in views.items():
+            current = latest.get(key)
+            if current is None or (message.timestamp, message.id) >= (current.timestamp, current.id):
+                latest[key] = message
+            if received:
+                unread[key] += 1
+    if not latest:
+        return
+
+    stmt = upsert(db, ConversationSummary)
+    table = ConversationSummary.__table__
+    newer = stmt.excluded.last_timestamp >= table.c.last_timestamp
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.peer_id],
+        set_={
+            # Out-of-order batches (e.g. from another worker) must not move "last message" backwards
+            "last_message_id": case((newer, stmt.excluded.last_message_id), else_=table.c.last_message_id),
+            "last_from_id": case((newer, stmt.excluded.last_from_id), else_=table.c.last_from_id),
+            "last_message": case((newer, stmt.excluded.last_message), else_=table.c.last_message),
+            "last_timestamp": case((newer, stmt.excluded.last_timestamp), else_=table.c.last_timestamp),
+            "unread_count": table.c.unread_count + stmt.excluded.unread_count,
+        },
+    )
+    await db.execute(stmt, [
+        {
+            "user_id": user_id,
+            "peer_id": peer_id,
+            "last_message_id": message.id,
+            "last_from_id": message.from_id,
+            "last_message": message.content,
+            "last_timestamp": message.timestamp,
+            "unread_count": unread[(user_id, peer_id)],
+        }
+        for (user_id, peer_id), message in latest.items()
+    ])
+
+
+async def record_seen(db: AsyncSession, reader_id: int, seen_per_sender: Dict[int, int]) -> None:
+    """Lower ``reader_id``'s unread counts by the number of messages just marked seen per sender"""
+    if not seen_per_sender:
+        return
+    table = ConversationSummary.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.user_id == bindparam("reader"), table.c.peer_id == bindparam("sender"))
+        .values(unread_count=case(
+            (table.c.unread_count > bindparam("seen"), table.c.unread_count - bindparam("seen")),
+            else_=0,
+        )),
+        [{"reader": reader_id, "sender": sender, "seen": seen} for sender, seen in seen_per_sender.items()],
+    )
+
+
+async def get_inbox(db: AsyncSession, user_id: int) -> List[dict]:
+    """Conversations for ``user_id``, most recent first"""
+    rows = (await db.execute(
+        select(ConversationSummary, User.name, User.avatar_url)
+        .join(User, User.id == ConversationSummary.peer_id)
+        .where(ConversationSummary.user_id == user_id)
+        .order_by(ConversationSummary.last_timestamp.desc())
+    )).all()
+    return [
+        {
+            "peer_id": summary.peer_id,
+            "peer_name": name,
+            "peer_avatar_url": avatar_url,
+            "last_message_id": summary.last_message_id,
+            "last_from_id": summary.last_from_id,
+            "last_message": summary.last_message,
+            "last_timestamp": summary.last_timestamp.isoformat(),
+            "unread_count": summary.unread_count,
+        }
+        for summary, name, avatar_url in rows
+    ]
+
+
+async def rebuild_summaries(db: AsyncSession) -> int:
+    """Recompute every summary from ``messages``; returns the number of rows written"""
+    sent = select(
+        Message.from_id.label("user_id"),
+        Message.to_id.label("peer_id"),
+        Message.id.label("message_id"),
+        Message.from_id.label("sender_id"),
+        Message.content.label("content"),
+        Message.timestamp.label("timestamp"),
+        literal(0).label("unread"),
+    )
+    received = select(
+        Message.to_id.label("user_id"),
+        Message.from_id.label("peer_id"),
+        Message.id.label("message_id"),
+        Message.from_id.label("sender_id"),
+        Message.content.label("content"),
+        Message.timestamp.label("timestamp"),
+        case((Message.seen_at.is_(None), 1), else_=0).label("unread"),
+    ).where(Message.from_id != Message.to_id)
+    views = union_all(sent, received).subquery()
+    partition = (views.c.user_id, views.c.peer_id)
+    ranked = select(
+        views,
+        func.row_number().over(
+            partition_by=partition, order_by=(views.c.timestamp.desc(), views.c.message_id.desc())
+        ).label("rank"),
+        func.sum(views.c.unread).over(partition_by=partition).label("unread_count"),
+    ).subquery()
+
+    await db.execute(delete(ConversationSummary))
+    result = await db.execute(
+        insert(ConversationSummary).from_select(
+            ["user_id", "peer_id", "last_message_id", "last_from_id", "last_message",
+             "last_timestamp", "unread_count"],
+            select(
+                ranked.c.user_id, ranked.c.peer_id, ranked.c.message_id, ranked.c.sender_id,
+                ranked.c.content, ranked.c.timestamp, ranked.c.unread_count,
+            ).where(ranked.c.rank == 1),
+        )
+    )
+    await db.commit()
+    return result.rowcount
+
+
+async def _main(args) -> int:
+    from app.db.database import AsyncSessionLocal, async_engine
+    from app.db.migrations import LATEST_VERSION, current_version
+
+    try:
+        async with async_engine.connect() as conn:
+            version = await conn.run_sync(current_version)
+        if version < LATEST_VERSION:
+            print(f"Schema version {version}, latest {LATEST_VERSION}; "
+                  f"run python -m app.db.migrations first", file=sys.stderr)
+            return 1
+        if args.rebuild:
+            async with AsyncSessionLocal() as db:
+                rows = await rebuild_summaries(db)
+            print(f"Rebuilt {rows} conversation summaries")
+        return 0
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Conversation summary maintenance")
+    parser.add_argument("--rebuild", action="store_true", help="recompute every summary from messages")
+    sys.exit(asyncio.run(_main(parser.parse_args())))
@@ -1,91 +1,437 @@
 from fastapi import WebSocket
-from typing import Dict, List, Optional
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
+from collections import deque
+from itertools import islice
 import asyncio
-import json
+import os
 from datetime import datetime
+from app.chat.protocol import Frame, decode, encode, frame_text
+from app.chat.routing import RoutingBackend, create_routing_backend
+from app.metrics import BROADCAST_RECIPIENTS, BROADCAST_SECONDS, SEND_FAILURES
+import time
+
+# Seconds a single socket write may take before the socket is considered dead
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+# Maximum number of frames buffered per connection before the overflow policy applies
+OUTBOUND_QUEUE_SIZE = int(os.getenv("WS_OUTBOUND_QUEUE_SIZE", "256"))
+# What to do when a connection's outbound queue is full: drop | coalesce | disconnect
+OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "coalesce")
+# Number of recent presence deltas kept for clients catching up with ?since=<version>
+PRESENCE_LOG_SIZE = int(os.getenv("PRESENCE_LOG_SIZE", "1024"))
+
+OVERFLOW_POLICIES = ("drop", "coalesce", "disconnect")
+
+# Close code sent to clients evicted for not keeping up ("try again later")
+CLOSE_TOO_SLOW = 1013
+
+# A queued frame: JSON text, or a Frame encoded for the socket's wire format when written
+Payload = Union[str, Frame]
+
+
+def presence_entry(user_id: str, user_info: dict) -> str:
+    """A user's entry in the connected-user list, encoded once as a JSON object"""
+    return encode({"user_id": user_id, **user_info})
+
+
+class Connection:
+    """
+    A connected socket: its bounded outbound queue and its presence entry.
+
+    Producers call ``enqueue`` and never await the socket; a writer task
+    drains the queue. Frames enqueued with a ``coalesce_key`` (typing,
+    presence) are ephemeral: under pressure they are dropped before any
+    essential frame, and with the ``coalesce`` policy a newer frame replaces a
+    queued one with the same key. The writer encodes each frame for the
+    socket's ``wire_format`` (json text or msgpack binary).
+
+    Most sockets are idle most of the time, so an idle connection holds no
+    queue and no task: both are created by the first frame queued and
+    released once the queue is drained. ``presence`` is the user's entry in
+    the connected-users list, already encoded as a JSON object.
+    """
+
+    __slots__ = (
+        "user_id", "websocket", "max_queue", "policy", "send_timeout", "on_failure", "wire_format",
+        "presence", "pending", "sent", "dropped", "coalesced", "closed", "_evicted", "_writer",
+    )
+
+    def __init__(
+        self,
+        user_id: str,
+        websocket: WebSocket,
+        max_queue: int = OUTBOUND_QUEUE_SIZE,
+        policy: str = OVERFLOW_POLICY,
+        send_timeout: float = SEND_TIMEOUT,
+        on_failure: Optional[Callable[["Connection"], None]] = None,
+        wire_format: str = "json",
+        presence: Optional[str] = None,
+    ):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.user_id = user_id
+        self.websocket = websocket
+        self.max_queue = max(1, max_queue)
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.on_failure = on_failure
+        self.wire_format = wire_format
+        self.presence = presence
+        self.pending: Optional[Deque[Tuple[Payload, Optional[str]]]] = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.closed = False
+        self._evicted = False
+        self._writer: Optional[asyncio.Task] = None
+
+    def enqueue(self, payload: Payload, coalesce_key: Optional[str] = None) -> bool:
+        """Queue a frame; returns False if the connection had to be evicted"""
+        if self.closed:
+            return False
+        pending = self.pending
+        if pending is None:
+            pending = self.pending = deque()
+
+        if coalesce_key is not None and self.policy == "coalesce":
+            for index, (_, key) in enumerate(pending):
+                if key == coalesce_key:
+                    pending[index] = (payload, coalesce_key)
+                    self.coalesced += 1
+                    return True
+
+        if len(pending) >= self.max_queue:
+            if self.policy == "disconnect":
+                self.evict()
+                return False
+            if coalesce_key is not None:
+                # Ephemeral frames are the first to go
+                self.dropped += 1
+                SEND_FAILURES.labels("dropped").inc()
+                return True
+            # Make room for an essential frame by dropping the oldest ephemeral one
+            for index, (_, key) in enumerate(pending):
+                if key is not None:
+                    del pending[index]
+                    self.dropped += 1
+                    SEND_FAILURES.labels("dropped").inc()
+                    break
+            else:
+                self.evict()
+                return False
+
+        pending.append((payload, coalesce_key))
+        self._wake()
+        return True
+
+    def evict(self):
+        """Stop accepting frames and close the socket once the writer notices"""
+        SEND_FAILURES.labels("overflow").inc()
+        self.closed = True
+        self._evicted = True
+        self.pending = None
+        self._wake()
+
+    def close(self):
+        """Stop the writer without touching the socket (the client already left)"""
+        self.closed = True
+        self.pending = None
+        if self._writer is not None:
+            self._writer.cancel()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.pending) if self.pending else 0
+
+    def _wake(self):
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop())
+
+    async def _write_loop(self):
+        try:
+            while not self.closed and self.pending:
+                payload, _ = self.pending.popleft()
+                if self.wire_format == "msgpack":
+                    frame = payload if isinstance(payload, Frame) else Frame(text=payload)
+                    send = self.websocket.send_bytes(frame.binary)
+                else:
+                    send = self.websocket.send_text(frame_text(payload))
+                await asyncio.wait_for(send, self.send_timeout)
+                self.sent += 1
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            SEND_FAILURES.labels("timeout" if isinstance(e, asyncio.TimeoutError) else "error").inc()
+            self.closed = True
+            self._evicted = True
+
+        # Drained (or closed): let the queue and this task go until the next frame
+        self.pending = None
+        self._writer = None
+        if self._evicted:
+            if self.on_failure:
+                self.on_failure(self)
+            try:
+                await asyncio.wait_for(
+                    self.websocket.close(code=CLOSE_TOO_SLOW), self.send_timeout
+                )
+            except Exception:
+                pass
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.user_info: Dict[str, dict] = {}  # Store user info for connected users
-
-    async def connect(self, user_id: str, websocket: WebSocket, user_info: Optional[dict] = None):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        
-        # Store user info if provided
+    def __init__(
+        self,
+        send_timeout: float = SEND_TIMEOUT,
+        max_queue: int = OUTBOUND_QUEUE_SIZE,
+        overflow_policy: str = OVERFLOW_POLICY,
+        backend: Optional[RoutingBackend] = None,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        # The registry: one Connection per connected user, holding its presence entry
+        self.active_connections: Dict[str, Connection] = {}
+        self.send_timeout = send_timeout
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.evicted_connections = 0
+        # Bound once and shared, rather than a new bound method per connection
+        self._on_failure = self._evict
+        # Users connected to other workers, as reported by the routing backend,
+        # with their encoded presence entries
+        self.backend = backend or RoutingBackend()
+        self.remote_users: Dict[str, str] = {}
+        # Presence is published as versioned deltas; clients that see a gap in
+        # versions re-sync from a snapshot instead of receiving the full list
+        # on every change.
+        self.presence_version = 0
+        self.presence_log: Deque[dict] = deque(maxlen=PRESENCE_LOG_SIZE)
+
+    async def start(self):
+        await self.backend.start(self)
+
+    async def stop(self):
+        await self.backend.stop()
+
+    def register(self, user_id: str, websocket: WebSocket, wire_format: str = "json",
+                 user_info: Optional[dict] = None) -> Connection:
+        """Attach an accepted socket to ``user_id``, replacing any previous one; ``user_info`` lists it as connected"""
+        previous = self.active_connections.get(user_id)
+        if previous:
+            previous.close()
+        # The user is here now, wherever they were before
+        self.remote_users.pop(user_id, None)
+        self.backend.forget(user_id)
+        connection = Connection(
+            user_id,
+            websocket,
+            max_queue=self.max_queue,
+            policy=self.overflow_policy,
+            send_timeout=self.send_timeout,
+            on_failure=self._on_failure,
+            wire_format=wire_format,
+            presence=presence_entry(user_id, user_info) if user_info else None,
+        )
+        self.active_connections[user_id] = connection
+        return connection
+
+    async def connect(
+        self,
+        user_id: str,
+        websocket: WebSocket,
+        user_info: Optional[dict] = None,
+        wire_format: str = "json",
+        subprotocol: Optional[str] = None,
+    ):
+        await websocket.accept(subprotocol=subprotocol)
         if user_info:
-            self.user_info[user_id] = {
+            user_info = {
                 **user_info,
                 "connected_at": datetime.utcnow().isoformat(),
                 "status": "online"
             }
-        
-        # Broadcast user connected event
-        await self.broadcast_json({
-            "event": "user_connected",
-            "user_id": user_id,
-            "user_info": self.user_info.get(user_id, {}),
-            "connected_users": self.get_connected_users()
-        })
-
-    def disconnect(self, user_id: str):
-        self.active_connections.pop(user_id, None)
-        self.user_info.pop(user_id, None)
-
-    async def send_personal_message(self, message: str, user_id: str):
-        websocket = self.active_connections.get(user_id)
-        if websocket:
-            try:
-                await websocket.send_text(message)
-            except Exception:
-                # Remove disconnected user
-                self.disconnect(user_id)
+        self.register(user_id, websocket, wire_format, user_info)
 
-    async def broadcast_json(self, data: dict):
-        disconnected_users = []
-        for user_id, websocket in self.active_connections.items():
-            try:
-                await websocket.send_text(json.dumps(data))
-            except Exception:
-                disconnected_users.append(user_id)
-        
-        # Clean up disconnected users
-        for user_id in disconnected_users:
-            self.disconnect(user_id)
+        delta = self._presence_delta("user_connected", user_id, user_info or {})
 
-    def get_connected_users(self) -> List[dict]:
-        """Return list of connected users with their info"""
-        return [
-            {
-                "user_id": user_id,
-                **user_info
-            }
-            for user_id, user_info in self.user_info.items()
-            if user_id in self.active_connections
+        # The new client starts from a snapshot, everyone else gets the delta
+        await self.send_personal_message(self.get_presence_snapshot(), user_id)
+        await self._broadcast_delta(delta, exclude=user_id)
+        await self.backend.publish_presence("user_connected", user_id, user_info or {})
+
+    async def announce_disconnect(self, user_id: str):
+        """Broadcast that ``user_id`` went offline"""
+        delta = self._presence_delta("user_disconnected", user_id)
+        await self._broadcast_delta(delta)
+        await self.backend.publish_presence("user_disconnected", user_id)
+
+    async def apply_remote_presence(self, event: str, user_id: str, user_info: Optional[dict]):
+        """Mirror a presence change that happened on another worker"""
+        if event == "user_disconnected":
+            if self.remote_users.pop(user_id, None) is None:
+                return
+            connection = self.active_connections.get(user_id)
+            if connection is not None:
+                # The other worker released the registry entry, but the user is still here
+                user_info = decode(connection.presence) if connection.presence else {}
+                user_info.pop("user_id", None)
+                await self.backend.publish_presence("user_connected", user_id, user_info)
+                return
+            delta = self._presence_delta(event, user_id)
+        else:
+            user_info = user_info or {}
+            self.remote_users[user_id] = presence_entry(user_id, user_info)
+            if user_id in self.active_connections:
+                return
+            delta = self._presence_delta(event, user_id, user_info)
+        await self._broadcast_delta(delta)
+
+    def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None) -> bool:
+        """Forget ``user_id``; with ``websocket`` only if it is still the active socket"""
+        connection = self.active_connections.get(user_id)
+        if connection is None or (websocket is not None and connection.websocket is not websocket):
+            return False
+        del self.active_connections[user_id]
+        connection.close()
+        return True
+
+    def _evict(self, connection: Connection):
+        if self.active_connections.get(connection.user_id) is connection:
+            self.active_connections.pop(connection.user_id, None)
+            self.evicted_connections += 1
+
+    async def send_personal_message(self, message: Payload, user_id: str, coalesce_key: Optional[str] = None) -> bool:
+        """Queue ``message`` for ``user_id`` on this worker or route it to theirs"""
+        if user_id in self.active_connections:
+            return await self.deliver_local(user_id, message, coalesce_key)
+        if user_id in self.remote_users:
+            return await self.backend.send(user_id, frame_text(message), coalesce_key)
+        return False
+
+    async def deliver_local(self, user_id: str, message: Payload, coalesce_key: Optional[str] = None) -> bool:
+        connection = self.active_connections.get(user_id)
+        if connection is None:
+            return False
+        if not connection.enqueue(message, coalesce_key):
+            self._evict(connection)
+            return False
+        return True
+
+    async def broadcast_json(self, data: dict, coalesce_key: Optional[str] = None, exclude: Optional[str] = None):
+        # Encode once per wire format in use, not once per recipient
+        await self.broadcast_text(Frame(data), coalesce_key, exclude)
+
+    async def broadcast_text(self, payload: Payload, coalesce_key: Optional[str] = None, exclude: Optional[str] = None):
+        """Queue an already-encoded payload on every connected socket.
+
+        Nothing here waits on a socket: each connection's writer task delivers
+        the frame, so a slow client only ever fills its own queue.
+        """
+        started = time.perf_counter()
+        connections = list(self.active_connections.items())
+        overflowed = [
+            connection
+            for user_id, connection in connections
+            if user_id != exclude and not connection.enqueue(payload, coalesce_key)
         ]
+        BROADCAST_RECIPIENTS.observe(len(connections) - (exclude in self.active_connections))
+        BROADCAST_SECONDS.observe(time.perf_counter() - started)
+        # Clean up connections that could not keep up
+        for connection in overflowed:
+            self._evict(connection)
+
+    def get_queue_stats(self) -> dict:
+        """Outbound queue depth and drop counters across all connections"""
+        depths = [c.queue_depth for c in self.active_connections.values()]
+        formats: Dict[str, int] = {}
+        for connection in self.active_connections.values():
+            formats[connection.wire_format] = formats.get(connection.wire_format, 0) + 1
+        return {
+            "policy": self.overflow_policy,
+            "max_queue": self.max_queue,
+            "connections": len(depths),
+            "total_depth": sum(depths),
+            "max_depth": max(depths, default=0),
+            "dropped": sum(c.dropped for c in self.active_connections.values()),
+            "coalesced": sum(c.coalesced for c in self.active_connections.values()),
+            "evicted_connections": self.evicted_connections,
+            "wire_formats": formats,
+        }
+
+    def get_connected_users(self) -> List[dict]:
+        """Return list of connected users with their info, across all workers"""
+        return decode(self.connected_users_json())
+
+    def connected_users_json(self) -> str:
+        """The connected-user list as a JSON array, joined from the encoded entries"""
+        entries = [c.presence for c in self.active_connections.values() if c.presence is not None]
+        entries.extend(
+            entry for user_id, entry in self.remote_users.items() if user_id not in self.active_connections
+        )
+        return "[" + ",".join(entries) + "]"
+
+    def _presence_delta(self, event: str, user_id: str, user_info: Optional[dict] = None) -> dict:
+        """Record a presence change under the next version and return its event"""
+        self.presence_version += 1
+        delta = {"event": event, "version": self.presence_version, "user_id": user_id}
+        if user_info is not None:
+            delta["user_info"] = {"user_id": user_id, **user_info}
+        self.presence_log.append(delta)
+        return delta
+
+    async def _broadcast_delta(self, delta: dict, exclude: Optional[str] = None):
+        """
+        Send a presence delta to every local socket.
+
+        Its key is unique to its version: under pressure the delta may be
+        dropped, and the client re-syncs from the version gap, but it is never
+        replaced by a later delta for the same user, which would skip a
+        version or deliver them out of order.
+        """
+        await self.broadcast_json(delta, coalesce_key=f"presence:{delta['version']}", exclude=exclude)
+
+    def get_presence_snapshot(self) -> Frame:
+        """Full connected-user list tagged with the current presence version"""
+        return Frame(text=(
+            f'{{"event":"connected_users","version":{self.presence_version},'
+            f'"users":{self.connected_users_json()}}}'
+        ))
+
+    def get_presence_changes(self, since: int) -> Optional[List[dict]]:
+        """Deltas newer than ``since``, or None if the log no longer reaches back that far"""
+        if since > self.presence_version or since < 0:
+            return None
+        if since == self.presence_version:
+            return []
+        if not self.presence_log or self.presence_log[0]["version"] > since + 1:
+            return None
+        start = since + 1 - self.presence_log[0]["version"]
+        return list(islice(self.presence_log, start, None))
 
     def is_user_connected(self, user_id: str) -> bool:
-        """Check if a specific user is connected"""
-        return user_id in self.active_connections
+        """Check if a specific user is connected to any worker"""
+        return user_id in self.active_connections or user_id in self.remote_users
 
     def get_connected_users_count(self) -> int:
         """Get the number of connected users"""
-        return len(self.active_connections)
+        return len(self.active_connections) + sum(
+            1 for user_id in self.remote_users if user_id not in self.active_connections
+        )
 
     async def update_user_info(self, user_id: str, user_info: dict):
         """Update user information for a connected user"""
-        if user_id in self.active_connections:
-            self.user_info[user_id] = {
-                **self.user_info.get(user_id, {}),
+        connection = self.active_connections.get(user_id)
+        if connection is not None:
+            user_info = {
+                **(decode(connection.presence) if connection.presence else {}),
                 **user_info,
                 "last_updated": datetime.utcnow().isoformat()
             }
-            
-            # Broadcast updated user list
-            await self.broadcast_json({
-                "event": "users_updated",
-                "connected_users": self.get_connected_users()
-            })
-
-manager = ConnectionManager()
+            user_info.pop("user_id", None)
+            connection.presence = presence_entry(user_id, user_info)
+
+            # Broadcast the updated entry only
+            delta = self._presence_delta("users_updated", user_id, user_info)
+            await self._broadcast_delta(delta)
+            await self.backend.publish_presence("users_updated", user_id, user_info)
+
+manager = ConnectionManager(backend=create_routing_backend())
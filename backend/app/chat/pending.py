@@ -0,0 +1,72 @@
+"""
+Draining undelivered messages when a user connects.
+
+Each chunk is claimed with one ``UPDATE ... RETURNING`` that sets
+``delivered_at`` and hands back the rows it changed, so two sockets for the
+same user racing on connect can never both deliver the same message.
+"""
+import os
+import time
+from datetime import datetime
+from typing import AsyncIterator, List
+
+from sqlalchemy import func, select, update
+
+from app.chat.history_cache import history_cache
+from app.db.database import AsyncSessionLocal
+from app.metrics import DB_COMMIT_SECONDS
+from app.models.message import Message
+
+# Messages claimed (and sent as one pending_messages frame) per statement
+PENDING_BATCH_SIZE = int(os.getenv("PENDING_BATCH_SIZE", "500"))
+
+
+async def claim_pending(db, user_id: int, delivered_at: datetime, limit: int) -> List:
+    """Mark up to ``limit`` of the oldest undelivered messages for ``user_id`` delivered and return them"""
+    oldest = (
+        select(Message.id, Message.timestamp)
+        .where(Message.to_id == user_id, Message.delivered_at.is_(None))
+        .order_by(Message.timestamp, Message.id)
+        .limit(limit)
+        .subquery()
+    )
+    rows = (await db.execute(
+        update(Message)
+        .where(
+            Message.id.in_(select(oldest.c.id)),
+            # Lets Postgres skip the monthly partitions older than anything being claimed
+            Message.timestamp >= select(func.min(oldest.c.timestamp)).scalar_subquery(),
+            # Re-checking delivered_at lets a concurrent drain skip rows already claimed
+            Message.delivered_at.is_(None),
+        )
+        .values(delivered_at=delivered_at)
+        .returning(Message.id, Message.from_id, Message.content, Message.timestamp)
+        .execution_options(synchronize_session=False)
+    )).all()
+    await db.commit()
+    history_cache.set_delivered([row.id for row in rows], delivered_at)
+    # RETURNING order is unspecified
+    return sorted(rows, key=lambda row: (row.timestamp, row.id))
+
+
+async def drain_pending(user_id: int, delivered_at: datetime,
+                        batch_size: int = PENDING_BATCH_SIZE) -> AsyncIterator[List]:
+    """Yield chunks of newly delivered messages, oldest first, until none are left"""
+    while True:
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            rows = await claim_pending(db, user_id, delivered_at, batch_size)
+        DB_COMMIT_SECONDS.labels("pending_drain").observe(time.perf_counter() - started)
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+
+
+def pending_row(row) -> dict:
+    return {
+        "from": str(row.from_id),
+        "message_id": row.id,
+        "message": row.content,
+        "timestamp": row.timestamp,
+    }
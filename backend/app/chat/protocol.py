@@ -0,0 +1,237 @@
+"""
+Wire format of the chat WebSocket.
+
+Outbound events are slotted dataclasses, one per event shape, encoded by
+``encode``. Datetimes are left as datetimes and serialized by the codec, so
+building an event costs no ``isoformat()`` calls. With ``orjson`` installed
+it encodes dataclasses, datetimes and dicts natively; otherwise the stdlib
+``json`` module is used with compact separators. ``WS_JSON_CODEC=json``
+forces the fallback.
+
+Inbound frames are decoded with ``decode`` and routed by their ``event`` key
+through a dispatch table (see ``app.chat.routes``).
+
+JSON text frames are the default wire format. A client may instead ask for
+MessagePack binary frames, in both directions, with the ``chat.msgpack``
+subprotocol (or ``?format=msgpack``). Outbound events are queued as
+``Frame`` objects, which encode lazily and at most once per wire format, so
+a broadcast to a mix of clients costs one encode per format in use.
+Compression is the WebSocket ``permessage-deflate`` extension, negotiated by
+the server (uvicorn) with any client that offers it.
+"""
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, ClassVar, Dict, List, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# auto | orjson | json
+JSON_CODEC = os.getenv("WS_JSON_CODEC", "auto")
+# Wire formats clients may negotiate; JSON is always available
+WIRE_FORMATS = os.getenv("WS_WIRE_FORMATS", "json,msgpack")
+
+msgpack = None
+# Only imported when it may be negotiated
+if "msgpack" in {name.strip() for name in WIRE_FORMATS.split(",")}:
+    try:
+        import msgpack
+    except ImportError:  # pragma: no cover - optional wire format
+        pass
+
+# Subprotocol names are "chat.<format>", e.g. "chat.msgpack"
+SUBPROTOCOL_PREFIX = "chat."
+
+
+class Event:
+    """Base of outbound events; subclasses are ``@dataclass(slots=True)`` with an ``event`` field"""
+
+    __slots__ = ()
+    # Field name -> wire key, for keys that are Python keywords ("from", "for")
+    WIRE_NAMES: ClassVar[Dict[str, str]] = {}
+
+    def as_dict(self) -> Dict[str, Any]:
+        names = self.WIRE_NAMES
+        return {names.get(name, name): getattr(self, name) for name in self.__slots__}
+
+
+@dataclass(slots=True)
+class PendingMessages(Event):
+    messages: List[dict]
+    delivered_at: datetime
+    event: str = field(default="pending_messages", init=False)
+
+
+@dataclass(slots=True)
+class MessagesDelivered(Event):
+    message_ids: List[int]
+    delivered_at: datetime
+    event: str = field(default="messages_delivered", init=False)
+
+
+@dataclass(slots=True)
+class Error(Event):
+    message: str
+    errors: List[str]
+    event: str = field(default="error", init=False)
+
+
+@dataclass(slots=True)
+class RateLimited(Event):
+    WIRE_NAMES = {"for_event": "for"}
+
+    for_event: Any
+    retry_after: float
+    event: str = field(default="rate_limited", init=False)
+
+
+@dataclass(slots=True)
+class MessageSent(Event):
+    message_id: int
+    to: Any
+    message: str
+    timestamp: datetime
+    event: str = field(default="message_sent", init=False)
+
+
+@dataclass(slots=True)
+class NewMessage(Event):
+    WIRE_NAMES = {"sender": "from"}
+
+    sender: str
+    message_id: int
+    message: str
+    timestamp: datetime
+    event: str = field(default="new_message", init=False)
+
+
+@dataclass(slots=True)
+class MessageDelivered(Event):
+    message_id: int
+    timestamp: datetime
+    delivered_at: datetime
+    event: str = field(default="message_delivered", init=False)
+
+
+@dataclass(slots=True)
+class MessageSeen(Event):
+    message_id: int
+    seen_at: datetime
+    event: str = field(default="message_seen", init=False)
+
+
+@dataclass(slots=True)
+class MessagesSeenUpTo(Event):
+    """High-water mark: every message up to ``up_to`` was seen by ``reader_id``"""
+
+    up_to: int
+    reader_id: str
+    seen_at: datetime
+    event: str = field(default="message_seen", init=False)
+
+
+@dataclass(slots=True)
+class Typing(Event):
+    WIRE_NAMES = {"sender": "from"}
+
+    sender: str
+    is_typing: bool
+    event: str = field(default="typing", init=False)
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, Event):
+        return obj.as_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None and JSON_CODEC != "json":
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj, default=_default).decode()
+
+    decode = orjson.loads
+    CODEC = "orjson"
+else:
+    if JSON_CODEC == "orjson":
+        raise ImportError("WS_JSON_CODEC=orjson but orjson is not installed")
+    _dumps = json.JSONEncoder(separators=(",", ":"), default=_default).encode
+    decode = json.loads
+    CODEC = "json"
+
+
+def encode(obj) -> str:
+    """Serialize an event (or any JSON-able value) to the text of one frame"""
+    if isinstance(obj, Event) and obj.WIRE_NAMES:
+        obj = obj.as_dict()
+    return _dumps(obj)
+
+
+def event_name(frame: Any, default: str = "message") -> Any:
+    """The ``event`` of a decoded frame; frames without one are chat messages"""
+    return frame.get("event", default) if isinstance(frame, dict) else None
+
+
+if msgpack is not None:
+    def pack(obj) -> bytes:
+        """Serialize an event (or any JSON-able value) to the bytes of one MessagePack frame"""
+        return msgpack.packb(obj, default=_default)
+
+    unpack = msgpack.unpackb
+else:  # pragma: no cover - msgpack not installed
+    pack = unpack = None
+
+
+def available_formats() -> Tuple[str, ...]:
+    """Wire formats enabled by ``WS_WIRE_FORMATS`` whose codec is installed"""
+    enabled = {name.strip() for name in WIRE_FORMATS.split(",")}
+    return ("json",) + (("msgpack",) if "msgpack" in enabled and msgpack is not None else ())
+
+
+def negotiate_format(subprotocols: List[str], requested: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """
+    Pick a socket's wire format: (format, subprotocol to accept, or None).
+
+    The first offered ``chat.<format>`` subprotocol the server supports wins,
+    then ``?format=``; anything else gets JSON, so old clients are unaffected.
+    """
+    formats = available_formats()
+    for subprotocol in subprotocols:
+        name = subprotocol[len(SUBPROTOCOL_PREFIX):] if subprotocol.startswith(SUBPROTOCOL_PREFIX) else None
+        if name in formats:
+            return name, subprotocol
+    return (requested if requested in formats else "json"), None
+
+
+class Frame:
+    """One outbound event, encoded on first use and at most once per wire format"""
+
+    __slots__ = ("value", "_text", "_binary")
+
+    def __init__(self, value: Any = None, text: Optional[str] = None):
+        self.value = value
+        self._text = text
+        self._binary: Optional[bytes] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = encode(self.value)
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            # Frames relayed from another worker arrive as JSON text only
+            self._binary = pack(decode(self._text) if self.value is None else self.value)
+        return self._binary
+
+
+def frame_text(payload: Union[str, Frame]) -> str:
+    """The JSON text of a queued payload, for routing it to another worker"""
+    return payload if isinstance(payload, str) else payload.text
@@ -0,0 +1,273 @@
+"""
+Per-user rate limiting for WebSocket events.
+
+Each (user, event) pair has a token bucket: ``rate`` tokens per second up to
+``burst``. ``LocalRateLimiter`` keeps the buckets in this worker's memory;
+``RedisRateLimiter`` keeps them in Redis and updates them with one atomic
+script per event, so the limit holds across workers. If Redis is unreachable
+the Redis limiter falls back to local buckets instead of blocking chat.
+
+A frame over its limit also pauses reading from that socket until a token is
+available, so a flooding client is slowed by TCP backpressure instead of
+being read and rejected as fast as it can send. Over-limit typing frames are
+not rejected; ``TypingCoalescer`` merges them instead.
+"""
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.chat.routing import REDIS_PREFIX, REDIS_URL, ROUTING_BACKEND
+from app.utils.security import rate_limit_key
+
+# Per-IP limits on the HTTP endpoints (slowapi); "false" turns them off, e.g. for load tests
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# local | redis; defaults to wherever cross-worker routing lives
+RATE_LIMIT_BACKEND = os.getenv("WS_RATE_LIMIT_BACKEND", ROUTING_BACKEND)
+# event=rate:burst pairs, rate in events per second; "other" covers unlisted events
+RATE_LIMITS = os.getenv(
+    "WS_RATE_LIMITS",
+    "message=5:20,typing=10:20,message_seen=20:60,mark_messages_seen=5:20,get_connected_users=1:5,other=5:20",
+)
+# Longest a socket's reader pauses after a rate-limited frame
+RATE_LIMIT_MAX_PAUSE = float(os.getenv("WS_RATE_LIMIT_MAX_PAUSE", "1"))
+# Seconds between sweeps of local buckets that have refilled completely (and of idle typing state)
+RATE_LIMIT_SWEEP_INTERVAL = float(os.getenv("WS_RATE_LIMIT_SWEEP_INTERVAL", "60"))
+# Typing changes forwarded per sender and recipient at most once per this many seconds
+TYPING_INTERVAL = float(os.getenv("WS_TYPING_INTERVAL", "0.5"))
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    limits = {}
+    for item in spec.split(","):
+        event, _, limit = item.partition("=")
+        if event.strip() and limit.strip():
+            rate, _, burst = limit.partition(":")
+            limits[event.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class LocalRateLimiter:
+    """
+    Token buckets in process memory.
+
+    Buckets are kept across reconnects, so reconnecting does not refill them;
+    a periodic sweep drops the ones that would be full again anyway.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 sweep_interval: float = RATE_LIMIT_SWEEP_INTERVAL):
+        self.limits = parse_limits(RATE_LIMITS) if limits is None else limits
+        # user_id -> event -> [tokens, last refill]
+        self.buckets: Dict[str, Dict[str, List[float]]] = {}
+        self.limited = 0
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+
+    def bucket_name(self, event) -> str:
+        return event if isinstance(event, str) and event in self.limits else "other"
+
+    def limit_for(self, event) -> Optional[Tuple[str, float, float]]:
+        """(bucket name, rate, burst) for an event, or None if it is not limited"""
+        name = self.bucket_name(event)
+        limit = self.limits.get(name)
+        return (name, *limit) if limit else None
+
+    async def hit(self, user_id: str, event) -> float:
+        """Take a token for ``event``; returns 0 if allowed, else seconds until one is available"""
+        return self.take(user_id, event)
+
+    def take(self, user_id: str, event) -> float:
+        limit = self.limit_for(event)
+        if limit is None:
+            return 0.0
+        name, rate, burst = limit
+        now = time.monotonic()
+        if now - self._last_sweep > self.sweep_interval:
+            self.sweep(now)
+        bucket = self.buckets.setdefault(user_id, {}).get(name)
+        if bucket is None:
+            bucket = self.buckets[user_id][name] = [burst, now]
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        self.limited += 1
+        return (1 - tokens) / rate
+
+    def sweep(self, now: float):
+        """Drop buckets idle long enough to have refilled; a new bucket starts full anyway"""
+        self._last_sweep = now
+        for user_id, buckets in list(self.buckets.items()):
+            for name, (tokens, updated) in list(buckets.items()):
+                rate, burst = self.limits[name]
+                if tokens + (now - updated) * rate >= burst:
+                    del buckets[name]
+            if not buckets:
+                del self.buckets[user_id]
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> Dict:
+        return {"users": len(self.buckets), "limited": self.limited}
+
+
+# Refill and take one token from the bucket in KEYS[1], timed by the Redis clock
+# so every worker agrees. Returns "0" if allowed, else the seconds to wait.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisRateLimiter(LocalRateLimiter):
+    """Token buckets shared by every worker; keys expire once a bucket would be full again"""
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = REDIS_PREFIX,
+                 limits: Optional[Dict[str, Tuple[float, float]]] = None, client=None):
+        super().__init__(limits)
+        from redis.exceptions import RedisError
+
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url)
+        self.redis = client
+        self.prefix = prefix
+        self.fallbacks = 0
+        self._errors = (RedisError, OSError)
+        self._take = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def hit(self, user_id: str, event) -> float:
+        limit = self.limit_for(event)
+        if limit is None:
+            return 0.0
+        name, rate, burst = limit
+        try:
+            wait = float(await self._take(
+                keys=[f"{self.prefix}:{rate_limit_key(user_id, name)}"], args=[rate, burst],
+            ))
+        except self._errors:
+            # Keep limiting on this worker alone until Redis is back
+            self.fallbacks += 1
+            return self.take(user_id, event)
+        if wait:
+            self.limited += 1
+        return wait
+
+    async def stop(self):
+        await self.redis.aclose()
+
+    def stats(self) -> Dict:
+        return {**super().stats(), "redis_fallbacks": self.fallbacks}
+
+
+def create_rate_limiter(name: str = RATE_LIMIT_BACKEND) -> LocalRateLimiter:
+    """Build the limiter selected by ``WS_RATE_LIMIT_BACKEND`` (local | redis)"""
+    if name == "redis":
+        return RedisRateLimiter()
+    if name == "local":
+        return LocalRateLimiter()
+    raise ValueError(f"Unknown rate limit backend: {name}")
+
+
+class _TypingState:
+    __slots__ = ("sent", "sent_at", "latest", "timer")
+
+    def __init__(self):
+        self.sent: Optional[bool] = None
+        self.sent_at = float("-inf")
+        self.latest: Optional[bool] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class TypingCoalescer:
+    """
+    Forward at most one typing change per sender and recipient every ``interval`` seconds.
+
+    The first change goes out immediately. Changes arriving within the
+    interval only replace the pending state, and the latest one is sent when
+    the interval ends unless the recipient already has it, so a client
+    toggling its indicator in a loop costs the recipient two frames per
+    interval at most and never leaves a stale indicator behind.
+
+    State past its interval behaves exactly like none at all, so a periodic
+    sweep drops it; what is kept is bounded by recent typing, not by every
+    recipient a sender ever named.
+    """
+
+    def __init__(self, forward: Callable[[str, str, bool], Awaitable], interval: float = TYPING_INTERVAL,
+                 sweep_interval: float = RATE_LIMIT_SWEEP_INTERVAL):
+        self.forward = forward
+        self.interval = interval
+        # sender -> recipient -> state
+        self.peers: Dict[str, Dict[str, _TypingState]] = {}
+        self.coalesced = 0
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+        self._tasks = set()
+
+    async def submit(self, from_id: str, to_id: str, is_typing: bool):
+        now = time.monotonic()
+        if now - self._last_sweep > self.sweep_interval:
+            self.sweep(now)
+        state = self.peers.setdefault(from_id, {}).get(to_id)
+        if state is None:
+            state = self.peers[from_id][to_id] = _TypingState()
+        elapsed = now - state.sent_at
+        if state.timer is not None or elapsed < self.interval:
+            self.coalesced += 1
+            state.latest = is_typing
+            if state.timer is None and is_typing != state.sent:
+                state.timer = asyncio.get_running_loop().call_later(
+                    self.interval - elapsed, self._flush, from_id, to_id, state
+                )
+            return
+        await self._send(from_id, to_id, state, is_typing)
+
+    async def _send(self, from_id: str, to_id: str, state: _TypingState, is_typing: bool):
+        state.sent = is_typing
+        state.sent_at = time.monotonic()
+        await self.forward(from_id, to_id, is_typing)
+
+    def _flush(self, from_id: str, to_id: str, state: _TypingState):
+        state.timer = None
+        if state.latest != state.sent:
+            task = asyncio.create_task(self._send(from_id, to_id, state, state.latest))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def sweep(self, now: float):
+        """Drop state with nothing pending whose interval is over; a new state would act the same"""
+        self._last_sweep = now
+        for from_id, states in list(self.peers.items()):
+            for to_id, state in list(states.items()):
+                if state.timer is None and now - state.sent_at >= self.interval:
+                    del states[to_id]
+            if not states:
+                del self.peers[from_id]
+
+    def stats(self) -> Dict:
+        return {"coalesced": self.coalesced, "pairs": sum(len(states) for states in self.peers.values())}
+
+    def forget(self, from_id: str):
+        for state in self.peers.pop(from_id, {}).values():
+            if state.timer is not None:
+                state.timer.cancel()
@@ -1,283 +1,375 @@
+import asyncio
 import json
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
+import os
+import time
+from collections import defaultdict, deque
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request, Query
+from fastapi.responses import Response, StreamingResponse
+from starlette.websockets import WebSocketState
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.auth.google import google_verifier
+from app.auth.profiles import profile_cache
+from app.chat.inbox import get_inbox
+from app.chat.history import HISTORY_MAX_PAGE_SIZE, HISTORY_PAGE_SIZE, conversation_query, history_row
+from app.chat.history_cache import history_cache
 from app.chat.manager import manager
-from app.db.database import get_db
-from app.models.message import Message
-from app.models.user import User
-from datetime import datetime, timedelta
+from app.chat.pending import drain_pending, pending_row
+from app.chat.protocol import (
+    Error, MessageDelivered, MessageSeen, MessageSent, MessagesDelivered, MessagesSeenUpTo,
+    Frame, NewMessage, PendingMessages, RateLimited, Typing, decode, event_name, negotiate_format, unpack,
+)
+from app.chat.ratelimit import RATE_LIMIT_ENABLED, RATE_LIMIT_MAX_PAUSE, TypingCoalescer, create_rate_limiter
+from app.db.database import AsyncSessionLocal, get_async_db
+from app.db.write_pipeline import MAX_ID, write_pipeline
+from app.log import get_logger
+from app.metrics import EVENTS_RATE_LIMITED, PENDING_DRAINED, VALIDATION_SECONDS, observe_event
+from datetime import datetime, UTC
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
 from slowapi import Limiter
 from slowapi.util import get_remote_address
-from app.utils.security import validate_user_input, validate_message_content
+from app.utils.sanitizer_pool import sanitizer_pool
+from app.utils.security import cache_stats, validate_user_input
 
 # Initialize rate limiter for chat routes
-limiter = Limiter(key_func=get_remote_address)
+limiter = Limiter(key_func=get_remote_address, enabled=RATE_LIMIT_ENABLED)
+
+# Messages from one user that may wait for their commit before their socket stops reading
+MESSAGE_PIPELINE_DEPTH = int(os.getenv("WS_MESSAGE_PIPELINE_DEPTH", "32"))
+
+# Per-message categories; each can be sampled through LOG_SAMPLE_RATES
+message_log = get_logger("app.chat.message")
+delivery_log = get_logger("app.chat.delivery")
+security_log = get_logger("app.chat.security")
+
+
+async def _send_typing(from_id: str, to_id: str, is_typing: bool):
+    await manager.send_personal_message(
+        Frame(Typing(from_id, is_typing)), to_id, coalesce_key=f"typing:{from_id}"
+    )
+
+
+def _frame_id(frame: dict, field: str) -> Optional[int]:
+    """``frame[field]`` as a positive row id, or None if it is missing or not one"""
+    value = frame.get(field)
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    return value if 0 < value <= MAX_ID else None
+
+
+# Each user's messages between queueing their insert and notifying both sides, oldest first
+_deliveries: Dict[str, Deque[asyncio.Task]] = {}
+
+
+async def _pipeline_message(user_id: str, to_id: int, content: str, stored: asyncio.Future):
+    """
+    Notify both sides of a queued message once it commits, without holding up the socket.
+
+    The socket goes on reading while its earlier messages commit, so one
+    sender is not limited to a commit per message. Each message still waits
+    for the one before it, keeping notifications in the order they were sent.
+    """
+    pending = _deliveries.setdefault(user_id, deque())
+    if len(pending) >= MESSAGE_PIPELINE_DEPTH:
+        await asyncio.wait([pending[0]])
+    task = asyncio.create_task(_deliver_message(user_id, to_id, content, stored, pending[-1] if pending else None))
+    pending.append(task)
+
+    def done(_):
+        pending.remove(task)
+        if not pending and _deliveries.get(user_id) is pending:
+            del _deliveries[user_id]
+        if not task.cancelled() and task.exception() is not None:
+            delivery_log.error("Message notification failed", exc_info=task.exception(), extra={
+                "from_id": user_id, "to_id": to_id,
+            })
+
+    task.add_done_callback(done)
+
+
+async def _reject(user_id: str, event: str, errors: List[str]):
+    """Answer a malformed frame with an error instead of failing the receive loop"""
+    security_log.warning("Invalid frame", extra={"user_id": user_id, "event": event, "errors": errors})
+    await manager.send_personal_message(Frame(Error(f"Invalid {event} frame", errors)), user_id)
+
+
+# Token buckets per user and event; typing is coalesced instead of limited
+rate_limiter = create_rate_limiter()
+typing_coalescer = TypingCoalescer(_send_typing)
 
 chat_router = APIRouter()
 
 
 @chat_router.websocket("/ws/chat/{user_id}")
-async def chat(websocket: WebSocket, user_id: str, db: Session = Depends(get_db)):
-    # Get user info from database
-    user = db.query(User).filter(User.id == int(user_id)).first()
-    if not user:
+async def chat(websocket: WebSocket, user_id: str):
+    # Each DB operation checks a connection out of the async pool only for its
+    # own duration, so idle sockets never pin a pooled connection.
+    # Get user info, from the profile cache when possible
+    profile = await profile_cache.get(int(user_id))
+    if not profile:
         await websocket.close(code=4004, reason="User not found")
         return
     
-    user_info = {
-        "id": user.id,
-        "name": user.name,
-        "avatar_url": user.avatar_url,
-        "google_id": user.google_id
-    }
-    
-    await manager.connect(user_id, websocket, user_info)
-    
-    # Deliver pending messages when user connects
-    pending_messages = db.query(Message).filter(
-        Message.to_id == int(user_id),
-        Message.delivered_at.is_(None)
-    ).all()
-    
-    print(f"[PENDING] User {user_id} connected, found {len(pending_messages)} pending messages")
-    
-    if pending_messages:
-        # Mark all as delivered with unique timestamps
-        base_time = datetime.utcnow()
-        for i, msg in enumerate(pending_messages):
-            msg.delivered_at = base_time + timedelta(microseconds=i)
-        
-        # Commit all changes at once
-        db.commit()
-        print(f"[PENDING] Marked {len(pending_messages)} messages as delivered at {base_time}")
+    user_info = profile.as_dict()
+
+    # JSON text frames unless the client asked for another wire format
+    wire_format, subprotocol = negotiate_format(
+        websocket.scope.get("subprotocols", []), websocket.query_params.get("format")
+    )
+    await manager.connect(user_id, websocket, user_info, wire_format, subprotocol)
+    if wire_format == "msgpack":
+        receive, loads = websocket.receive_bytes, unpack
+    else:
+        receive, loads = websocket.receive_text, decode
     
-    for msg in pending_messages:
-        print(f"[PENDING] Delivering pending message {msg.id} from {msg.from_id} to {user_id}")
-        
-        # Send the pending message
+    # Deliver pending messages when user connects, a chunk per frame
+    delivered_at = datetime.now(UTC)
+    delivered_by_sender = defaultdict(list)
+    drained = 0
+    async for rows in drain_pending(int(user_id), delivered_at):
+        delivery_log.info("Delivering pending messages", extra={"user_id": user_id, "count": len(rows)})
+        drained += len(rows)
         await manager.send_personal_message(
-            json.dumps(
-                {
-                    "event": "new_message",
-                    "from": str(msg.from_id),
-                    "message_id": msg.id,
-                    "message": msg.content,
-                    "timestamp": msg.timestamp.isoformat(),
-                }
-            ),
-            user_id,
+            Frame(PendingMessages([pending_row(row) for row in rows], delivered_at)), user_id
         )
-        
-        # Notify sender that message was delivered
-        if manager.is_user_connected(str(msg.from_id)):
-            print(f"[PENDING] Notifying sender {msg.from_id} that message {msg.id} was delivered")
+        for row in rows:
+            delivered_by_sender[str(row.from_id)].append(row.id)
+    PENDING_DRAINED.observe(drained)
+
+    # One delivery receipt per sender rather than per message
+    for sender_id, message_ids in delivered_by_sender.items():
+        if manager.is_user_connected(sender_id):
             await manager.send_personal_message(
-                json.dumps(
-                    {
-                        "event": "message_delivered",
-                        "message_id": msg.id,
-                        "timestamp": msg.timestamp.isoformat(),
-                        "delivered_at": msg.delivered_at.isoformat(),
-                    }
-                ),
-                str(msg.from_id),
+                Frame(MessagesDelivered(message_ids, delivered_at)), sender_id
             )
-    
+
+    # Seconds to stop reading after a rate-limited frame
+    pause = 0.0
     try:
         while True:
-            data = await websocket.receive_text()
-            data_json = json.loads(data)
-            event = data_json.get("event", "message")
-
-            if event == "message":
-                # Validate and sanitize user input
-                validation_result = validate_user_input(data_json)
-                if not validation_result['is_valid']:
-                    print(f"[SECURITY] Message validation failed for user {user_id}: {validation_result['errors']}")
-                    await websocket.send_text(json.dumps({
-                        "event": "error",
-                        "message": "Message validation failed",
-                        "errors": validation_result['errors']
-                    }))
-                    continue
-
-                to_id = validation_result['sanitized_data']['to']
-                content = validation_result['sanitized_data']['message']
-
-                # Additional message content validation
-                message_validation = validate_message_content(content)
-                if not message_validation['is_valid']:
-                    print(f"[SECURITY] Message content validation failed for user {user_id}: {message_validation['errors']}")
-                    await websocket.send_text(json.dumps({
-                        "event": "error",
-                        "message": "Message content validation failed",
-                        "errors": message_validation['errors']
-                    }))
-                    continue
-
-                # Use the sanitized message
-                sanitized_content = message_validation['sanitized_message']
-                
-                # Log security warnings
-                if message_validation['warnings']:
-                    print(f"[SECURITY] Message warnings for user {user_id}: {message_validation['warnings']}")
-
-                new_msg = Message(
-                    from_id=int(user_id), to_id=int(to_id), content=sanitized_content
-                )
-                db.add(new_msg)
-                db.commit()
-                db.refresh(new_msg)
-
-                print(f"[MESSAGE] User {user_id} sent message {new_msg.id} to {to_id} at {new_msg.timestamp}")
-
-                # Send confirmation to sender with server timestamp
-                await manager.send_personal_message(
-                    json.dumps(
-                        {
-                            "event": "message_sent",
-                            "message_id": new_msg.id,
-                            "to": to_id,
-                            "message": sanitized_content,
-                            "timestamp": new_msg.timestamp.isoformat(),
-                        }
-                    ),
-                    user_id,
-                )
-
-                # Check if receiver is connected (convert to string for consistency)
-                to_id_str = str(to_id)
-                is_connected = manager.is_user_connected(to_id_str)
-                print(f"[DELIVERY_CHECK] User {to_id} is connected: {is_connected}")
-                print(f"[DEBUG] Connected users: {list(manager.active_connections.keys())}")
-                
-                if is_connected:
-                    print(f"[DELIVERY] Delivering message {new_msg.id} immediately to {to_id}")
-                    
-                    # Notify the receiver
-                    await manager.send_personal_message(
-                        json.dumps(
-                            {
-                                "event": "new_message",
-                                "from": user_id,
-                                "message_id": new_msg.id,
-                                "message": sanitized_content,
-                                "timestamp": new_msg.timestamp.isoformat(),
-                            }
-                        ),
-                        to_id_str,
-                    )
-
-                    # Mark as delivered only if receiver is connected
-                    new_msg.delivered_at = datetime.utcnow()
-                    db.commit()
-
-                    print(f"[DELIVERY] Message {new_msg.id} marked as delivered at {new_msg.delivered_at}")
-
-                    # Notify sender that message was delivered
-                    await manager.send_personal_message(
-                        json.dumps(
-                            {
-                                "event": "message_delivered",
-                                "message_id": new_msg.id,
-                                "timestamp": new_msg.timestamp.isoformat(),
-                                "delivered_at": new_msg.delivered_at.isoformat(),
-                            }
-                        ),
-                        user_id,
-                    )
-                else:
-                    print(f"[DELIVERY] User {to_id} not connected, message {new_msg.id} will be delivered later")
-                    # Receiver is not connected, message will be delivered when they connect
-                    pass
-
-            elif event == "message_seen":
-                message_id = data_json["message_id"]
-                message = db.query(Message).get(message_id)
-                if message and message.to_id == int(user_id):
-                    message.seen_at = datetime.utcnow()
-                    db.commit()
-
-                    # Notify sender that message was seen
-                    if manager.is_user_connected(str(message.from_id)):
-                        await manager.send_personal_message(
-                            json.dumps(
-                                {
-                                    "event": "message_seen",
-                                    "message_id": message.id,
-                                    "seen_at": message.seen_at.isoformat(),
-                                }
-                            ),
-                            str(message.from_id),
-                        )
-                        
-            elif event == "mark_messages_seen":
-                # Mark all messages from a specific user as seen
-                from_user_id = data_json["from_user_id"]
-                messages = db.query(Message).filter(
-                    Message.from_id == int(from_user_id),
-                    Message.to_id == int(user_id),
-                    Message.seen_at.is_(None)
-                ).all()
-                
-                # Mark each message with its own timestamp (with small increments to ensure uniqueness)
-                base_time = datetime.utcnow()
-                for i, message in enumerate(messages):
-                    # Add microseconds to ensure each message has a unique timestamp
-                    message.seen_at = base_time + timedelta(microseconds=i)
-                
-                # Commit all changes at once
-                db.commit()
-                
-                # Notify sender for each message that was seen
-                for message in messages:
-                    if manager.is_user_connected(str(message.from_id)):
+            if pause:
+                # A flooding client is held back by TCP backpressure rather than
+                # costing a parse and a rejection per frame
+                await asyncio.sleep(pause)
+                pause = 0.0
+            data = await receive()
+            started = time.perf_counter()
+            frame = loads(data)
+            event = event_name(frame)
+
+            try:
+                retry_after = await rate_limiter.hit(user_id, event)
+                if retry_after:
+                    EVENTS_RATE_LIMITED.labels(rate_limiter.bucket_name(event)).inc()
+                    pause = min(retry_after, RATE_LIMIT_MAX_PAUSE)
+                    # Typing is coalesced by its handler rather than rejected
+                    if event != "typing":
+                        # One pending notice per event type, however hard the client floods
                         await manager.send_personal_message(
-                            json.dumps(
-                                {
-                                    "event": "message_seen",
-                                    "message_id": message.id,
-                                    "seen_at": message.seen_at.isoformat(),
-                                }
-                            ),
-                            str(message.from_id),
+                            Frame(RateLimited(event, round(retry_after, 3))),
+                            user_id,
+                            coalesce_key=f"rate_limited:{event}",
                         )
+                        continue
 
-            elif event == "typing":
-                to_id = data_json["to"]
-                is_typing = data_json["is_typing"]
-                await manager.send_personal_message(
-                    json.dumps(
-                        {"event": "typing", "from": user_id, "is_typing": is_typing}
-                    ),
-                    str(to_id),
-                )
-
-            elif event == "get_connected_users":
-                # Send current connected users to the requesting user
-                await manager.send_personal_message(
-                    json.dumps({
-                        "event": "connected_users",
-                        "users": manager.get_connected_users()
-                    }),
-                    user_id
-                )
+                handler = EVENT_HANDLERS.get(event) if isinstance(event, str) else None
+                if handler is not None:
+                    await handler(user_id, frame)
+            finally:
+                observe_event(event, started)
 
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
-        await manager.broadcast_json(
-            {"event": "user_disconnected", "user_id": user_id, "connected_users": manager.get_connected_users()}
+        pass
+    except RuntimeError:
+        # receive raises this once the writer task found the socket gone or evicted it
+        if websocket.application_state == WebSocketState.CONNECTED:
+            raise
+    finally:
+        manager.disconnect(user_id, websocket)
+        # Skip the broadcast if a reconnect already replaced this socket
+        if not manager.is_user_connected(user_id):
+            typing_coalescer.forget(user_id)
+            await manager.announce_disconnect(user_id)
+
+
+async def on_message(user_id: str, frame: dict):
+    # Validate and sanitize user input; heavy sanitizing may run on a worker pool
+    validation_started = time.perf_counter()
+    content = frame.get("message")
+    content_result = await sanitizer_pool.check(content) if isinstance(content, str) else None
+    validation_result = validate_user_input(frame, content_result)
+    VALIDATION_SECONDS.observe(time.perf_counter() - validation_started)
+    if not validation_result['is_valid']:
+        security_log.warning("Message validation failed", extra={
+            "user_id": user_id, "errors": validation_result['errors'],
+        })
+        await manager.send_personal_message(
+            Frame(Error("Message validation failed", validation_result['errors'])), user_id
+        )
+        return
+
+    # Content was validated and sanitized once, above
+    to_id = _frame_id(validation_result['sanitized_data'], 'to')
+    if to_id is None:
+        await _reject(user_id, "message", ["to must be a user id"])
+        return
+    sanitized_content = validation_result['sanitized_data']['message']
+
+    # Log security warnings
+    if validation_result['warnings']:
+        security_log.info("Message sanitized", extra={
+            "user_id": user_id, "warnings": validation_result['warnings'],
+        })
+
+    # Queued now, so this socket's messages are stored in the order they arrived
+    stored = write_pipeline.insert_message(from_id=int(user_id), to_id=to_id, content=sanitized_content)
+    await _pipeline_message(user_id, to_id, sanitized_content, stored)
+
+
+async def _deliver_message(user_id: str, to_id: int, sanitized_content: str, stored: asyncio.Future,
+                           previous: Optional[asyncio.Task]):
+    try:
+        # Resolves once the batch holding this insert has committed
+        new_msg = await stored
+    except Exception:
+        message_log.exception("Message could not be stored", extra={"from_id": user_id, "to_id": to_id})
+        await manager.send_personal_message(Frame(Error("Message could not be stored", [])), user_id)
+        return
+    if previous is not None:
+        await asyncio.wait([previous])
+
+    message_log.info("Message stored", extra={
+        "from_id": user_id, "to_id": to_id, "message_id": new_msg.id,
+    })
+
+    # Send confirmation to sender with server timestamp
+    await manager.send_personal_message(
+        Frame(MessageSent(new_msg.id, to_id, sanitized_content, new_msg.timestamp)), user_id
+    )
+
+    # Check if receiver is connected (convert to string for consistency)
+    to_id_str = str(to_id)
+    is_connected = manager.is_user_connected(to_id_str)
+    # .debug() does the level check (and any sampling) itself; guarding it here would sample twice
+    delivery_log.debug("Delivery check", extra={
+        "to_id": to_id, "connected": is_connected,
+        "connected_users": len(manager.active_connections),
+    })
+
+    # Notify the receiver, on this worker or wherever they are connected
+    delivered = is_connected and await manager.send_personal_message(
+        Frame(NewMessage(user_id, new_msg.id, sanitized_content, new_msg.timestamp)), to_id_str
+    )
+
+    if delivered:
+        # Mark as delivered only if receiver is connected. Not awaited: the
+        # sender's next message would wait for a second commit otherwise, and
+        # a message whose update is lost is just delivered again as pending.
+        delivered_at = datetime.now(UTC)
+        await write_pipeline.mark_delivered([new_msg], delivered_at, wait=False)
+
+        delivery_log.info("Message delivered", extra={"message_id": new_msg.id, "to_id": to_id})
+
+        # Notify sender that message was delivered
+        await manager.send_personal_message(
+            Frame(MessageDelivered(new_msg.id, new_msg.timestamp, delivered_at)), user_id
+        )
+    else:
+        # Receiver is not connected, message will be delivered when they connect
+        delivery_log.info("Message queued until receiver connects", extra={
+            "message_id": new_msg.id, "to_id": to_id,
+        })
+
+
+async def on_message_seen(user_id: str, frame: dict):
+    seen_at = datetime.now(UTC)
+    if "up_to" in frame:
+        # Everything from from_user_id up to and including message up_to
+        sender_id, up_to = _frame_id(frame, "from_user_id"), _frame_id(frame, "up_to")
+        if sender_id is None or up_to is None:
+            await _reject(user_id, "message_seen", ["from_user_id and up_to must be a user id and a message id"])
+            return
+        await _mark_seen_up_to(user_id, sender_id, up_to, seen_at)
+        return
+    message_id = _frame_id(frame, "message_id")
+    if message_id is None:
+        await _reject(user_id, "message_seen", ["message_id must be a message id"])
+        return
+    # Only messages addressed to this user and not yet seen are updated
+    for message in await write_pipeline.mark_seen(int(user_id), [message_id], seen_at):
+        # Notify sender that message was seen
+        if manager.is_user_connected(str(message.from_id)):
+            await manager.send_personal_message(
+                Frame(MessageSeen(message.id, seen_at)), str(message.from_id)
+            )
+
+
+async def on_mark_messages_seen(user_id: str, frame: dict):
+    # Mark all messages from a specific user as seen
+    sender_id = _frame_id(frame, "from_user_id")
+    if sender_id is None:
+        await _reject(user_id, "mark_messages_seen", ["from_user_id must be a user id"])
+        return
+    await _mark_seen_up_to(user_id, sender_id, None, datetime.now(UTC))
+
+
+async def on_typing(user_id: str, frame: dict):
+    to_id = _frame_id(frame, "to")
+    if to_id is None:
+        await _reject(user_id, "typing", ["to must be a user id"])
+        return
+    if not manager.is_user_connected(str(to_id)):
+        # Nobody to show it to; and no typing state kept for ids that are not online
+        return
+    await typing_coalescer.submit(user_id, str(to_id), bool(frame.get("is_typing")))
+
+
+async def on_get_connected_users(user_id: str, frame: dict):
+    # Send a versioned snapshot; clients use this to recover from presence gaps
+    await manager.send_personal_message(manager.get_presence_snapshot(), user_id)
+
+
+# Inbound event -> handler(user_id, frame); frames with any other event are ignored
+EVENT_HANDLERS: Dict[str, Callable[[str, dict], Awaitable[None]]] = {
+    "message": on_message,
+    "message_seen": on_message_seen,
+    "mark_messages_seen": on_mark_messages_seen,
+    "typing": on_typing,
+    "get_connected_users": on_get_connected_users,
+}
+
+
+async def _mark_seen_up_to(reader_id: str, sender_id: int, up_to: Optional[int], seen_at: datetime):
+    """Mark a conversation read up to a message and tell the sender with one high-water-mark event"""
+    seen = await write_pipeline.mark_seen_up_to(int(reader_id), sender_id, up_to, seen_at)
+    if seen and manager.is_user_connected(str(sender_id)):
+        await manager.send_personal_message(
+            Frame(MessagesSeenUpTo(seen.up_to, reader_id, seen_at)), str(sender_id)
         )
 
 
 @chat_router.get("/connected-users")
 @limiter.limit("30/minute")
-def get_connected_users(request: Request):
-    """Get list of currently connected users"""
-    return {
-        "connected_users": manager.get_connected_users(),
-        "total_count": manager.get_connected_users_count()
-    }
+def get_connected_users(request: Request, since: Optional[int] = None):
+    """Get currently connected users, or only the presence changes after ``since``"""
+    if since is not None:
+        changes = manager.get_presence_changes(since)
+        if changes is not None:
+            return {
+                "version": manager.presence_version,
+                "changes": changes,
+                "total_count": manager.get_connected_users_count()
+            }
+    # No version given, or it is too old to replay: fall back to a snapshot,
+    # spliced from the encoded entries rather than re-serialized
+    return Response(
+        f'{{"version":{manager.presence_version},"connected_users":{manager.connected_users_json()},'
+        f'"total_count":{manager.get_connected_users_count()}}}',
+        media_type="application/json",
+    )
 
 
 @chat_router.get("/connected-users/{user_id}")
@@ -290,28 +382,89 @@ def is_user_connected(user_id: str, request: Request):
     }
 
 
+@chat_router.get("/ws/queues")
+@limiter.limit("30/minute")
+def get_outbound_queue_stats(request: Request):
+    """Get outbound queue depth and drop counters for connected sockets"""
+    return manager.get_queue_stats()
+
+
+@chat_router.get("/cache-stats")
+@limiter.limit("30/minute")
+def get_cache_stats(request: Request):
+    """Get hit/miss/eviction counters for the in-process caches"""
+    return {
+        "profiles": profile_cache.stats(),
+        "tokens": google_verifier.token_cache.stats(),
+        "history": history_cache.stats(),
+        **cache_stats(),
+    }
+
+
+@chat_router.get("/cache-stats/history/consistency")
+@limiter.limit("2/minute")
+async def get_history_cache_consistency(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Compare every cached conversation tail with the database (reads several pages per conversation)"""
+    return await history_cache.verify(db)
+
+
+@chat_router.get("/inbox/{user_id}")
+@limiter.limit("30/minute")
+async def get_user_inbox(user_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Conversations for a user with the latest message and unread count, newest first"""
+    return await get_inbox(db, user_id)
+
+
 @chat_router.get("/history/{user1_id}/{user2_id}")
 @limiter.limit("30/minute")
-def get_chat_history(user1_id: int, user2_id: int, request: Request, db: Session = Depends(get_db)):
-    messages = (
-        db.query(Message)
-        .filter(
-            ((Message.from_id == user1_id) & (Message.to_id == user2_id))
-            | ((Message.from_id == user2_id) & (Message.to_id == user1_id))
-        )
-        .order_by(Message.timestamp.asc())
-        .all()
+async def get_chat_history(
+    user1_id: int,
+    user2_id: int,
+    request: Request,
+    before: Optional[int] = Query(None, description="Only messages older than this message id"),
+    after: Optional[int] = Query(None, description="Only messages newer than this message id"),
+    limit: Optional[int] = Query(None, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    stream: bool = Query(False, description="Stream every matching message as a JSON array"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Messages between two users in chronological order.
+
+    Returns the latest ``limit`` messages by default; page backwards with
+    ``before=<oldest id seen>`` or forwards with ``after=<newest id seen>``.
+    ``stream=true`` streams all matching messages through a server-side cursor.
+    Recent pages of recently read conversations are served from memory.
+    """
+    if stream:
+        query = conversation_query(user1_id, user2_id, before=before, after=after, limit=limit)
+        return StreamingResponse(_stream_history(query), media_type="application/json")
+
+    page_size = limit or HISTORY_PAGE_SIZE
+    cached = history_cache.page(user1_id, user2_id, before=before, after=after, limit=page_size)
+    if cached is not None:
+        return [history_row(row) for row in cached]
+    if before is None and after is None and history_cache.enabled:
+        # Opening a chat window: read the latest page and keep the conversation's tail
+        return [history_row(row) for row in await history_cache.load_latest(db, user1_id, user2_id, page_size)]
+
+    # Without an ``after`` cursor we want the newest page, fetched newest-first and reversed
+    newest_first = after is None
+    query = conversation_query(
+        user1_id, user2_id, before=before, after=after,
+        limit=page_size, newest_first=newest_first,
     )
+    rows = (await db.execute(query)).all()
+    if newest_first:
+        rows.reverse()
+    return [history_row(row) for row in rows]
+
 
-    return [
-        {
-            "id": m.id,
-            "from": m.from_id,
-            "to": m.to_id,
-            "message": m.content,
-            "timestamp": m.timestamp.isoformat(),
-            "delivered_at": m.delivered_at.isoformat() if m.delivered_at else None,
-            "seen_at": m.seen_at.isoformat() if m.seen_at else None,
-        }
-        for m in messages
-    ]
+async def _stream_history(query):
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=500))
+        yield "["
+        first = True
+        async for row in result:
+            yield ("" if first else ",") + json.dumps(history_row(row))
+            first = False
+        yield "]"
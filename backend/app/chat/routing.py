@@ -0,0 +1,302 @@
+"""
+Routing backends for ``ConnectionManager``.
+
+A backend tells the manager about users connected to *other* workers and
+carries frames to them. ``RoutingBackend`` is the in-process default: every
+user lives on this worker, so nothing is ever routed. ``RedisRoutingBackend``
+keeps a global presence registry in Redis and delivers frames between
+workers over pub/sub.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import uuid
+from contextlib import suppress
+from typing import Dict, Optional
+
+ROUTING_BACKEND = os.getenv("CHAT_ROUTING_BACKEND", "local")
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
+# Prefix for every Redis key and channel used for routing
+REDIS_PREFIX = os.getenv("CHAT_REDIS_PREFIX", "chat")
+# Seconds between node heartbeats; a node missing three in a row is considered dead
+HEARTBEAT_INTERVAL = float(os.getenv("CHAT_HEARTBEAT_INTERVAL", "5"))
+# Seconds before resubscribing after the pub/sub connection drops; doubled up to 30 while it keeps failing
+RESUBSCRIBE_DELAY = float(os.getenv("CHAT_RESUBSCRIBE_DELAY", "0.5"))
+# Seconds to wait for the target worker to confirm a routed frame reached a socket
+ROUTE_ACK_TIMEOUT = float(os.getenv("CHAT_ROUTE_ACK_TIMEOUT", "2"))
+
+logger = logging.getLogger("app.chat.routing")
+
+
+class RoutingBackend:
+    """In-process routing: every connected user is on this worker"""
+
+    async def start(self, manager):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish_presence(self, event: str, user_id: str, user_info: Optional[dict] = None):
+        """Tell other workers that a local user connected, disconnected or changed"""
+        pass
+
+    async def send(self, user_id: str, payload: str, coalesce_key: Optional[str] = None) -> bool:
+        """Deliver ``payload`` to a user on another worker; False if nobody took it"""
+        return False
+
+    def forget(self, user_id: str):
+        """``user_id`` connected to this worker: drop any record of them being elsewhere"""
+        pass
+
+
+# Publish to the node currently holding the user, if that node is still alive.
+# Returns the number of subscribers that received the frame.
+ROUTE_SCRIPT = """
+local node = redis.call('HGET', KEYS[1], ARGV[1])
+if not node then
+    return 0
+end
+node = cjson.decode(node)['node']
+if redis.call('EXISTS', ARGV[3] .. ':node:' .. node .. ':alive') == 0 then
+    return 0
+end
+return redis.call('PUBLISH', ARGV[3] .. ':node:' .. node, ARGV[2])
+"""
+
+# Remove a presence entry only if it still belongs to this node, so a user who
+# already reconnected elsewhere is not dropped from the registry.
+RELEASE_SCRIPT = """
+local entry = redis.call('HGET', KEYS[1], ARGV[1])
+if entry and cjson.decode(entry)['node'] == ARGV[2] then
+    return redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+class RedisRoutingBackend(RoutingBackend):
+    """
+    Cross-worker routing over Redis.
+
+    * ``<prefix>:presence`` hash maps user_id -> {"node", "info"} for every
+      connected user in the fleet.
+    * ``<prefix>:node:<id>`` is each worker's inbox channel for directed frames
+      (new_message, typing, message_seen, message_delivered, ...). The
+      receiving worker acks every frame on the sender's inbox, saying whether
+      it reached a socket; a frame for a user it no longer holds releases
+      their stale presence entry.
+    * ``<prefix>:presence-events`` fans presence deltas out to all workers.
+    * ``<prefix>:node:<id>:alive`` is a heartbeat key with a TTL; entries owned
+      by a node whose heartbeat expired are treated as offline.
+    """
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = REDIS_PREFIX,
+                 heartbeat_interval: float = HEARTBEAT_INTERVAL, ack_timeout: float = ROUTE_ACK_TIMEOUT,
+                 client=None):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url)
+        self.redis = client
+        self.prefix = prefix
+        self.node_id = uuid.uuid4().hex
+        self.heartbeat_interval = heartbeat_interval
+        self.ack_timeout = ack_timeout
+        self.presence_key = f"{prefix}:presence"
+        self.inbox_channel = f"{prefix}:node:{self.node_id}"
+        self.presence_channel = f"{prefix}:presence-events"
+        self.alive_key = f"{prefix}:node:{self.node_id}:alive"
+        self.remote_nodes: Dict[str, str] = {}  # user_id -> node_id for users on other workers
+        self.manager = None
+        self._route = self.redis.register_script(ROUTE_SCRIPT)
+        self._release = self.redis.register_script(RELEASE_SCRIPT)
+        self._pubsub = None
+        self._tasks = []
+        # Routed frames waiting for the target worker's ack, by sequence number
+        self._acks: Dict[int, asyncio.Future] = {}
+        self._sequence = itertools.count()
+
+    async def start(self, manager):
+        self.manager = manager
+        await self._heartbeat()
+        await self._subscribe()
+        self._tasks = [
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._heartbeat_loop()),
+        ]
+        await self._sync_presence()
+        await self._reap_dead_nodes()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for future in self._acks.values():
+            future.cancel()
+        self._acks.clear()
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe()
+            await self._pubsub.aclose()
+            self._pubsub = None
+        await self.redis.delete(self.alive_key)
+        await self.redis.aclose()
+
+    async def publish_presence(self, event: str, user_id: str, user_info: Optional[dict] = None):
+        if event == "user_disconnected":
+            if not await self._release(keys=[self.presence_key], args=[user_id, self.node_id]):
+                # The entry is no longer ours: the user reconnected on another worker
+                return
+        else:
+            entry = json.dumps({"node": self.node_id, "info": user_info or {}})
+            await self.redis.hset(self.presence_key, user_id, entry)
+        await self.redis.publish(self.presence_channel, json.dumps({
+            "origin": self.node_id,
+            "event": event,
+            "user_id": user_id,
+            "user_info": user_info,
+        }))
+
+    async def send(self, user_id: str, payload: str, coalesce_key: Optional[str] = None) -> bool:
+        # A subscribed worker is not a delivery: wait for it to say the frame reached a socket
+        ack = next(self._sequence)
+        frame = json.dumps({
+            "user_id": user_id,
+            "payload": payload,
+            "coalesce_key": coalesce_key,
+            "reply_to": self.node_id,
+            "ack": ack,
+        })
+        future = self._acks[ack] = asyncio.get_running_loop().create_future()
+        try:
+            if not await self._route(keys=[self.presence_key], args=[user_id, frame, self.prefix]):
+                return False
+            return await asyncio.wait_for(future, self.ack_timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._acks.pop(ack, None)
+
+    def forget(self, user_id: str):
+        self.remote_nodes.pop(user_id, None)
+
+    async def _subscribe(self):
+        self._pubsub = self.redis.pubsub()
+        await self._pubsub.subscribe(self.inbox_channel, self.presence_channel)
+
+    async def _sync_presence(self):
+        """Bring ``remote_nodes`` and the manager in line with the presence registry"""
+        registry = await self.redis.hgetall(self.presence_key)
+        entries = {_text(user_id): json.loads(entry) for user_id, entry in registry.items()}
+        for user_id in list(self.remote_nodes):
+            entry = entries.get(user_id)
+            if entry is None or entry["node"] == self.node_id:
+                del self.remote_nodes[user_id]
+                await self.manager.apply_remote_presence("user_disconnected", user_id, None)
+        for user_id, entry in entries.items():
+            if entry["node"] != self.node_id and self.remote_nodes.get(user_id) != entry["node"]:
+                self.remote_nodes[user_id] = entry["node"]
+                await self.manager.apply_remote_presence("user_connected", user_id, entry["info"])
+
+    async def _listen(self):
+        """Handle pub/sub messages for good: a bad message is logged and skipped, a lost connection resubscribed"""
+        delay = RESUBSCRIBE_DELAY
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    delay = RESUBSCRIBE_DELAY
+                    if message["type"] == "message":
+                        await self._handle(message)
+            except Exception as e:
+                logger.warning("Routing subscription lost, resubscribing in %.1f seconds: %s", delay, e)
+            else:
+                logger.warning("Routing subscription ended, resubscribing in %.1f seconds", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+            with suppress(Exception):
+                await self._pubsub.aclose()
+            try:
+                await self._subscribe()
+                # Presence events published while unsubscribed were missed
+                await self._sync_presence()
+            except Exception as e:
+                logger.warning("Resubscribing to routing channels failed: %s", e)
+
+    async def _handle(self, message: dict):
+        channel = _text(message["channel"])
+        try:
+            data = json.loads(message["data"])
+            if channel == self.inbox_channel:
+                if "payload" in data:
+                    await self._deliver(data)
+                else:
+                    future = self._acks.get(data["ack"])
+                    if future is not None and not future.done():
+                        future.set_result(data["delivered"])
+            elif data["origin"] != self.node_id:
+                if data["event"] == "user_disconnected":
+                    self.remote_nodes.pop(data["user_id"], None)
+                elif data["user_id"] in self.manager.active_connections and not await self._owned_by(
+                    data["user_id"], data["origin"]
+                ):
+                    # A late event from a worker the user already left for this one
+                    return
+                else:
+                    self.remote_nodes[data["user_id"]] = data["origin"]
+                await self.manager.apply_remote_presence(data["event"], data["user_id"], data["user_info"])
+        except Exception:
+            logger.exception("Dropped routing message on %s", channel)
+
+    async def _owned_by(self, user_id: str, node: str) -> bool:
+        entry = await self.redis.hget(self.presence_key, user_id)
+        return entry is not None and json.loads(entry)["node"] == node
+
+    async def _deliver(self, data: dict):
+        user_id = data["user_id"]
+        delivered = await self.manager.deliver_local(user_id, data["payload"], data["coalesce_key"])
+        await self.redis.publish(f"{self.prefix}:node:{data['reply_to']}", json.dumps({
+            "ack": data["ack"], "delivered": delivered,
+        }))
+        if not delivered and not self.manager.is_user_connected(user_id):
+            # The registry still routes this user here after they left; release the entry
+            await self.manager.announce_disconnect(user_id)
+
+    async def _heartbeat(self):
+        ttl = max(1, int(self.heartbeat_interval * 3))
+        await self.redis.set(self.alive_key, "1", ex=ttl)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await self._heartbeat()
+            await self._reap_dead_nodes()
+
+    async def _reap_dead_nodes(self):
+        """Forget users whose worker stopped heartbeating without saying goodbye"""
+        nodes = set(self.remote_nodes.values())
+        if not nodes:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for node in nodes:
+                pipe.exists(f"{self.prefix}:node:{node}:alive")
+            alive = await pipe.execute()
+        dead = {node for node, exists in zip(nodes, alive) if not exists}
+        for user_id, node in list(self.remote_nodes.items()):
+            if node in dead:
+                del self.remote_nodes[user_id]
+                await self._release(keys=[self.presence_key], args=[user_id, node])
+                await self.manager.apply_remote_presence("user_disconnected", user_id, None)
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def create_routing_backend(name: str = ROUTING_BACKEND) -> RoutingBackend:
+    """Build the backend selected by ``CHAT_ROUTING_BACKEND`` (local | redis)"""
+    if name == "redis":
+        return RedisRoutingBackend()
+    if name == "local":
+        return RoutingBackend()
+    raise ValueError(f"Unknown routing backend: {name}")
@@ -0,0 +1,137 @@
+"""
+Database availability: connecting at boot, and the readiness probe.
+
+A worker waits for the database with async retries, so the event loop is
+never blocked while it does. It then opens ``DB_POOL_WARM`` pooled
+connections at once, so the first requests skip the connect, and reads the
+schema version. It stays unready until migrations have been applied; while
+the schema is behind, every readiness check reads the version again, so a
+worker started before ``python -m app.db.migrations`` finished turns ready
+once it has.
+
+``GET /ready`` asks ``DatabaseProbe``, which checks out a pooled connection
+and pings it within ``DB_READY_TIMEOUT`` seconds. A result is reused for
+``DB_READY_INTERVAL`` seconds, so however often a load balancer probes,
+each worker does at most one round-trip per interval.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import QueuePool
+
+from app.db.database import DB_POOL_SIZE, async_engine
+
+logger = logging.getLogger("app.db.health")
+
+# Connection attempts at boot before giving up
+DB_CONNECT_RETRIES = int(os.getenv("DB_CONNECT_RETRIES", "5"))
+# Seconds before the first retry; doubled after each failure
+DB_CONNECT_RETRY_DELAY = float(os.getenv("DB_CONNECT_RETRY_DELAY", "1"))
+# Pooled connections opened at boot (at most DB_POOL_SIZE; 0 opens them on demand)
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", "4"))
+# Longest a readiness check waits for a pooled connection and its ping
+DB_READY_TIMEOUT = float(os.getenv("DB_READY_TIMEOUT", "2"))
+# Seconds a readiness result is reused before the database is asked again
+DB_READY_INTERVAL = float(os.getenv("DB_READY_INTERVAL", "1"))
+
+
+async def wait_for_database(engine: AsyncEngine = async_engine, retries: int = DB_CONNECT_RETRIES,
+                            delay: float = DB_CONNECT_RETRY_DELAY):
+    """Return once the database answers, retrying with exponential backoff"""
+    for attempt in range(1, retries + 1):
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            return
+        except (DBAPIError, OSError) as e:
+            if attempt == retries:
+                logger.error("Failed to connect to database after %d attempts", retries)
+                raise
+            logger.warning(
+                "Database connection failed (attempt %d/%d), retrying in %.1f seconds: %s",
+                attempt, retries, delay, e,
+            )
+            await asyncio.sleep(delay)
+            delay *= 2
+
+
+async def warm_pool(engine: AsyncEngine = async_engine, size: int = DB_POOL_WARM) -> int:
+    """Open ``size`` pooled connections concurrently and hand them back to the pool; returns how many opened"""
+    size = min(size, DB_POOL_SIZE)
+    if size <= 0:
+        return 0
+    # Held at the same time, so each is a separate connection
+    results = await asyncio.gather(*(engine.connect().start() for _ in range(size)), return_exceptions=True)
+    opened = [conn for conn in results if not isinstance(conn, BaseException)]
+    for conn in opened:
+        await conn.close()
+    if len(opened) < size:
+        logger.warning("Warmed %d of %d pooled database connections", len(opened), size)
+    return len(opened)
+
+
+class DatabaseProbe:
+    def __init__(self, engine: AsyncEngine = async_engine, timeout: float = DB_READY_TIMEOUT,
+                 interval: float = DB_READY_INTERVAL):
+        self.engine = engine
+        self.timeout = timeout
+        self.interval = interval
+        # Read at startup, and again by each check until it reaches LATEST_VERSION
+        self.schema_version: Optional[int] = None
+        self.checks = 0
+        self.failures = 0
+        self._result: Optional[Dict] = None
+        self._checked_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    async def read_schema_version(self) -> int:
+        from app.db.migrations import current_version
+
+        async with self.engine.connect() as conn:
+            self.schema_version = await conn.run_sync(current_version)
+        return self.schema_version
+
+    async def check(self) -> Dict:
+        """``{"ok": ..., "pool": ...}`` for the database, asking it at most once per interval"""
+        async with self._lock:
+            if time.monotonic() - self._checked_at >= self.interval:
+                self._result = await self._check()
+                self._checked_at = time.monotonic()
+            return self._result
+
+    async def _check(self) -> Dict:
+        self.checks += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._ping(), self.timeout)
+        except (asyncio.TimeoutError, DBAPIError, OSError) as e:
+            self.failures += 1
+            return {"ok": False, "error": str(e) or type(e).__name__, "pool": self.pool_stats()}
+        return {"ok": True, "ping_ms": round((time.perf_counter() - started) * 1000, 2), "pool": self.pool_stats()}
+
+    async def _ping(self):
+        from app.db.migrations import LATEST_VERSION, current_version
+
+        async with self.engine.connect() as conn:
+            await conn.exec_driver_sql("SELECT 1")
+            if self.schema_version is None or self.schema_version < LATEST_VERSION:
+                self.schema_version = await conn.run_sync(current_version)
+
+    def pool_stats(self) -> Dict:
+        pool = self.engine.pool
+        if not isinstance(pool, QueuePool):
+            return {}
+        # overflow() counts up from -size as connections are opened
+        return {
+            "size": pool.size(), "open": pool.size() + pool.overflow(),
+            "checked_out": pool.checkedout(), "overflow": max(0, pool.overflow()),
+        }
+
+
+database_probe = DatabaseProbe()
@@ -0,0 +1,149 @@
+"""
+Versioned schema migrations, applied once per deploy.
+
+Workers no longer create tables as they boot. The schema is built and
+changed here, by numbered migrations that each take a sync ``Connection``.
+Applied versions are recorded in ``schema_migrations``. Every pending
+migration runs in its own transaction together with the row recording it.
+On Postgres an advisory lock is held as well, so runners started together
+apply each migration once.
+
+    python -m app.db.migrations            # apply pending migrations
+    python -m app.db.migrations --check    # exit 1 if any are pending
+    python -m app.db.migrations --list
+
+At startup a worker only reads the current version and stays unready
+while it is behind (see ``app.db.health``). ``DB_MIGRATE_ON_STARTUP=true``
+lets a single-process development server migrate itself.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from datetime import UTC, datetime
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, insert, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from app.db.database import Base, engine
+from app.db.partitions import create_tables
+from app.models import conversation, message, user  # noqa: F401  (every table on Base)
+
+logger = logging.getLogger("app.db.migrations")
+
+# Apply pending migrations when a worker starts; for development, where one process serves everything
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "false").lower() == "true"
+
+# Advisory lock key, next to the partition maintenance ones
+MIGRATION_LOCK = 0x6D736703
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+def _initial_schema(connection: Connection):
+    # Tables that already exist (databases from before migrations) are left as they are
+    create_tables(connection)
+
+
+def _missing_indexes(connection: Connection):
+    # create_all never adds an index to an existing table, so older databases lack the newer ones
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+MIGRATIONS = [
+    Migration(1, "initial schema", _initial_schema),
+    Migration(2, "indexes missing from tables created before them", _missing_indexes),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(connection: Connection) -> int:
+    """Highest applied migration, 0 for a database that has never been migrated"""
+    if not inspect(connection).has_table(schema_migrations.name):
+        return 0
+    return connection.scalar(select(func.max(schema_migrations.c.version))) or 0
+
+
+def _lock(connection: Connection):
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK})
+
+
+def upgrade(bind: Engine = engine, target: Optional[int] = None) -> List[Migration]:
+    """Apply every pending migration up to ``target`` (the latest by default); returns those applied"""
+    with bind.begin() as connection:
+        _lock(connection)
+        schema_migrations.create(connection, checkfirst=True)
+    applied = []
+    for migration in MIGRATIONS:
+        if target is not None and migration.version > target:
+            break
+        with bind.begin() as connection:
+            _lock(connection)
+            done = connection.scalar(
+                select(schema_migrations.c.version).where(schema_migrations.c.version == migration.version)
+            )
+            if done is not None:
+                continue
+            started = time.perf_counter()
+            migration.apply(connection)
+            connection.execute(insert(schema_migrations).values(
+                version=migration.version, name=migration.name, applied_at=datetime.now(UTC),
+            ))
+        logger.info("Applied migration %d (%s) in %.0f ms",
+                    migration.version, migration.name, (time.perf_counter() - started) * 1000)
+        applied.append(migration)
+    return applied
+
+
+async def _main(args) -> int:
+    from app.db.database import async_engine
+    from app.db.health import wait_for_database
+    from app.log import configure_logging, shutdown_logging
+
+    configure_logging()
+    try:
+        # The database may still be starting next to us
+        await wait_for_database()
+        with engine.connect() as connection:
+            version = current_version(connection)
+        pending = [migration for migration in MIGRATIONS if migration.version > version]
+        if args.list:
+            for migration in MIGRATIONS:
+                state = "pending" if migration in pending else "applied"
+                print(f"{migration.version:4d}  {state:8s} {migration.name}")
+        elif args.check:
+            print(f"Schema version {version}, latest {LATEST_VERSION}")
+            return 1 if pending else 0
+        else:
+            applied = upgrade(target=args.target)
+            print(f"Schema version {max([version] + [m.version for m in applied])}, "
+                  f"applied {len(applied)} migration(s)")
+        return 0
+    finally:
+        await async_engine.dispose()
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database schema migrations")
+    parser.add_argument("--check", action="store_true", help="exit 1 if migrations are pending")
+    parser.add_argument("--list", action="store_true", help="list migrations and whether each is applied")
+    parser.add_argument("--target", type=int, help="stop after this version")
+    sys.exit(asyncio.run(_main(parser.parse_args())))
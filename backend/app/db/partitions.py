@@ -0,0 +1,268 @@
+"""
+Monthly partitions of the ``messages`` table, and archival of expired ones.
+
+On Postgres, ``messages`` is created partitioned by range of ``timestamp``,
+one partition per calendar month (UTC) named ``messages_yYYYYmMM``. A
+partitioned table's unique constraints must include the partition key, so
+its primary key is ``(id, timestamp)``; ids still come from one sequence.
+There is no default partition: it would stop Postgres from scanning the
+partitions in order for the latest history page. Instead the partitions
+for this month and the next ``MESSAGE_PARTITIONS_AHEAD`` are created with
+the table (``app.db.migrations``) and topped up by a background task on
+every worker.
+
+The same task enforces ``MESSAGE_RETENTION_MONTHS``. A partition whose
+whole month is past the window is detached from ``messages``, streamed with
+``COPY`` to a gzipped CSV in ``MESSAGE_ARCHIVE_DIR`` and dropped. A
+partition left detached but unarchived (the worker died mid-copy) is
+archived on the next run.
+
+SQLite has no partitioning, so there ``messages`` stays a plain table and
+nothing is archived. A Postgres ``messages`` table created before
+partitioning is left alone, with a warning.
+"""
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import UTC, datetime
+from typing import BinaryIO, List, Optional, Tuple
+
+from sqlalchemy import MetaData, PrimaryKeyConstraint, Table, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.db.database import Base, async_engine
+from app.models.message import Message
+
+logger = logging.getLogger("app.db.partitions")
+
+# monthly | off: how messages is partitioned on Postgres (SQLite never is)
+MESSAGE_PARTITIONING = os.getenv("MESSAGE_PARTITIONING", "monthly").lower()
+# Monthly partitions kept ready past the current one
+MESSAGE_PARTITIONS_AHEAD = int(os.getenv("MESSAGE_PARTITIONS_AHEAD", "3"))
+# Whole months of messages kept before their partition is archived (0 keeps everything)
+MESSAGE_RETENTION_MONTHS = int(os.getenv("MESSAGE_RETENTION_MONTHS", "0"))
+# Directory archived partitions are written to, one .csv.gz per month
+MESSAGE_ARCHIVE_DIR = os.getenv("MESSAGE_ARCHIVE_DIR", "archive")
+# Seconds between maintenance runs (partition creation and archival)
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+# Longest DETACH PARTITION waits for its lock; queued behind a long transaction it would block every insert
+PARTITION_LOCK_TIMEOUT = os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+
+if MESSAGE_PARTITIONING not in ("monthly", "off"):
+    raise ValueError(f"Unknown message partitioning: {MESSAGE_PARTITIONING}")
+
+PARTITION_NAME = re.compile(r"^messages_y(\d{4})m(\d{2})$")
+# Advisory lock keys, so several workers never create or archive partitions at once
+CREATE_LOCK = 0x6D736701
+ARCHIVE_LOCK = 0x6D736702
+
+
+def month_start(value: datetime) -> datetime:
+    value = value.astimezone(UTC) if value.tzinfo else value.replace(tzinfo=UTC)
+    return datetime(value.year, value.month, 1, tzinfo=UTC)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=UTC)
+
+
+def partition_name(month: datetime) -> str:
+    return f"messages_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[datetime]:
+    match = PARTITION_NAME.match(name)
+    return datetime(int(match[1]), int(match[2]), 1, tzinfo=UTC) if match else None
+
+
+def partitioning_enabled(connection) -> bool:
+    return connection.dialect.name == "postgresql" and MESSAGE_PARTITIONING == "monthly"
+
+
+def partitioned_table() -> Table:
+    """``messages`` declared as a range-partitioned table, for ``CREATE TABLE`` on Postgres"""
+    metadata = MetaData()
+    # The foreign keys need the users table to render
+    Base.metadata.tables["users"].to_metadata(metadata)
+    table = Message.__table__.to_metadata(metadata)
+    table.c.id.autoincrement = True
+    table.c.timestamp.primary_key = True
+    table.append_constraint(PrimaryKeyConstraint(table.c.id, table.c.timestamp, name="messages_pkey"))
+    table.dialect_kwargs["postgresql_partition_by"] = "RANGE (timestamp)"
+    return table
+
+
+def create_tables(connection: Connection):
+    """``Base.metadata.create_all``, creating ``messages`` partitioned by month where that is enabled"""
+    if not partitioning_enabled(connection):
+        Base.metadata.create_all(connection)
+        return
+    Base.metadata.create_all(connection, tables=[
+        table for table in Base.metadata.sorted_tables if table.name != Message.__tablename__
+    ])
+    partitioned_table().create(connection, checkfirst=True)
+    if is_partitioned(connection):
+        ensure_partitions(connection)
+    else:
+        logger.warning("messages is not a partitioned table; partition maintenance and retention are off")
+
+
+def is_partitioned(connection: Connection) -> bool:
+    return bool(connection.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('messages'))"
+    )))
+
+
+def monthly_partitions(connection: Connection) -> List[Tuple[str, bool]]:
+    """``(name, attached)`` for every monthly partition table, attached to ``messages`` or not, oldest first"""
+    rows = connection.execute(text(
+        "SELECT relname, relispartition FROM pg_class "
+        "WHERE relkind = 'r' AND relnamespace = current_schema()::regnamespace "
+        "AND relname ~ '^messages_y[0-9]{4}m[0-9]{2}$' ORDER BY relname"
+    )).all()
+    return [(row.relname, row.relispartition) for row in rows]
+
+
+def ensure_partitions(connection: Connection, first: Optional[datetime] = None,
+                      months_ahead: int = MESSAGE_PARTITIONS_AHEAD) -> List[str]:
+    """
+    Create any missing partition from ``first`` (this month by default)
+    through ``months_ahead`` months from now. Returns the partitions created.
+    """
+    this_month = month_start(datetime.now(UTC))
+    month = month_start(first) if first is not None else this_month
+    last = add_months(this_month, months_ahead)
+    existing = {name for name, _ in monthly_partitions(connection)}
+    created = []
+    while month <= last:
+        name = partition_name(month)
+        if name not in existing:
+            if not created:
+                connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": CREATE_LOCK})
+            # Bounds are literals: DDL takes no bind parameters
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            created.append(name)
+        month = add_months(month, 1)
+    if created:
+        logger.info("Created message partitions %s", ", ".join(created))
+    return created
+
+
+async def archive_expired(engine: AsyncEngine = async_engine, retention_months: int = MESSAGE_RETENTION_MONTHS,
+                          archive_dir: str = MESSAGE_ARCHIVE_DIR, now: Optional[datetime] = None) -> List[str]:
+    """Detach, archive and drop every partition older than the retention window; returns the files written"""
+    if retention_months <= 0 or engine.dialect.name != "postgresql":
+        return []
+    cutoff = add_months(month_start(now or datetime.now(UTC)), -retention_months)
+    written = []
+    async with engine.connect() as conn:
+        locked = await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": ARCHIVE_LOCK})
+        await conn.commit()
+        if not locked:
+            # Another worker is archiving
+            return []
+        try:
+            for name, attached in await conn.run_sync(monthly_partitions):
+                if partition_month(name) >= cutoff:
+                    continue
+                if attached:
+                    await conn.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+                    await conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+                    await conn.commit()
+                written.append(await _archive(conn, name, archive_dir))
+                await conn.execute(text(f"DROP TABLE {name}"))
+                await conn.commit()
+        finally:
+            await conn.rollback()
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ARCHIVE_LOCK})
+            await conn.commit()
+    return written
+
+
+async def _archive(conn: AsyncConnection, name: str, archive_dir: str) -> str:
+    """Stream a detached partition to ``<archive_dir>/<name>.csv.gz`` and return its path"""
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    partial = path + ".partial"
+    raw = await conn.get_raw_connection()
+    # Compression and every file system call run in a thread; a slow disk must not stall the event loop
+    file, compressed = await asyncio.to_thread(_open_archive, archive_dir, partial)
+    try:
+        async def write(chunk: bytes):
+            await asyncio.to_thread(compressed.write, chunk)
+
+        status = await raw.driver_connection.copy_from_table(name, output=write, format="csv", header=True)
+        await asyncio.to_thread(_finish_archive, file, compressed, partial, path)
+    except BaseException:
+        await asyncio.to_thread(file.close)
+        raise
+    logger.info("Archived message partition %s to %s (%s)", name, path, status)
+    return path
+
+
+def _open_archive(archive_dir: str, partial: str) -> Tuple[BinaryIO, gzip.GzipFile]:
+    os.makedirs(archive_dir, exist_ok=True)
+    file = open(partial, "wb")
+    return file, gzip.GzipFile(fileobj=file, mode="wb")
+
+
+def _finish_archive(file: BinaryIO, compressed: gzip.GzipFile, partial: str, path: str):
+    compressed.close()
+    file.flush()
+    os.fsync(file.fileno())
+    file.close()
+    # Only a complete file gets the final name, so the partition is never dropped before it is on disk
+    os.replace(partial, path)
+
+
+class PartitionMaintainer:
+    def __init__(self, engine: AsyncEngine = async_engine, interval: float = PARTITION_MAINTENANCE_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self.runs = 0
+        self.created = 0
+        self.archived = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return partitioning_enabled(self.engine)
+
+    def start(self):
+        """Keep partitions ahead of the clock and archive expired ones in the background"""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run_once(self):
+        async with self.engine.begin() as conn:
+            if not await conn.run_sync(is_partitioned):
+                return
+            self.created += len(await conn.run_sync(ensure_partitions))
+        # The history cache drops expired rows itself (HistoryCache.expire), on every worker
+        self.archived += len(await archive_expired(self.engine))
+        self.runs += 1
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.warning("Message partition maintenance failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "runs": self.runs, "created": self.created, "archived": self.archived}
+
+
+partition_maintainer = PartitionMaintainer()
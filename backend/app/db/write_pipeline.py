@@ -0,0 +1,311 @@
+"""
+Write-behind pipeline for chat message writes.
+
+Inserts and delivered/seen updates from every socket on the worker are
+queued here and flushed together in a single transaction (along with the
+matching conversation summary updates), either once
+``WRITE_BATCH_SIZE`` operations are waiting or ``WRITE_BATCH_DELAY_MS`` after
+the first one arrived. Each call resolves only after the batch containing it
+has committed, so callers can acknowledge to clients knowing the write is
+durable. Once a batch commits, its changes are applied to the history cache.
+
+Arguments are checked and cast before an operation is queued, so a
+malformed id is rejected to its caller alone. If a batch still fails (a
+foreign key violation, say), its operations are retried one transaction
+each, so only the operation at fault fails and the others still commit.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, UTC
+from types import SimpleNamespace
+from typing import Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import bindparam, insert, update
+
+from app.chat.history_cache import history_cache
+from app.chat.inbox import record_messages, record_seen
+from app.db.database import AsyncSessionLocal
+from app.metrics import DB_COMMIT_SECONDS, WRITE_BATCH_OPERATIONS
+from app.models.message import Message
+
+logger = logging.getLogger("app.db.write_pipeline")
+
+# Flush as soon as this many operations are queued
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "256"))
+# ...or this long after the first queued operation, whichever comes first
+WRITE_BATCH_DELAY_MS = float(os.getenv("WRITE_BATCH_DELAY_MS", "5"))
+
+# Ids are INTEGER columns; a larger value would fail the whole batch on Postgres
+MAX_ID = 2**31 - 1
+
+
+class StoredMessage(NamedTuple):
+    id: int
+    timestamp: datetime
+
+
+class SeenMessage(NamedTuple):
+    id: int
+    from_id: int
+
+
+class SeenRange(NamedTuple):
+    up_to: int
+    count: int
+
+
+class _Operation(NamedTuple):
+    kind: str
+    params: dict
+    future: asyncio.Future
+
+
+def _id(value, name: str) -> int:
+    """``value`` as a row id, or ValueError before it can reach a shared batch"""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} must be an integer id")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer id") from None
+    if not 0 < value <= MAX_ID:
+        raise ValueError(f"{name} is out of range")
+    return value
+
+
+def _log_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Queued write failed: %s", future.exception())
+
+
+class WritePipeline:
+    def __init__(self, session_factory=AsyncSessionLocal, max_batch: int = WRITE_BATCH_SIZE,
+                 max_delay: float = WRITE_BATCH_DELAY_MS / 1000):
+        self.session_factory = session_factory
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self.batches = 0
+        self.operations = 0
+        self._queue: List[_Operation] = []
+        self._has_work = asyncio.Event()
+        self._full = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush whatever is queued and stop the background flusher"""
+        if self._task is not None:
+            # Never cancel: a batch being flushed is already off the queue and would be lost
+            self._stopping = True
+            self._has_work.set()
+            self._full.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        # Left over only if the flusher died
+        while self._queue:
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            await self._flush(batch)
+
+    def insert_message(self, from_id: int, to_id: int, content: str,
+                       timestamp: Optional[datetime] = None) -> "asyncio.Future[StoredMessage]":
+        """Queue a message insert now; the future resolves to its id and timestamp once committed
+
+        Inserts are stored in the order they are queued, so a caller can keep
+        queueing before earlier ones commit.
+        """
+        # Stamp on arrival rather than with the DB clock, which would give every
+        # message in a batch the same transaction timestamp
+        if not isinstance(content, str):
+            raise ValueError("content must be a string")
+        params = {"from_id": _id(from_id, "from_id"), "to_id": _id(to_id, "to_id"), "content": content,
+                  "timestamp": timestamp or datetime.now(UTC)}
+        return self._submit("insert", params)
+
+    async def mark_delivered(self, messages: Iterable[StoredMessage], delivered_at: datetime, wait: bool = True):
+        """Set ``delivered_at`` on the given stored messages
+
+        With ``wait=False`` the update is only queued: it commits with the next
+        batch and a failure is logged rather than raised.
+        """
+        messages = list(messages)
+        if messages:
+            future = self._submit("delivered", {"messages": messages, "at": delivered_at})
+            if wait:
+                await future
+            else:
+                future.add_done_callback(_log_failure)
+
+    async def mark_seen(self, reader_id: int, message_ids: Iterable[int],
+                        seen_at: datetime) -> List[SeenMessage]:
+        """Set ``seen_at`` on unseen messages addressed to ``reader_id``; returns the rows changed"""
+        ids = [_id(message_id, "message_id") for message_id in message_ids]
+        if not ids:
+            return []
+        return await self._submit("seen", {"reader_id": _id(reader_id, "reader_id"), "ids": ids, "at": seen_at})
+
+    async def mark_seen_up_to(self, reader_id: int, sender_id: int, up_to: Optional[int],
+                              seen_at: datetime) -> Optional[SeenRange]:
+        """Set ``seen_at`` on every unseen message from ``sender_id`` to ``reader_id`` with id <= ``up_to``
+
+        ``up_to=None`` covers the whole conversation. Returns the highest id
+        changed and how many rows were updated, or None if nothing was unseen.
+        """
+        return await self._submit("seen_up_to", {
+            "reader_id": _id(reader_id, "reader_id"), "sender_id": _id(sender_id, "sender_id"),
+            "up_to": None if up_to is None else _id(up_to, "up_to"), "at": seen_at,
+        })
+
+    def _submit(self, kind: str, params: dict) -> asyncio.Future:
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append(_Operation(kind, params, future))
+        self._has_work.set()
+        if len(self._queue) >= self.max_batch:
+            self._full.set()
+        return future
+
+    async def _run(self):
+        while True:
+            await self._has_work.wait()
+            if not self._queue:
+                # Woken by stop() with nothing left to flush
+                return
+            if len(self._queue) < self.max_batch and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            if not self._queue and not self._stopping:
+                self._has_work.clear()
+            if len(self._queue) < self.max_batch and not self._stopping:
+                self._full.clear()
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[_Operation]):
+        started = time.perf_counter()
+        try:
+            async with self.session_factory() as db:
+                results, stored, seen_changes = await self._execute(db, batch)
+                await db.commit()
+        except Exception as exc:
+            if len(batch) > 1:
+                # Find the operation at fault: each one alone, so only it fails
+                logger.warning("Write batch of %d operations failed, retrying one by one: %s", len(batch), exc)
+                for op in batch:
+                    await self._flush([op])
+                return
+            for op in batch:
+                if not op.future.done():
+                    op.future.set_exception(exc)
+            return
+
+        history_cache.add_messages(stored)
+        for op in batch:
+            if op.kind == "delivered":
+                history_cache.set_delivered([message.id for message in op.params["messages"]], op.params["at"])
+        for ids, seen_at in seen_changes:
+            history_cache.set_seen(ids, seen_at)
+
+        DB_COMMIT_SECONDS.labels("write_batch").observe(time.perf_counter() - started)
+        WRITE_BATCH_OPERATIONS.observe(len(batch))
+        self.batches += 1
+        self.operations += len(batch)
+        for op in batch:
+            if not op.future.done():
+                op.future.set_result(results.get(id(op)))
+
+    async def _execute(self, db, batch: List[_Operation]):
+        """Run ``batch`` in ``db``'s transaction; returns (results by op, stored messages, seen changes)"""
+        inserts = [op for op in batch if op.kind == "insert"]
+        delivered = [op for op in batch if op.kind == "delivered"]
+        seen = [op for op in batch if op.kind == "seen"]
+        seen_ranges = [op for op in batch if op.kind == "seen_up_to"]
+        results = {}
+        stored = []
+        # (message ids, seen_at) actually changed, for the history cache
+        seen_changes = []
+
+        if inserts:
+            # Rendered as multi-row INSERT ... VALUES (...), (...) RETURNING
+            rows = await db.execute(
+                insert(Message).returning(
+                    Message.id, Message.timestamp, sort_by_parameter_order=True
+                ),
+                [op.params for op in inserts],
+            )
+            for op, row in zip(inserts, rows):
+                results[id(op)] = StoredMessage(row.id, row.timestamp)
+                stored.append(SimpleNamespace(**{**op.params, "id": row.id, "timestamp": row.timestamp}))
+            await record_messages(db, stored)
+
+        if delivered:
+            # Bulk UPDATE by primary key; the timestamp takes Postgres straight to the monthly partition
+            columns = Message.__table__.c
+            await db.execute(
+                update(Message.__table__)
+                .where(columns.id == bindparam("message_id"),
+                       columns.timestamp == bindparam("message_timestamp"))
+                .values(delivered_at=bindparam("at")),
+                [
+                    {"message_id": message.id, "message_timestamp": message.timestamp, "at": op.params["at"]}
+                    for op in delivered
+                    for message in op.params["messages"]
+                ],
+            )
+
+        # One UPDATE ... RETURNING per reader so nobody can mark another user's messages
+        by_reader = defaultdict(list)
+        for op in seen:
+            by_reader[(op.params["reader_id"], op.params["at"])].append(op)
+        for (reader_id, seen_at), ops in by_reader.items():
+            ids = {message_id for op in ops for message_id in op.params["ids"]}
+            rows = (await db.execute(
+                update(Message)
+                .where(
+                    Message.id.in_(ids),
+                    Message.to_id == reader_id,
+                    Message.seen_at.is_(None),
+                )
+                .values(seen_at=seen_at)
+                .returning(Message.id, Message.from_id)
+                .execution_options(synchronize_session=False)
+            )).all()
+            changed = {row.id: SeenMessage(row.id, row.from_id) for row in rows}
+            seen_changes.append((changed, seen_at))
+            await record_seen(db, reader_id, Counter(row.from_id for row in rows))
+            for op in ops:
+                results[id(op)] = [changed[i] for i in op.params["ids"] if i in changed]
+
+        for op in seen_ranges:
+            params = op.params
+            statement = update(Message).where(
+                Message.from_id == params["sender_id"],
+                Message.to_id == params["reader_id"],
+                Message.seen_at.is_(None),
+            )
+            if params["up_to"] is not None:
+                statement = statement.where(Message.id <= params["up_to"])
+            ids = (await db.scalars(
+                statement.values(seen_at=params["at"])
+                .returning(Message.id)
+                .execution_options(synchronize_session=False)
+            )).all()
+            if ids:
+                seen_changes.append((ids, params["at"]))
+                await record_seen(db, params["reader_id"], {params["sender_id"]: len(ids)})
+                results[id(op)] = SeenRange(max(ids), len(ids))
+
+        return results, stored, seen_changes
+
+
+write_pipeline = WritePipeline()
@@ -0,0 +1,150 @@
+"""
+Structured, non-blocking logging.
+
+Records are put on a bounded in-memory queue by a ``QueueHandler`` and
+formatted and written by a ``QueueListener`` thread, so log I/O never runs on
+the event loop. When the queue is full new records are dropped (and counted)
+rather than blocking the caller.
+
+Hot-path categories are separate loggers under ``app.chat`` and can be
+sampled: ``LOG_SAMPLE_RATES=app.chat.message=0.01`` keeps one in a hundred
+of that logger's records below WARNING. The sampling decision is made before
+a record is built, so a skipped call costs about as much as a disabled
+level. Fields passed through ``extra`` are
+emitted as JSON keys (``LOG_FORMAT=json``, the default) or ``key=value``
+pairs (``LOG_FORMAT=text``).
+"""
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from app.metrics import LOG_RECORDS_DROPPED
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Records buffered for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# logger=rate pairs; records below WARNING from that logger are kept with this probability
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "app.chat.message=0.01,app.chat.delivery=0.01")
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def _extra(record: logging.LogRecord) -> Dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any ``extra`` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_extra(record),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Plain lines with ``extra`` fields appended as key=value pairs"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = " ".join(f"{key}={value}" for key, value in _extra(record).items())
+        return f"{line} {fields}" if fields else line
+
+
+class SampledLogger(logging.LoggerAdapter):
+    """Logger that keeps a fraction ``rate`` of its records below WARNING"""
+
+    def __init__(self, logger: logging.Logger, rate: float):
+        super().__init__(logger, None)
+        self.rate = rate
+
+    def isEnabledFor(self, level: int) -> bool:
+        if not self.logger.isEnabledFor(level):
+            return False
+        return level >= logging.WARNING or random.random() < self.rate
+
+    def process(self, msg, kwargs):
+        # Pass the caller's extra through untouched
+        return msg, kwargs
+
+
+_sample_rates = parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+def get_logger(name: str):
+    """``logging.getLogger(name)``, sampled if ``LOG_SAMPLE_RATES`` names it"""
+    logger = logging.getLogger(name)
+    rate = _sample_rates.get(name)
+    return SampledLogger(logger, rate) if rate is not None and rate < 1 else logger
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Enqueue records without formatting them; drop instead of blocking when the queue is full"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener thread formats; records never leave the process
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, queue_size: int = LOG_QUEUE_SIZE):
+    """Route the ``app`` loggers through the queue and start the writer thread"""
+    global _handler, _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    _handler = DroppingQueueHandler(queue.Queue(queue_size))
+
+    root = logging.getLogger("app")
+    root.setLevel(level)
+    root.addHandler(_handler)
+    root.propagate = False
+
+    _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Write out whatever is still queued and stop the writer thread"""
+    global _handler, _listener
+    if _listener is not None:
+        logging.getLogger("app").removeHandler(_handler)
+        _listener.stop()
+        _handler = _listener = None
@@ -1,45 +1,98 @@
+import asyncio
+import logging
 import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request
-from app.db.database import Base, engine
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 from app.auth import routes as auth_routes
+from app.auth.google import google_verifier
+from app.auth.profiles import profile_cache
 from fastapi.middleware.cors import CORSMiddleware
 from app.chat import routes as chat_routes
-from sqlalchemy.exc import OperationalError
+from app.chat.history_cache import history_cache
+from app.chat.manager import manager
+from app.chat.ratelimit import RATE_LIMIT_ENABLED
+from app.db.health import database_probe, wait_for_database, warm_pool
+from app.db.migrations import DB_MIGRATE_ON_STARTUP, LATEST_VERSION, upgrade
+from app.db.partitions import partition_maintainer
+from app.db.write_pipeline import write_pipeline
+from app.utils.sanitizer_pool import sanitizer_pool
+from app.utils.security import message_cache, url_cache
+from app import metrics
+from app.log import configure_logging, shutdown_logging
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
 # Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
+limiter = Limiter(key_func=get_remote_address, enabled=RATE_LIMIT_ENABLED)
+
+logger = logging.getLogger("app.main")
+
+# Gauges computed at scrape time from state the app already keeps
+metrics.CONNECTED_SOCKETS.set_function(lambda: len(manager.active_connections))
+metrics.register_collector(metrics.StatsCollector("chat_cache", lambda: {
+    "profiles": profile_cache.by_id.stats(),
+    "profiles_by_google_id": profile_cache.ids_by_google_id.stats(),
+    "tokens": google_verifier.token_cache.stats(),
+    "urls": url_cache.stats(),
+    "messages": message_cache.stats(),
+    "history": history_cache.stats(),
+}))
+metrics.register_collector(metrics.StatsCollector("message_partitions", lambda: {
+    "messages": partition_maintainer.stats(),
+}))
+metrics.register_collector(metrics.StatsCollector("chat_outbound", lambda: {
+    "queues": manager.get_queue_stats(),
+}))
+metrics.register_collector(metrics.StatsCollector("chat_ratelimit", lambda: {
+    "limiter": chat_routes.rate_limiter.stats(),
+    "typing": chat_routes.typing_coalescer.stats(),
+}))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    max_retries = 5
-    retry_delay = 2
-    
-    for attempt in range(max_retries):
-        try:
-            Base.metadata.create_all(bind=engine)
-            print("Database tables created successfully")
-            break
-        except OperationalError as e:
-            if attempt < max_retries - 1:
-                print(f"Database connection failed (attempt {attempt + 1}/{max_retries}). Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-                retry_delay *= 2  # Exponential backoff
-            else:
-                print("Failed to connect to database after all retries")
-                raise e
-    
+    started = time.perf_counter()
+    configure_logging()
+    await wait_for_database()
+    if DB_MIGRATE_ON_STARTUP:
+        await asyncio.to_thread(upgrade)
+    _, schema_version = await asyncio.gather(warm_pool(), database_probe.read_schema_version())
+    if schema_version < LATEST_VERSION:
+        # Serve anyway (liveness stays up) but report unready until the schema catches up
+        logger.error(
+            "Database schema is at version %d, this build needs %d; run python -m app.db.migrations",
+            schema_version, LATEST_VERSION,
+        )
+
+    # Join the cross-worker routing backend (no-op for the in-process default)
+    await manager.start()
+    write_pipeline.start()
+    partition_maintainer.start()
+    sanitizer_pool.start()
+    # Fetch Google's signing keys for local ID token verification
+    google_verifier.start()
+
+    app.state.ready = True
+    metrics.STARTUP_SECONDS.set(time.perf_counter() - started)
+    logger.info("Started in %.0f ms", (time.perf_counter() - started) * 1000)
     yield
-    # Shutdown (if needed)
+    # Shutdown: stop taking traffic, then flush queued message writes before leaving
+    app.state.ready = False
+    await write_pipeline.stop()
+    await partition_maintainer.stop()
+    await manager.stop()
+    sanitizer_pool.stop()
+    await google_verifier.stop()
+    await chat_routes.rate_limiter.stop()
+    shutdown_logging()
 
 app = FastAPI(lifespan=lifespan)
 
 # Configure rate limiter
 app.state.limiter = limiter
+app.state.ready = False
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
 app.include_router(auth_routes.router)
@@ -56,4 +109,24 @@ app.add_middleware(
 @app.get("/health")
 @limiter.limit("10/minute")
 def health_check(request: Request):
-    return {"status": "ok"}
\ No newline at end of file
+    """Liveness: the process is up and serving; see /ready for its dependencies"""
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: startup finished, the schema is migrated and the database answers (503 otherwise)"""
+    database = await database_probe.check()
+    schema = {"version": database_probe.schema_version, "required": LATEST_VERSION}
+    ready = (
+        app.state.ready and database["ok"]
+        and database_probe.schema_version is not None and database_probe.schema_version >= LATEST_VERSION
+    )
+    return JSONResponse(
+        {"status": "ready" if ready else "unavailable", "database": database, "schema": schema},
+        status_code=200 if ready else 503,
+    )
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,126 @@
+"""
+Prometheus metrics for the chat server, served at ``GET /metrics``.
+
+Hot paths only touch pre-bound label children (a dict lookup plus an
+``observe``/``inc``). Gauges that mirror existing state, such as connected
+sockets or cache counters, are computed at scrape time instead of being
+updated on every change. Set ``METRICS_ENABLED=false`` to turn every metric
+into a no-op.
+"""
+import os
+import time
+from typing import Callable, Dict, Iterable
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Events with their own label value; anything else a client sends is counted as "other"
+CHAT_EVENTS = ("message", "typing", "message_seen", "mark_messages_seen", "get_connected_users")
+
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SIZE_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+
+class _Noop:
+    """Stands in for any metric (or label child) when metrics are disabled"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def observe(self, amount: float):
+        pass
+
+    def set(self, value: float):
+        pass
+
+    def set_function(self, f: Callable[[], float]):
+        pass
+
+
+def _metric(cls, *args, **kwargs):
+    return cls(*args, **kwargs) if METRICS_ENABLED else _Noop()
+
+
+STARTUP_SECONDS = _metric(Gauge, "chat_startup_seconds", "Time from the start of lifespan until this worker was ready")
+CONNECTED_SOCKETS = _metric(Gauge, "chat_connected_sockets", "WebSocket connections open on this worker")
+EVENTS_RECEIVED = _metric(Counter, "chat_events_received_total", "WebSocket frames received, by event", ["event"])
+EVENT_SECONDS = _metric(
+    Histogram, "chat_event_handler_seconds", "Time spent handling a received frame, by event",
+    ["event"], buckets=FAST_BUCKETS,
+)
+DB_COMMIT_SECONDS = _metric(
+    Histogram, "chat_db_commit_seconds", "Time to execute and commit a batch of message writes",
+    ["operation"], buckets=FAST_BUCKETS,
+)
+WRITE_BATCH_OPERATIONS = _metric(
+    Histogram, "chat_write_batch_operations", "Operations committed per write-pipeline batch", buckets=SIZE_BUCKETS,
+)
+VALIDATION_SECONDS = _metric(
+    Histogram, "chat_validation_seconds", "Time to validate and sanitize one chat message", buckets=FAST_BUCKETS,
+)
+BROADCAST_RECIPIENTS = _metric(
+    Histogram, "chat_broadcast_recipients", "Sockets a broadcast was queued on", buckets=SIZE_BUCKETS,
+)
+BROADCAST_SECONDS = _metric(
+    Histogram, "chat_broadcast_seconds", "Time to queue one broadcast on every socket", buckets=FAST_BUCKETS,
+)
+SEND_FAILURES = _metric(
+    Counter, "chat_send_failures_total", "Outbound frames or sockets lost, by reason", ["reason"],
+)
+EVENTS_RATE_LIMITED = _metric(
+    Counter, "chat_events_rate_limited_total", "WebSocket frames rejected by the per-user rate limit, by event",
+    ["event"],
+)
+PENDING_DRAINED = _metric(
+    Histogram, "chat_pending_drained_messages", "Queued messages delivered when a user connects", buckets=SIZE_BUCKETS,
+)
+LOG_RECORDS_DROPPED = _metric(
+    Counter, "chat_log_records_dropped_total", "Log records dropped because the log queue was full",
+)
+
+# Pre-bound children so the hot path skips the labels() lookup
+_EVENT_COUNTERS = {event: EVENTS_RECEIVED.labels(event) for event in CHAT_EVENTS + ("other",)}
+_EVENT_TIMERS = {event: EVENT_SECONDS.labels(event) for event in CHAT_EVENTS + ("other",)}
+
+
+def observe_event(event: str, started: float):
+    """Count a received frame and record how long its handler took since ``started``"""
+    if not isinstance(event, str) or event not in _EVENT_COUNTERS:
+        event = "other"
+    _EVENT_COUNTERS[event].inc()
+    _EVENT_TIMERS[event].observe(time.perf_counter() - started)
+
+
+class StatsCollector:
+    """Exports ``{name: stats()}`` dicts (cache counters, queue stats) as gauges at scrape time"""
+
+    def __init__(self, prefix: str, sources: Callable[[], Dict[str, Dict]]):
+        self.prefix = prefix
+        self.sources = sources
+
+    def collect(self) -> Iterable[GaugeMetricFamily]:
+        families: Dict[str, GaugeMetricFamily] = {}
+        for source, stats in self.sources().items():
+            for key, value in stats.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                name = f"{self.prefix}_{key}"
+                if name not in families:
+                    families[name] = GaugeMetricFamily(name, f"{self.prefix} {key}", labels=["source"])
+                families[name].add_metric([source], value)
+        return families.values()
+
+
+def register_collector(collector):
+    if METRICS_ENABLED:
+        REGISTRY.register(collector)
+
+
+def render():
+    """Body and content type for the /metrics endpoint"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from app.db.database import Base
+
+
+class ConversationSummary(Base):
+    """One participant's view of a conversation: latest message and unread count"""
+    __tablename__ = "conversation_summaries"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    peer_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    last_message_id = Column(Integer, nullable=False)
+    last_from_id = Column(Integer, nullable=False)
+    last_message = Column(String, nullable=False)
+    last_timestamp = Column(DateTime(timezone=True), nullable=False)
+    unread_count = Column(Integer, nullable=False, default=0)
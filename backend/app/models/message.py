@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime, UTC
 from app.db.database import Base
@@ -18,4 +18,18 @@ class Message(Base):
     seen_at = Column(DateTime(timezone=True), nullable=True, default=None)
 
     sender = relationship("User", foreign_keys=[from_id])
-    receiver = relationship("User", foreign_keys=[to_id])
\ No newline at end of file
+    receiver = relationship("User", foreign_keys=[to_id])
+
+    # Fetch server-generated columns (timestamp) with RETURNING on insert
+    __mapper_args__ = {"eager_defaults": True}
+
+    __table_args__ = (
+        # One direction of a conversation in keyset order; history reads walk it per direction
+        Index("ix_messages_conversation", "from_id", "to_id", "timestamp", "id"),
+        # Undelivered messages per recipient, oldest first; drained on connect
+        Index(
+            "ix_messages_pending", "to_id", "timestamp", "id",
+            postgresql_where=delivered_at.is_(None),
+            sqlite_where=delivered_at.is_(None),
+        ),
+    )
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""
+Optional worker pool for message sanitization.
+
+``bleach.clean`` is pure Python; with ``SANITIZE_EXECUTOR=off`` (the default)
+it runs inline on the event loop. ``thread`` or ``process`` moves messages
+that miss the plain-text fast path onto an executor instead. Messages
+arriving while a batch is in flight are collected and sent together through
+``validate_batch``, so the executor round-trip is paid once per batch rather
+than once per message.
+
+``thread`` keeps the loop responsive (the GIL is released between bytecode
+slices) but adds no throughput; ``process`` also sanitizes in parallel.
+"""
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from app.utils.security import ValidationResult, check_message_content, needs_sanitizing, validate_batch
+
+# Where to sanitize messages that need bleach: off | thread | process
+SANITIZE_EXECUTOR = os.getenv("SANITIZE_EXECUTOR", "off")
+# Executor size; defaults to the number of CPUs
+SANITIZE_WORKERS = int(os.getenv("SANITIZE_WORKERS", "0")) or os.cpu_count() or 1
+# Most messages handed to one validate_batch call
+SANITIZE_BATCH_SIZE = int(os.getenv("SANITIZE_BATCH_SIZE", "64"))
+
+SANITIZE_MODES = ("off", "thread", "process")
+
+
+class SanitizerPool:
+    def __init__(self, mode: str = SANITIZE_EXECUTOR, workers: int = SANITIZE_WORKERS,
+                 max_batch: int = SANITIZE_BATCH_SIZE):
+        if mode not in SANITIZE_MODES:
+            raise ValueError(f"Unknown sanitize executor: {mode}")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.max_batch = max(1, max_batch)
+        self.batches = 0
+        self.offloaded = 0
+        self._executor: Optional[Executor] = None
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._in_flight = 0
+
+    def start(self):
+        if self.mode == "off" or self._executor is not None:
+            return
+        if self.mode == "thread":
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="sanitize")
+        else:
+            self._executor = ProcessPoolExecutor(self.workers)
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def check(self, message: str) -> ValidationResult:
+        """Validate one message, on the executor if it needs sanitizing"""
+        if self._executor is None or not needs_sanitizing(message):
+            return check_message_content(message)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((message, future))
+        self._dispatch()
+        return await future
+
+    async def check_batch(self, messages: List[str]) -> List[ValidationResult]:
+        """Validate many messages with as few executor round-trips as possible"""
+        if self._executor is None:
+            return validate_batch(messages)
+        return list(await asyncio.gather(*(self.check(message) for message in messages)))
+
+    def _dispatch(self):
+        # Keep at most one batch per worker in flight; later arrivals wait and
+        # ride along in the next batch
+        while self._pending and self._in_flight < self.workers:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            self._in_flight += 1
+            asyncio.create_task(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, validate_batch, [m for m, _ in batch])
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+        else:
+            self.batches += 1
+            self.offloaded += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._in_flight -= 1
+            self._dispatch()
+
+
+sanitizer_pool = SanitizerPool()
@@ -1,6 +1,11 @@
+import os
 import re
+import string
+import threading
+import time
 import bleach
-from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
 from urllib.parse import urlparse
 import html
 
@@ -8,6 +13,122 @@ import html
 ALLOWED_TAGS = ['b', 'i', 'em', 'strong', 'u']
 ALLOWED_ATTRIBUTES = {}
 
+MAX_MESSAGE_LENGTH = 1000
+
+# Compiled once at import instead of on every call
+URL_PATTERN = re.compile(r'https?://[^\s<>"{}|\\^`\[\]]+')
+# Anything bleach/html.escape could change: markup, entities, CR and control characters.
+# Plain ASCII text without these (and without links) skips sanitization entirely.
+NEEDS_SANITIZING = re.compile(r'[<>&\r\x00-\x08\x0b-\x1f]|http')
+
+# str.translate tables that delete the characters being counted
+_DROP_UPPERCASE = str.maketrans('', '', string.ascii_uppercase)
+_DROP_SPECIAL_CHARS = str.maketrans('', '', '!@#$%^&*()_+-=[]{};\'\\:"|,.<>?')
+
+
+# Memoization of URL verdicts and of validation results for short messages.
+# Memory is bounded by entry count and by only caching short keys, so a flood
+# of unique inputs just churns the cache.
+URL_CACHE_SIZE = int(os.getenv("URL_CACHE_SIZE", "4096"))
+URL_CACHE_MAX_LENGTH = int(os.getenv("URL_CACHE_MAX_LENGTH", "512"))
+MESSAGE_CACHE_SIZE = int(os.getenv("MESSAGE_CACHE_SIZE", "4096"))
+MESSAGE_CACHE_MAX_LENGTH = int(os.getenv("MESSAGE_CACHE_MAX_LENGTH", "64"))
+# Seconds a cached entry stays valid; 0 disables expiry
+SECURITY_CACHE_TTL = float(os.getenv("SECURITY_CACHE_TTL", "300"))
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Size-bounded LRU cache with optional TTL and hit/miss/eviction counters (thread-safe)"""
+
+    def __init__(self, maxsize: int, ttl: float = 0):
+        self.maxsize = max(0, maxsize)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=_MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if not expires_at or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        """Store ``value``; ``ttl`` overrides the cache-wide TTL for this entry"""
+        if not self.maxsize:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else 0
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+url_cache = LRUCache(URL_CACHE_SIZE, SECURITY_CACHE_TTL)
+message_cache = LRUCache(MESSAGE_CACHE_SIZE, SECURITY_CACHE_TTL)
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """Hit/miss/eviction counters for the URL and message caches"""
+    return {"urls": url_cache.stats(), "messages": message_cache.stats()}
+
+
+class ValidationResult(NamedTuple):
+    """Outcome of validating one message; ``blocked_urls`` holds (url, reason) pairs"""
+    is_valid: bool
+    sanitized_message: str = ''
+    errors: Tuple[str, ...] = ()
+    warnings: Tuple[str, ...] = ()
+    detected_urls: Tuple[str, ...] = ()
+    blocked_urls: Tuple[Tuple[str, str], ...] = ()
+
+    def as_dict(self) -> Dict[str, any]:
+        """The dict shape returned by ``validate_message_content``"""
+        return {
+            'is_valid': self.is_valid,
+            'sanitized_message': self.sanitized_message,
+            'errors': list(self.errors),
+            'warnings': list(self.warnings),
+            'detected_urls': list(self.detected_urls),
+            'blocked_urls': [{'url': url, 'reason': reason} for url, reason in self.blocked_urls],
+        }
+
 def sanitize_message(message: str) -> str:
     """
     Sanitize message content to prevent XSS attacks.
@@ -26,7 +147,7 @@ def sanitize_message(message: str) -> str:
     
     return sanitized.strip()
 
-def validate_message_length(message: str, max_length: int = 1000) -> bool:
+def validate_message_length(message: str, max_length: int = MAX_MESSAGE_LENGTH) -> bool:
     """
     Validate message length.
     
@@ -49,17 +170,20 @@ def detect_potential_spam(message: str) -> bool:
     Returns:
         True if potential spam is detected
     """
+    length = len(message)
+    if length <= 10:
+        return False
+
     # Check for excessive repetition
-    if len(set(message.lower())) < len(message) * 0.3 and len(message) > 20:
+    if length > 20 and len(set(message.lower())) < length * 0.3:
         return True
     
     # Check for excessive capitalization
-    if len(re.findall(r'[A-Z]', message)) > len(message) * 0.5 and len(message) > 10:
+    if length - len(message.translate(_DROP_UPPERCASE)) > length * 0.5:
         return True
     
     # Check for excessive special characters
-    special_chars = re.findall(r'[!@#$%^&*()_+\-=\[\]{};\'\\:"|,.<>?]', message)
-    if len(special_chars) > len(message) * 0.3 and len(message) > 10:
+    if length - len(message.translate(_DROP_SPECIAL_CHARS)) > length * 0.3:
         return True
     
     return False
@@ -74,9 +198,7 @@ def extract_urls(message: str) -> List[str]:
     Returns:
         List of URLs found in the message
     """
-    url_pattern = r'https?://[^\s<>"{}|\\^`\[\]]+'
-    urls = re.findall(url_pattern, message)
-    return urls
+    return URL_PATTERN.findall(message)
 
 def validate_url_safety(url: str) -> Tuple[bool, str]:
     """
@@ -88,6 +210,15 @@ def validate_url_safety(url: str) -> Tuple[bool, str]:
     Returns:
         Tuple of (is_safe, reason)
     """
+    if len(url) > URL_CACHE_MAX_LENGTH:
+        return _check_url_safety(url)
+    verdict = url_cache.get(url)
+    if verdict is _MISSING:
+        verdict = _check_url_safety(url)
+        url_cache.set(url, verdict)
+    return verdict
+
+def _check_url_safety(url: str) -> Tuple[bool, str]:
     try:
         parsed = urlparse(url)
         
@@ -117,67 +248,110 @@ def validate_url_safety(url: str) -> Tuple[bool, str]:
     except Exception as e:
         return False, f"URL validation error: {str(e)}"
 
-def validate_message_content(message: str) -> Dict[str, any]:
+def check_message_content(message: str) -> ValidationResult:
     """
-    Comprehensive message validation and sanitization.
+    Validate and sanitize a message in a single pass.
     
     Args:
         message: Raw message content
         
     Returns:
-        Dict containing validation results and sanitized message
+        ValidationResult with the sanitized message, errors and warnings
     """
-    result = {
-        'is_valid': True,
-        'sanitized_message': '',
-        'errors': [],
-        'warnings': [],
-        'detected_urls': [],
-        'blocked_urls': []
-    }
-    
+    # Short messages ("ok", "thanks", a pasted link) repeat a lot
+    if len(message) > MESSAGE_CACHE_MAX_LENGTH:
+        return _check_message_content(message)
+    result = message_cache.get(message)
+    if result is _MISSING:
+        result = _check_message_content(message)
+        message_cache.set(message, result)
+    return result
+
+def _check_message_content(message: str) -> ValidationResult:
     # Check if message is empty
     if not message.strip():
-        result['is_valid'] = False
-        result['errors'].append("Message cannot be empty")
-        return result
+        return ValidationResult(False, errors=("Message cannot be empty",))
     
     # Validate message length
-    if not validate_message_length(message):
-        result['is_valid'] = False
-        result['errors'].append("Message too long (max 1000 characters)")
-        return result
+    if len(message) > MAX_MESSAGE_LENGTH:
+        return ValidationResult(False, errors=(f"Message too long (max {MAX_MESSAGE_LENGTH} characters)",))
+    
+    # Fast path: nothing for the sanitizer to change and no URLs to check
+    if not needs_sanitizing(message):
+        sanitized = message.strip()
+        warnings = ["Message may contain spam patterns"] if detect_potential_spam(sanitized) else []
+        if sanitized != message:
+            warnings.append("Message was sanitized for security")
+        return ValidationResult(True, sanitized, warnings=tuple(warnings))
     
     # Sanitize the message
     sanitized = sanitize_message(message)
-    result['sanitized_message'] = sanitized
+    warnings = []
     
     # Detect potential spam
     if detect_potential_spam(sanitized):
-        result['warnings'].append("Message may contain spam patterns")
+        warnings.append("Message may contain spam patterns")
     
     # Extract and validate URLs
-    urls = extract_urls(sanitized)
-    result['detected_urls'] = urls
-    
+    urls = tuple(extract_urls(sanitized))
+    blocked = []
     for url in urls:
         is_safe, reason = validate_url_safety(url)
         if not is_safe:
-            result['blocked_urls'].append({'url': url, 'reason': reason})
-            result['warnings'].append(f"Potentially unsafe URL detected: {url}")
+            blocked.append((url, reason))
+            warnings.append(f"Potentially unsafe URL detected: {url}")
     
     # Log if message was modified during sanitization
     if sanitized != message:
-        result['warnings'].append("Message was sanitized for security")
+        warnings.append("Message was sanitized for security")
     
-    return result
+    return ValidationResult(True, sanitized, (), tuple(warnings), urls, tuple(blocked))
+
+def needs_sanitizing(message: str) -> bool:
+    """
+    Check whether a message misses the fast path and goes through bleach.
+    
+    Args:
+        message: Raw message content
+        
+    Returns:
+        True if sanitizing the message is more than a strip()
+    """
+    return not message.isascii() or NEEDS_SANITIZING.search(message) is not None
+
+def validate_batch(messages: List[str]) -> List[ValidationResult]:
+    """
+    Validate several messages in one call (one executor round-trip when offloaded).
+    
+    Args:
+        messages: Raw message contents
+        
+    Returns:
+        One ValidationResult per message, in order
+    """
+    return [check_message_content(message) for message in messages]
 
-def validate_user_input(input_data: Dict[str, any]) -> Dict[str, any]:
+def validate_message_content(message: str) -> Dict[str, any]:
+    """
+    Comprehensive message validation and sanitization.
+    
+    Args:
+        message: Raw message content
+        
+    Returns:
+        Dict containing validation results and sanitized message
+    """
+    return check_message_content(message).as_dict()
+
+def validate_user_input(input_data: Dict[str, any],
+                        message_validation: Optional[ValidationResult] = None) -> Dict[str, any]:
     """
     Validate user input from WebSocket messages.
     
     Args:
         input_data: Dictionary containing user input
+        message_validation: Result of checking ``input_data['message']`` if
+            already computed (e.g. in a worker pool)
         
     Returns:
         Dict containing validation results
@@ -185,6 +359,7 @@ def validate_user_input(input_data: Dict[str, any]) -> Dict[str, any]:
     result = {
         'is_valid': True,
         'errors': [],
+        'warnings': [],
         'sanitized_data': {}
     }
     
@@ -207,12 +382,14 @@ def validate_user_input(input_data: Dict[str, any]) -> Dict[str, any]:
     
     # Validate message content if present
     if 'message' in input_data:
-        message_validation = validate_message_content(input_data['message'])
-        if not message_validation['is_valid']:
+        if message_validation is None:
+            message_validation = check_message_content(input_data['message'])
+        if not message_validation.is_valid:
             result['is_valid'] = False
-            result['errors'].extend(message_validation['errors'])
+            result['errors'].extend(message_validation.errors)
         else:
-            result['sanitized_data']['message'] = message_validation['sanitized_message']
+            result['sanitized_data']['message'] = message_validation.sanitized_message
+            result['warnings'].extend(message_validation.warnings)
     
     # Validate user IDs
     if 'to' in input_data:
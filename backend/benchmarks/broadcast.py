@@ -0,0 +1,82 @@
+"""
+Presence broadcast fan-out with a mix of fast and deliberately slow clients.
+
+Compares the previous sequential, encode-per-recipient loop with
+``ConnectionManager.broadcast_json``, which only queues the frame on each
+connection and lets per-connection writer tasks deliver it. The time until
+every fast client has the frame should be independent of how slow the
+slowest client is; the sequential loop pays for every slow client in turn.
+
+    python -m benchmarks.broadcast --sockets 5000 --slow 10 --slow-delay 0.5
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from app.chat.manager import ConnectionManager
+
+
+class FakeWebSocket:
+    """Stands in for a Starlette WebSocket; ``delay`` simulates a slow TCP window"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.sent = 0
+
+    async def send_text(self, payload: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            await asyncio.sleep(0)
+        self.sent += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def legacy_broadcast(sockets, data: dict):
+    for websocket in sockets:
+        await websocket.send_text(json.dumps(data))
+
+
+async def main(args):
+    payload = {"event": "users_updated", "connected_users": [{"user_id": str(i)} for i in range(50)]}
+    sockets = [FakeWebSocket(args.slow_delay if i < args.slow else 0.0) for i in range(args.sockets)]
+
+    started = time.perf_counter()
+    await legacy_broadcast(sockets, payload)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({"mode": "sequential", "sockets": args.sockets, "slow_sockets": args.slow,
+                      "all_delivered_s": round(elapsed, 3)}))
+
+    manager = ConnectionManager(send_timeout=args.send_timeout)
+    sockets = [FakeWebSocket(args.slow_delay if i < args.slow else 0.0) for i in range(args.sockets)]
+    fast = sockets[args.slow:]
+    for i, websocket in enumerate(sockets):
+        manager.register(str(i), websocket)
+    started = time.perf_counter()
+    await manager.broadcast_json(payload)
+    enqueued = time.perf_counter() - started
+    while any(ws.sent == 0 for ws in fast):
+        await asyncio.sleep(0.001)
+    fast_delivered = time.perf_counter() - started
+    await asyncio.sleep(args.send_timeout * 1.5)
+    print(json.dumps({
+        "mode": "queued",
+        "sockets": args.sockets,
+        "slow_sockets": args.slow,
+        "enqueue_s": round(enqueued, 4),
+        "fast_delivered_s": round(fast_delivered, 3),
+        "remaining_connections": manager.get_connected_users_count(),
+        **manager.get_queue_stats(),
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sockets", type=int, default=5000)
+    parser.add_argument("--slow", type=int, default=10)
+    parser.add_argument("--slow-delay", type=float, default=0.5)
+    parser.add_argument("--send-timeout", type=float, default=0.25)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,119 @@
+"""
+Encode/decode cost of the WebSocket frames on the message hot path.
+
+``dict`` builds each frame the way the handlers used to (a dict with
+``isoformat()`` timestamps passed to ``json.dumps``); ``orjson`` and ``json``
+build the typed events from ``app.chat.protocol`` and ``encode`` them with
+that codec (``WS_JSON_CODEC``). Decoding parses the inbound ``message``,
+``typing`` and ``mark_messages_seen`` frames. Each codec runs in a fresh
+interpreter, since the codec is chosen at import.
+
+    python -m benchmarks.codec --frames 100000 --pending 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import UTC, datetime
+
+INBOUND = [
+    '{"event":"message","to":"42","message":"hello there, see you at five?"}',
+    '{"event":"typing","to":"42","is_typing":true}',
+    '{"event":"mark_messages_seen","from_id":"42","up_to":1234}',
+]
+
+
+def dict_frames(now: datetime, pending: list) -> list:
+    return [
+        json.dumps({
+            "event": "message_sent", "message_id": 1234, "to": "42",
+            "message": "hello there, see you at five?", "timestamp": now.isoformat(),
+        }),
+        json.dumps({
+            "event": "new_message", "from": "7", "message_id": 1234,
+            "message": "hello there, see you at five?", "timestamp": now.isoformat(),
+        }),
+        json.dumps({
+            "event": "message_delivered", "message_id": 1234,
+            "timestamp": now.isoformat(), "delivered_at": now.isoformat(),
+        }),
+        json.dumps({"event": "typing", "from": "7", "is_typing": True}),
+        json.dumps({
+            "event": "pending_messages",
+            "messages": [{**row, "timestamp": row["timestamp"].isoformat()} for row in pending],
+            "delivered_at": now.isoformat(),
+        }),
+    ]
+
+
+def event_frames(now: datetime, pending: list) -> list:
+    from app.chat.protocol import MessageDelivered, MessageSent, NewMessage, PendingMessages, Typing, encode
+
+    return [
+        encode(MessageSent(1234, "42", "hello there, see you at five?", now)),
+        encode(NewMessage("7", 1234, "hello there, see you at five?", now)),
+        encode(MessageDelivered(1234, now, now)),
+        encode(Typing("7", True)),
+        encode(PendingMessages(pending, now)),
+    ]
+
+
+def run(mode: str, frames: int, pending_size: int) -> dict:
+    now = datetime.now(UTC)
+    pending = [
+        {"from": "7", "message_id": i, "message": "hello there, see you at five?", "timestamp": now}
+        for i in range(pending_size)
+    ]
+    if mode == "dict":
+        build, loads = dict_frames, json.loads
+    else:
+        from app.chat.protocol import decode
+
+        build, loads = event_frames, decode
+
+    rounds = max(1, frames // 5)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        build(now, pending)
+    encode_seconds = time.perf_counter() - started
+
+    rounds_in = max(1, frames // len(INBOUND))
+    started = time.perf_counter()
+    for _ in range(rounds_in):
+        for data in INBOUND:
+            loads(data)
+    decode_seconds = time.perf_counter() - started
+
+    return {
+        "us_per_outbound_round": round(encode_seconds / rounds * 1e6, 2),
+        "us_per_inbound_frame": round(decode_seconds / (rounds_in * len(INBOUND)) * 1e6, 3),
+    }
+
+
+def run_child(mode: str, args) -> dict:
+    env = dict(os.environ)
+    env["WS_JSON_CODEC"] = "json" if mode == "dict" else mode
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.codec", "--child", mode,
+         "--frames", str(args.frames), "--pending", str(args.pending)],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=100000)
+    parser.add_argument("--pending", type=int, default=50, help="messages in the pending_messages frame")
+    parser.add_argument("--child", choices=("dict", "orjson", "json"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(run(args.child, args.frames, args.pending)))
+    else:
+        for mode in ("dict", "json", "orjson"):
+            try:
+                print(json.dumps({"codec": mode, **run_child(mode, args)}))
+            except subprocess.CalledProcessError as error:
+                print(json.dumps({"codec": mode, "error": error.stderr.strip().splitlines()[-1]}))
@@ -0,0 +1,89 @@
+"""
+Shared helpers for the backend benchmarks.
+
+Benchmarks are run from the ``backend`` directory, e.g.::
+
+    python -m benchmarks.ws_latency
+
+and default to a throwaway SQLite database so they need no running services.
+Set ``DATABASE_URL`` to point them at Postgres instead.
+"""
+import asyncio
+import os
+import socket
+import statistics
+import tempfile
+from contextlib import asynccontextmanager
+from typing import List, Sequence
+
+
+def configure_database() -> str:
+    """Point the app at a throwaway SQLite file unless DATABASE_URL is set"""
+    if not os.getenv("DATABASE_URL"):
+        path = os.path.join(tempfile.mkdtemp(prefix="teachly-bench-"), "bench.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    return os.environ["DATABASE_URL"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of ``samples`` (pct in 0..100)"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: Sequence[float]) -> dict:
+    """Latency summary in milliseconds for a list of second-valued samples"""
+    ms = [s * 1000 for s in samples]
+    return {
+        "count": len(ms),
+        "mean_ms": round(statistics.fmean(ms), 3) if ms else 0.0,
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "max_ms": round(max(ms), 3) if ms else 0.0,
+    }
+
+
+def seed_users(count: int) -> List[int]:
+    """Create ``count`` users and return their ids"""
+    from app.db.database import SessionLocal
+    from app.db.migrations import upgrade
+    from app.models.user import User
+
+    upgrade()
+    with SessionLocal() as db:
+        start = db.query(User).count()
+        users = [
+            User(google_id=f"bench-{start + i}", name=f"Bench User {start + i}")
+            for i in range(count)
+        ]
+        db.add_all(users)
+        db.commit()
+        return [u.id for u in users]
+
+
+@asynccontextmanager
+async def running_app(port: int):
+    """Serve ``app.main:app`` with uvicorn on localhost for the duration of the block"""
+    import uvicorn
+    from app.main import app
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", ws_max_queue=1024)
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        yield f"127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await task
@@ -0,0 +1,94 @@
+"""
+Memory held by the connection registry per idle socket, at 10k-100k sockets.
+
+Each level runs in a fresh ``--child`` interpreter. It builds the user
+profiles and stand-in sockets first, then registers every socket with a
+``ConnectionManager`` the way ``connect`` does and lets the event loop go
+idle. What the registry allocated is read with ``tracemalloc`` and divided
+by the socket count. The stand-in sockets are excluded, so the figure is
+the server's own per-connection bookkeeping, on top of what Starlette and
+uvicorn hold for every socket. ``rss_bytes_per_connection`` is the growth
+of the process's resident set over the same step, allocator overhead
+included.
+
+It also times assembling the presence snapshot a newcomer receives
+(``snapshot_ms``) and its size.
+
+    python -m benchmarks.connection_memory --connections 10000 50000 100000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.presence import user_info
+
+
+class IdleWebSocket:
+    __slots__ = ()
+
+    async def send_text(self, payload: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def rss() -> int:
+    """Resident set size of this process in bytes (Linux)"""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+async def measure(connections: int) -> dict:
+    from app.chat.manager import ConnectionManager
+
+    manager = ConnectionManager()
+    user_ids = [str(i) for i in range(connections)]
+    profiles = [user_info(i) for i in range(connections)]
+    sockets = [IdleWebSocket() for _ in range(connections)]
+    connected_at = datetime.utcnow().isoformat()
+
+    gc.collect()
+    rss_before = rss()
+    tracemalloc.start()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    for user_id, profile, websocket in zip(user_ids, profiles, sockets):
+        manager.register(user_id, websocket, user_info={**profile, "connected_at": connected_at, "status": "online"})
+    # Let anything scheduled by registration run, so every connection is idle
+    await asyncio.sleep(0)
+    gc.collect()
+    traced = tracemalloc.get_traced_memory()[0] - traced_before
+    tracemalloc.stop()
+    grown = rss() - rss_before
+
+    started = time.perf_counter()
+    snapshot = manager.get_presence_snapshot().text
+    snapshot_ms = (time.perf_counter() - started) * 1000
+    return {
+        "connections": connections,
+        "bytes_per_connection": round(traced / connections),
+        "rss_bytes_per_connection": round(grown / connections),
+        "registry_mb": round(traced / 2**20, 1),
+        "snapshot_ms": round(snapshot_ms, 2),
+        "snapshot_bytes": len(snapshot),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connections", type=int, nargs="+", default=[10000, 50000, 100000])
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(measure(args.child))))
+        sys.exit()
+    for connections in args.connections:
+        subprocess.run([sys.executable, "-m", "benchmarks.connection_memory", "--child", str(connections)], check=True)
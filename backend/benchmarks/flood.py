@@ -0,0 +1,174 @@
+"""
+Message latency for well-behaved users while one client floods the server.
+
+``--pairs`` sender/receiver pairs exchange ``--messages`` messages each, one
+every ``--interval`` seconds (under the default ``message`` limit), and record
+send-to-receive latency. Meanwhile ``--flooders`` clients, each in its own
+process, send ``message`` and ``typing`` frames at ``--flood-rate`` frames
+per second (0: as fast as the socket takes them). Each scenario runs in a fresh interpreter: ``quiet`` (no flood), ``flood_unlimited``
+(``WS_RATE_LIMITS`` empty) and ``flood_limited`` (default limits).
+
+    python -m benchmarks.flood --pairs 10 --messages 40 --flooders 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from benchmarks.common import configure_database, free_port, running_app, seed_users, summarize
+
+SCENARIOS = {
+    "quiet": {"flooders": False, "limits": None},
+    "flood_unlimited": {"flooders": True, "limits": ""},
+    "flood_limited": {"flooders": True, "limits": None},
+}
+
+
+async def connect(host: str, user_id: int):
+    import websockets
+
+    ws = await websockets.connect(f"ws://{host}/ws/chat/{user_id}", max_queue=None)
+    # Anything sent before the socket is registered would be queued as pending
+    while json.loads(await ws.recv())["event"] != "connected_users":
+        pass
+    return ws
+
+
+async def drain(ws, counts: dict = None):
+    try:
+        while True:
+            frame = json.loads(await ws.recv())
+            if counts is not None:
+                counts[frame["event"]] = counts.get(frame["event"], 0) + 1
+    except Exception:
+        pass
+
+
+async def pair(host: str, sender_id: int, receiver_id: int, messages: int, interval: float, latencies: list):
+    sender = await connect(host, sender_id)
+    receiver = await connect(host, receiver_id)
+    sent_at = {}
+    drainer = asyncio.create_task(drain(sender))
+
+    async def receive():
+        received = 0
+        while received < messages:
+            frame = json.loads(await receiver.recv())
+            if frame.get("event") == "new_message" and frame["message"] in sent_at:
+                latencies.append(time.perf_counter() - sent_at.pop(frame["message"]))
+                received += 1
+
+    reader = asyncio.create_task(receive())
+    for i in range(messages):
+        text = f"pair {sender_id} {i}"
+        sent_at[text] = time.perf_counter()
+        await sender.send(json.dumps({"event": "message", "to": str(receiver_id), "message": text}))
+        await asyncio.sleep(interval)
+    await asyncio.wait_for(reader, timeout=120)
+    drainer.cancel()
+    await sender.close()
+    await receiver.close()
+
+
+async def flood(host: str, flooder_id: int, target_id: int, rate: float):
+    """Runs in its own process, so the flood competes with the server like a remote client would"""
+    from websockets.exceptions import ConnectionClosed
+
+    counts = {"sent": 0, "closed_by_server": 0}
+    started = time.perf_counter()
+    try:
+        while True:
+            # Reconnect whenever the server closes the socket, as an abusive client would
+            ws = await connect(host, flooder_id)
+            drainer = asyncio.create_task(drain(ws, counts))
+            try:
+                while True:
+                    await ws.send(json.dumps({"event": "message", "to": str(target_id), "message": "spam"}))
+                    await ws.send(json.dumps({"event": "typing", "to": str(target_id), "is_typing": True}))
+                    counts["sent"] += 2
+                    if counts["sent"] % 100 == 0:
+                        # Sleep off anything sent faster than the target rate
+                        await asyncio.sleep(max(0, started + counts["sent"] / rate - time.perf_counter()) if rate else 0)
+            except ConnectionClosed:
+                counts["closed_by_server"] += 1
+            finally:
+                drainer.cancel()
+    except asyncio.CancelledError:
+        print(json.dumps(counts), flush=True)
+
+
+async def scenario(pairs: int, messages: int, interval: float, flooders: int, flood_rate: float) -> dict:
+    configure_database()
+    import app.main  # noqa: F401  (creates every table before seeding)
+
+    ids = seed_users(pairs * 2 + flooders * 2)
+    pair_ids, flood_ids = ids[:pairs * 2], ids[pairs * 2:]
+    latencies, flood_frames = [], []
+    async with running_app(free_port()) as host:
+        targets = [await connect(host, flood_ids[i + 1]) for i in range(0, len(flood_ids), 2)]
+        target_drains = [asyncio.create_task(drain(ws)) for ws in targets]
+        floods = [
+            await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "benchmarks.flood", "--flood", host, str(flood_ids[i]), str(flood_ids[i + 1]),
+                "--flood-rate", str(flood_rate),
+                stdout=asyncio.subprocess.PIPE,
+            )
+            for i in range(0, len(flood_ids), 2)
+        ]
+        await asyncio.sleep(2 if floods else 0)
+        await asyncio.gather(*(
+            pair(host, pair_ids[i], pair_ids[i + 1], messages, interval, latencies)
+            for i in range(0, len(pair_ids), 2)
+        ))
+        for process in floods:
+            process.send_signal(signal.SIGINT)
+            output, _ = await process.communicate()
+            flood_frames.append(json.loads(output.decode().strip().splitlines()[-1]))
+        for task in target_drains:
+            task.cancel()
+    return {**summarize(latencies), "flood_frames": flood_frames}
+
+
+def run_child(name: str, args) -> dict:
+    env = dict(os.environ)
+    env.pop("DATABASE_URL", None)
+    limits = SCENARIOS[name]["limits"]
+    if limits is not None:
+        env["WS_RATE_LIMITS"] = limits
+    flooders = args.flooders if SCENARIOS[name]["flooders"] else 0
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.flood", "--child", "--pairs", str(args.pairs),
+         "--messages", str(args.messages), "--interval", str(args.interval), "--flooders", str(flooders),
+         "--flood-rate", str(args.flood_rate)],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--interval", type=float, default=0.25)
+    parser.add_argument("--flooders", type=int, default=2)
+    parser.add_argument("--flood-rate", type=float, default=2000, help="frames/sec per flooder (0 = unpaced)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--flood", nargs=3, metavar=("HOST", "FROM", "TO"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.flood:
+        host, flooder_id, target_id = args.flood
+        try:
+            asyncio.run(flood(host, int(flooder_id), int(target_id), args.flood_rate))
+        except KeyboardInterrupt:
+            pass
+    elif args.child:
+        print(json.dumps(asyncio.run(
+            scenario(args.pairs, args.messages, args.interval, args.flooders, args.flood_rate)
+        )))
+    else:
+        for name in SCENARIOS:
+            print(json.dumps({"scenario": name, **run_child(name, args)}))
@@ -0,0 +1,132 @@
+"""
+``GET /history`` with and without the conversation tail cache, plus a consistency check.
+
+``--conversations`` pairs of users, each conversation seeded with
+``--history`` messages, chat over WebSockets for ``--duration`` seconds.
+Each user sends messages to its partner, acknowledges what it receives
+with ``message_seen``, and now and then sends ``mark_messages_seen``.
+Meanwhile ``--readers`` HTTP clients open chat windows (latest page) and
+page backwards and forwards through random conversations.
+
+Each mode runs in a fresh interpreter: ``cached`` (the default settings)
+and ``uncached`` (``HISTORY_CACHE_CONVERSATIONS=0``). Both report /history
+latency and the cache counters. With the cache on, once the traffic stops,
+``HistoryCache.verify`` compares every cached conversation's pages field by
+field with the same pages read from the database. Any mismatch is reported
+and makes the run exit non-zero. Both modes use ``DATABASE_URL`` when it is
+set, so the check can run against Postgres.
+
+    python -m benchmarks.history_cache --conversations 50 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.common import configure_database, free_port, running_app, seed_users, summarize
+from benchmarks.load import seed_history
+
+MODES = {"cached": None, "uncached": "0"}
+
+
+async def chat(host: str, user_id: int, partner_id: int, until: float, rng: random.Random):
+    import websockets
+
+    async with websockets.connect(f"ws://{host}/ws/chat/{user_id}", max_queue=None) as ws:
+        async def read():
+            async for data in ws:
+                frame = json.loads(data)
+                if frame.get("event") == "new_message" and rng.random() < 0.7:
+                    await ws.send(json.dumps({"event": "message_seen", "message_id": frame["message_id"]}))
+
+        reader = asyncio.create_task(read())
+        sent = 0
+        while time.time() < until:
+            await ws.send(json.dumps({"event": "message", "to": str(partner_id), "message": f"hello {sent}"}))
+            sent += 1
+            if rng.random() < 0.05:
+                await ws.send(json.dumps({"event": "mark_messages_seen", "from_user_id": str(partner_id)}))
+            await asyncio.sleep(rng.uniform(0.05, 0.3))
+        await asyncio.sleep(1)
+        reader.cancel()
+
+
+async def read_history(host: str, pairs: list, until: float, rng: random.Random, latencies: list):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=f"http://{host}", timeout=30) as client:
+        while time.time() < until:
+            a, b = rng.choice(pairs)
+            started = time.perf_counter()
+            page = (await client.get(f"/history/{a}/{b}", params={"limit": 50})).json()
+            latencies.append(time.perf_counter() - started)
+            if page and rng.random() < 0.5:
+                # Scroll up, or catch up from a message in the middle of the page
+                cursor = {"before": page[0]["id"]} if rng.random() < 0.5 else {"after": page[len(page) // 2]["id"]}
+                started = time.perf_counter()
+                await client.get(f"/history/{a}/{b}", params={"limit": 50, **cursor})
+                latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.01)
+
+
+async def scenario(conversations: int, history: int, duration: float, readers: int) -> dict:
+    configure_database()
+    # Chat as fast as the scenario wants; the limits are not what is measured here
+    os.environ.setdefault("WS_RATE_LIMITS", "")
+    from app.chat.history_cache import history_cache
+    from app.db.database import AsyncSessionLocal
+
+    ids = seed_users(conversations * 2)
+    seed_history(ids, history)
+    pairs = [(ids[i], ids[i + 1]) for i in range(0, len(ids), 2)]
+    rng = random.Random(0)
+    latencies = []
+    async with running_app(free_port()) as host:
+        until = time.time() + duration
+        await asyncio.gather(
+            *(chat(host, a, b, until, rng) for a, b in pairs),
+            *(chat(host, b, a, until, rng) for a, b in pairs),
+            *(read_history(host, pairs, until, rng, latencies) for _ in range(readers)),
+        )
+        # Let the last writes commit
+        await asyncio.sleep(1)
+        result = {"history": summarize(latencies), "cache": history_cache.stats()}
+        if history_cache.enabled:
+            async with AsyncSessionLocal() as db:
+                result["consistency"] = await history_cache.verify(db)
+    return result
+
+
+def run_child(mode: str, args) -> dict:
+    env = dict(os.environ, RATE_LIMIT_ENABLED="false", LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"))
+    if MODES[mode] is not None:
+        env["HISTORY_CACHE_CONVERSATIONS"] = MODES[mode]
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.history_cache", "--child", "--conversations", str(args.conversations),
+         "--history", str(args.history), "--duration", str(args.duration), "--readers", str(args.readers)],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--history", type=int, default=200, help="seeded messages per conversation")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--readers", type=int, default=4, help="concurrent HTTP history readers")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(asyncio.run(scenario(args.conversations, args.history, args.duration, args.readers))))
+    else:
+        failed = False
+        for mode in MODES:
+            result = run_child(mode, args)
+            failed |= result.get("consistency", {}).get("mismatches", 0) > 0
+            print(json.dumps({"mode": mode, **result}))
+        sys.exit(1 if failed else 0)
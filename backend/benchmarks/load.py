@@ -0,0 +1,479 @@
+"""
+End-to-end load test: the whole app under a realistic WebSocket and HTTP mix.
+
+The server (``app.main:app`` under uvicorn) runs in its own process, with a
+task measuring event-loop lag. ``--clients`` load-generator processes open
+``--users`` sockets to ``/ws/chat/{user_id}`` between them. Once every socket
+is connected, each user sends ``--rate`` events per second for
+``--duration`` seconds (Poisson arrivals), drawn from ``--mix``:
+
+* ``message``            - to a random online user; the receiver records send -> deliver latency
+* ``typing``             - on/off indicator to a random online user
+* ``message_seen``       - for the last message this user received
+* ``mark_messages_seen`` - the whole conversation with the last sender
+
+Meanwhile ``--http-rate`` requests per second hit ``GET /history`` (for
+conversations seeded with ``--history`` messages each) and
+``GET /connected-users``. The per-user WebSocket limits stay on; the per-IP
+HTTP limits are turned off, since every request comes from localhost.
+
+Reported: throughput, send -> deliver latency percentiles, HTTP latency,
+event-loop lag on the server, server RSS per connection (Linux) and the
+server's outbound-queue drops and evictions. Failed connects are counted,
+not fatal. Results
+are printed as one JSON document; ``--output`` also saves it, and
+``--compare BASE.json NEW.json`` prints the change between two saved runs.
+Runs use a throwaway SQLite database unless ``DATABASE_URL`` is set.
+
+    python -m benchmarks.load --users 1000 --clients 2 --duration 60 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import UTC, datetime, timedelta
+
+from benchmarks.common import configure_database, free_port, seed_users, summarize
+
+DEFAULT_MIX = "message=0.5,typing=0.3,message_seen=0.15,mark_messages_seen=0.05"
+# Seconds to keep receiving after the last send, so in-flight messages count
+GRACE = 3.0
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for item in spec.split(","):
+        event, _, weight = item.partition("=")
+        if event.strip():
+            mix[event.strip()] = float(weight or 1)
+    return mix
+
+
+def raise_fd_limit():
+    """Every socket is a file descriptor on both ends"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def rss_bytes(pid: int):
+    """Resident set size of ``pid`` from /proc, or None where that is unavailable"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+def seed_history(ids: list, per_conversation: int):
+    """``per_conversation`` delivered, seen messages between each pair (ids[0], ids[1]), (ids[2], ids[3]), ..."""
+    from app.db.database import engine
+    from app.models.message import Message
+
+    if per_conversation <= 0:
+        return
+    start = datetime(2024, 1, 1, tzinfo=UTC)
+    rows = [
+        {
+            "from_id": ids[i + n % 2], "to_id": ids[i + 1 - n % 2],
+            "content": f"seeded message {n}", "timestamp": start + timedelta(seconds=n),
+            "delivered_at": start + timedelta(seconds=n), "seen_at": start + timedelta(seconds=n),
+        }
+        for i in range(0, len(ids) - 1, 2)
+        for n in range(per_conversation)
+    ]
+    with engine.begin() as conn:
+        conn.execute(Message.__table__.insert(), rows)
+
+
+# --- server process -------------------------------------------------------
+
+async def serve(port: int, lag_interval: float):
+    """Run the app and sample event-loop lag until uvicorn is told to exit"""
+    import uvicorn
+    from app.main import app
+
+    lags = []
+
+    async def monitor():
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(lag_interval)
+            lags.append((time.time(), time.perf_counter() - started - lag_interval))
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", ws_max_queue=1024)
+    server = uvicorn.Server(config)
+    sampler = asyncio.create_task(monitor())
+    try:
+        await server.serve()
+    finally:
+        # uvicorn re-raises the SIGINT that stopped it, which cancels this task
+        sampler.cancel()
+        print(json.dumps({"loop_lag": lags}), flush=True)
+
+
+# --- load generator process -----------------------------------------------
+
+class User:
+    __slots__ = ("user_id", "ws", "last_message_id", "last_sender")
+
+    def __init__(self, user_id: int, ws):
+        self.user_id = user_id
+        self.ws = ws
+        self.last_message_id = None
+        self.last_sender = None
+
+
+async def generate(plan: dict) -> dict:
+    """Connect this generator's users, wait for "go", run the mix and report raw samples"""
+    import httpx
+    import websockets
+
+    host, peers = plan["host"], plan["peers"]
+    mix = parse_mix(plan["mix"])
+    events, weights = list(mix), list(mix.values())
+    rng = random.Random(plan["seed"])
+    latencies, http_latencies = [], {"history": [], "connected_users": []}
+    sent, received, http_status, errors = Counter(), Counter(), Counter(), Counter()
+    connect_times = []
+    # Frames are only counted from the start of the run to the end of the grace period
+    measuring = False
+
+    async def connect(user_id: int, limit: asyncio.Semaphore):
+        async with limit:
+            started = time.perf_counter()
+            try:
+                ws = await websockets.connect(f"ws://{host}/ws/chat/{user_id}", max_queue=None, open_timeout=60)
+                # Registered once the presence snapshot arrives
+                while json.loads(await ws.recv())["event"] != "connected_users":
+                    pass
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+                # Reported rather than fatal: a server that sheds connections under load is a result
+                errors["connect_failed"] += 1
+                return None
+            connect_times.append(time.perf_counter() - started)
+            return User(user_id, ws)
+
+    async def read(user: User):
+        try:
+            async for data in user.ws:
+                frame = json.loads(data)
+                event = frame.get("event")
+                if measuring:
+                    received[event] += 1
+                if event == "new_message":
+                    tag, _, sent_at = frame["message"].partition(" ")
+                    if tag == "load":
+                        latencies.append(time.time() - float(sent_at))
+                    user.last_message_id = frame["message_id"]
+                    user.last_sender = frame["from"]
+        except websockets.ConnectionClosed:
+            pass
+
+    def peer_of(user: User) -> str:
+        while True:
+            peer = rng.choice(peers)
+            if peer != user.user_id:
+                return str(peer)
+
+    async def drive(user: User, until: float):
+        while True:
+            await asyncio.sleep(rng.expovariate(plan["rate"]))
+            if time.time() >= until:
+                return
+            event = rng.choices(events, weights)[0]
+            if event == "message":
+                frame = {"event": "message", "to": peer_of(user), "message": f"load {time.time():.6f}"}
+            elif event == "typing":
+                frame = {"event": "typing", "to": peer_of(user), "is_typing": rng.random() < 0.5}
+            elif event == "message_seen" and user.last_message_id is not None:
+                frame = {"event": "message_seen", "message_id": user.last_message_id}
+            elif event == "mark_messages_seen" and user.last_sender is not None:
+                frame = {"event": "mark_messages_seen", "from_user_id": user.last_sender}
+            else:
+                continue
+            try:
+                await user.ws.send(json.dumps(frame))
+            except websockets.ConnectionClosed:
+                errors["closed"] += 1
+                return
+            sent[event] += 1
+
+    async def request(client: httpx.AsyncClient, kind: str, path: str):
+        started = time.perf_counter()
+        try:
+            response = await client.get(path)
+            http_status[response.status_code] += 1
+        except httpx.HTTPError:
+            http_status["error"] += 1
+            return
+        http_latencies[kind].append(time.perf_counter() - started)
+
+    async def http(until: float):
+        if not plan["http_rate"]:
+            return
+        conversations = plan["conversations"]
+        pending = set()
+        async with httpx.AsyncClient(base_url=f"http://{host}", timeout=30) as client:
+            while True:
+                await asyncio.sleep(rng.expovariate(plan["http_rate"]))
+                if time.time() >= until:
+                    break
+                # Open loop: a slow server gets more concurrent requests, not fewer
+                if rng.random() < 0.5 and conversations:
+                    a, b = rng.choice(conversations)
+                    task = asyncio.create_task(request(client, "history", f"/history/{a}/{b}?limit=50"))
+                else:
+                    task = asyncio.create_task(request(client, "connected_users", "/connected-users"))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+
+    limit = asyncio.Semaphore(plan["connect_concurrency"])
+    users = [user for user in await asyncio.gather(*(connect(user_id, limit) for user_id in plan["users"])) if user]
+    readers = [asyncio.create_task(read(user)) for user in users]
+    print(json.dumps({"ready": len(users)}), flush=True)
+
+    # The parent sends the start time once every generator is connected
+    loop = asyncio.get_running_loop()
+    started_at = float(await loop.run_in_executor(None, sys.stdin.readline))
+    until = started_at + plan["duration"]
+    await asyncio.sleep(max(0, started_at - time.time()))
+    measuring = True
+    await asyncio.gather(http(until), *(drive(user, until) for user in users))
+    await asyncio.sleep(GRACE)
+    measuring = False
+
+    # Closing every socket makes the server evict some mid-broadcast; let the parent read its stats first
+    print(json.dumps({"done": True}), flush=True)
+    await loop.run_in_executor(None, sys.stdin.readline)
+    for user in users:
+        await user.ws.close()
+    for task in readers:
+        task.cancel()
+    return {
+        "latencies": latencies,
+        "http": http_latencies,
+        "http_status": {str(k): v for k, v in http_status.items()},
+        "sent": dict(sent),
+        "received": {str(k): v for k, v in received.items()},
+        "errors": dict(errors),
+        "connect": connect_times,
+    }
+
+
+# --- orchestration --------------------------------------------------------
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def merge(reports: list) -> dict:
+    merged = {"latencies": [], "http": {}, "http_status": Counter(), "sent": Counter(),
+              "received": Counter(), "errors": Counter(), "connect": []}
+    for report in reports:
+        merged["latencies"] += report["latencies"]
+        merged["connect"] += report["connect"]
+        for kind, samples in report["http"].items():
+            merged["http"].setdefault(kind, []).extend(samples)
+        for key in ("http_status", "sent", "received", "errors"):
+            merged[key].update(report[key])
+    return merged
+
+
+def run(args) -> dict:
+    import httpx
+
+    raise_fd_limit()
+    configure_database()
+    import app.main  # noqa: F401  (creates every table before seeding)
+
+    ids = seed_users(args.users)
+    seed_history(ids, args.history)
+    conversations = [[ids[i], ids[i + 1]] for i in range(0, len(ids) - 1, 2)] if args.history else []
+
+    env = dict(os.environ, RATE_LIMIT_ENABLED="false", LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"))
+    port = free_port()
+    host = f"127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.load", "--serve", str(port), "--lag-interval", str(args.lag_interval)],
+        env=env, stdout=subprocess.PIPE, text=True,
+    )
+    generators = []
+    try:
+        _wait_for_port(port)
+        rss_idle = rss_bytes(server.pid)
+
+        with tempfile.TemporaryDirectory(prefix="teachly-load-") as tmp:
+            for index in range(args.clients):
+                plan = {
+                    "host": host, "users": ids[index::args.clients], "peers": ids, "mix": args.mix,
+                    "rate": args.rate, "duration": args.duration, "http_rate": args.http_rate / args.clients,
+                    "conversations": conversations, "seed": index,
+                    "connect_concurrency": args.connect_concurrency,
+                }
+                path = os.path.join(tmp, f"plan-{index}.json")
+                with open(path, "w") as f:
+                    json.dump(plan, f)
+                generators.append(subprocess.Popen(
+                    [sys.executable, "-m", "benchmarks.load", "--generate", path],
+                    env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+                ))
+
+            connect_started = time.perf_counter()
+            for generator in generators:
+                json.loads(generator.stdout.readline())
+            connect_seconds = time.perf_counter() - connect_started
+            rss_connected = rss_bytes(server.pid)
+
+            started_at = time.time() + 0.5
+            for generator in generators:
+                generator.stdin.write(f"{started_at}\n")
+                generator.stdin.flush()
+            for generator in generators:
+                json.loads(generator.stdout.readline())
+            rss_end = rss_bytes(server.pid)
+            # Evictions and drops explain most missing deliveries
+            queues = httpx.get(f"http://{host}/ws/queues", timeout=30).json()
+            reports = [
+                json.loads(generator.communicate("\n")[0].strip().splitlines()[-1]) for generator in generators
+            ]
+    finally:
+        for generator in generators:
+            if generator.poll() is None:
+                generator.kill()
+        server.send_signal(2)
+        output, _ = server.communicate(timeout=60)
+
+    lags = json.loads(output.strip().splitlines()[-1])["loop_lag"]
+    window = [lag for at, lag in lags if started_at <= at <= started_at + args.duration]
+    merged = merge(reports)
+    messages_sent = merged["sent"]["message"]
+    delivered = len(merged["latencies"])
+    frames_sent = sum(merged["sent"].values())
+    frames_received = sum(merged["received"].values())
+    per_connection = (
+        round((rss_connected - rss_idle) / args.users) if rss_idle and rss_connected and args.users else None
+    )
+    return {
+        "label": args.label,
+        "revision": git_revision(),
+        "started": datetime.now(UTC).isoformat(),
+        "config": {
+            "users": args.users, "clients": args.clients, "duration_s": args.duration, "rate": args.rate,
+            "mix": parse_mix(args.mix), "http_rate": args.http_rate, "history": args.history,
+            "connect_concurrency": args.connect_concurrency,
+            "database": os.environ["DATABASE_URL"].split("://")[0],
+        },
+        "throughput": {
+            "messages_per_s": round(messages_sent / args.duration, 1),
+            "delivered_per_s": round(delivered / args.duration, 1),
+            "frames_in_per_s": round(frames_sent / args.duration, 1),
+            "frames_out_per_s": round(frames_received / args.duration, 1),
+            "http_per_s": round(sum(len(s) for s in merged["http"].values()) / args.duration, 1),
+        },
+        "delivery": {**summarize(merged["latencies"]), "sent": messages_sent, "delivered": delivered},
+        "http": {kind: summarize(samples) for kind, samples in merged["http"].items()},
+        "http_status": dict(merged["http_status"]),
+        "connect": {**summarize(merged["connect"]), "total_s": round(connect_seconds, 2)},
+        "loop_lag": summarize(window),
+        "memory": {
+            "rss_idle_mb": round(rss_idle / 2 ** 20, 1) if rss_idle else None,
+            "rss_connected_mb": round(rss_connected / 2 ** 20, 1) if rss_connected else None,
+            "rss_end_mb": round(rss_end / 2 ** 20, 1) if rss_end else None,
+            "bytes_per_connection": per_connection,
+        },
+        "outbound_queues": {key: queues[key] for key in ("dropped", "coalesced", "evicted_connections")},
+        "events_sent": dict(merged["sent"]),
+        "events_received": dict(merged["received"]),
+        "errors": dict(merged["errors"]),
+    }
+
+
+def _wait_for_port(port: int, timeout: float = 60):
+    import socket
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"server did not start listening on port {port}")
+
+
+def compare(base: dict, new: dict) -> dict:
+    """Relative change of every numeric result between two saved runs"""
+    changes = {}
+    for section in ("throughput", "delivery", "loop_lag", "memory", "connect"):
+        for key, value in new.get(section, {}).items():
+            old = base.get(section, {}).get(key)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)):
+                changes[f"{section}.{key}"] = {
+                    "base": old, "new": value, "change": round((value - old) / old, 3) if old else None,
+                }
+    for kind, stats in new.get("http", {}).items():
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            old = base.get("http", {}).get(kind, {}).get(key)
+            if old is not None:
+                changes[f"http.{kind}.{key}"] = {
+                    "base": old, "new": stats[key], "change": round((stats[key] - old) / old, 3) if old else None,
+                }
+    return changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--clients", type=int, default=1, help="load-generator processes")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--rate", type=float, default=0.2, help="events per second per user")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="event=weight pairs")
+    parser.add_argument("--http-rate", type=float, default=20, help="HTTP requests per second in total")
+    parser.add_argument("--history", type=int, default=50, help="seeded messages per history conversation")
+    parser.add_argument("--connect-concurrency", type=int, default=50, help="sockets each generator opens at once")
+    parser.add_argument("--lag-interval", type=float, default=0.05, help="event-loop lag sampling period")
+    parser.add_argument("--label", default=None, help="free-form name stored with the results")
+    parser.add_argument("--output", help="also write the results JSON here")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two saved runs")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    parser.add_argument("--generate", metavar="PLAN", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        raise_fd_limit()
+        try:
+            asyncio.run(serve(args.serve, args.lag_interval))
+        except KeyboardInterrupt:
+            # The parent stops the server with SIGINT; that is a normal exit
+            pass
+    elif args.generate:
+        raise_fd_limit()
+        with open(args.generate) as f:
+            plan = json.load(f)
+        print(json.dumps(asyncio.run(generate(plan))))
+    elif args.compare:
+        with open(args.compare[0]) as base, open(args.compare[1]) as new:
+            print(json.dumps(compare(json.load(base), json.load(new)), indent=2))
+    else:
+        results = run(args)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        print(json.dumps(results))
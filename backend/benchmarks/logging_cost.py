@@ -0,0 +1,82 @@
+"""
+Time the per-message logging spends on the calling (event loop) thread.
+
+``print`` replays the four lines the message handler used to print, including
+the connected-user list, with ``--connected`` users online. ``sampled`` and
+``unsampled`` make the structured logger calls that replaced them, with
+``LOG_SAMPLE_RATES`` applied and with every record kept. ``--sink`` is where output
+goes (default: a temp file).
+
+    python -m benchmarks.logging_cost --messages 20000 --connected 1000 10000
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+
+def print_lines(sink, connected: dict, messages: int):
+    with contextlib.redirect_stdout(sink):
+        for i in range(messages):
+            print(f"[MESSAGE] User 1 sent message {i} to 2 at 2024-01-01 00:00:00")
+            print("[DELIVERY_CHECK] User 2 is connected: True")
+            print(f"[DEBUG] Connected users: {list(connected.keys())}")
+            print(f"[DELIVERY] Delivered message {i} immediately to 2")
+
+
+def log_lines(connected: dict, messages: int, sampled: bool):
+    from app.log import get_logger
+
+    get = get_logger if sampled else logging.getLogger
+    message_log = get("app.chat.message")
+    delivery_log = get("app.chat.delivery")
+    for i in range(messages):
+        message_log.info("Message stored", extra={"from_id": "1", "to_id": "2", "message_id": i})
+        if delivery_log.isEnabledFor(logging.DEBUG):
+            delivery_log.debug("Delivery check", extra={
+                "to_id": "2", "connected": True, "connected_users": len(connected),
+            })
+        delivery_log.info("Message delivered", extra={"message_id": i, "to_id": "2"})
+
+
+def run(mode: str, sink_path: str, connected: int, messages: int) -> float:
+    from app.log import configure_logging, shutdown_logging
+
+    users = {str(i): None for i in range(connected)}
+    with open(sink_path, "a") as sink:
+        if mode == "print":
+            started = time.perf_counter()
+            print_lines(sink, users, messages)
+            return time.perf_counter() - started
+
+        with contextlib.redirect_stdout(sink):
+            configure_logging()
+            try:
+                started = time.perf_counter()
+                log_lines(users, messages, sampled=mode == "sampled")
+                return time.perf_counter() - started
+            finally:
+                shutdown_logging()
+
+
+def main(messages: int, levels, sink_path: str):
+    for connected in levels:
+        for mode in ("print", "sampled", "unsampled"):
+            elapsed = run(mode, sink_path, connected, messages)
+            print(json.dumps({
+                "mode": mode,
+                "connected": connected,
+                "us_per_message": round(elapsed / messages * 1e6, 2),
+            }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--connected", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--sink", default=os.path.join(tempfile.gettempdir(), "teachly-logging-bench.log"))
+    args = parser.parse_args()
+    main(args.messages, args.connected, args.sink)
@@ -0,0 +1,103 @@
+"""
+``POST /auth/login`` latency with local ID token verification.
+
+Google is replaced by a local JWKS stand-in (an ``httpx.MockTransport``) and
+tokens are self-signed with a throwaway RSA key, so no network is needed.
+``--users`` distinct users log in ``--logins`` times each from
+``--concurrency`` concurrent clients; repeated logins reuse their token, hit
+the verified-token cache and skip the database write for unchanged profiles.
+
+    python -m benchmarks.login --users 200 --logins 3 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import configure_database, summarize
+
+CLIENT_ID = "bench-client.apps.googleusercontent.com"
+
+
+def make_signer():
+    """A signing key plus a transport serving its public half as Google's JWKS"""
+    import httpx
+    from joserfc.jwk import RSAKey
+
+    key = RSAKey.generate_key(2048, parameters={"kid": "bench", "alg": "RS256", "use": "sig"})
+    jwks = {"keys": [key.as_dict(private=False)]}
+    fetches = []
+
+    def handler(request):
+        fetches.append(request.url)
+        return httpx.Response(200, json=jwks, headers={"cache-control": "public, max-age=3600"})
+
+    return key, httpx.MockTransport(handler), fetches
+
+
+def sign(key, user: int) -> str:
+    from joserfc import jwt
+
+    now = int(time.time())
+    return jwt.encode({"alg": "RS256", "kid": "bench"}, {
+        "iss": "https://accounts.google.com",
+        "aud": CLIENT_ID,
+        "sub": f"bench-google-{user}",
+        "name": f"Bench User {user}",
+        "picture": f"https://example.com/{user}.png",
+        "iat": now,
+        "exp": now + 3600,
+    }, key)
+
+
+async def main(users: int, logins: int, concurrency: int):
+    import httpx
+
+    configure_database()
+    from app.db.migrations import upgrade
+
+    upgrade()
+    from app.auth.google import google_verifier
+    from app.auth.profiles import profile_cache
+    from app.main import app
+
+    key, transport, fetches = make_signer()
+    google_verifier.client_id = CLIENT_ID
+    google_verifier.http_client = httpx.AsyncClient(transport=transport)
+    tokens = [sign(key, user) for user in range(users)]
+
+    latencies = {"first": [], "repeat": []}
+    semaphore = asyncio.Semaphore(concurrency)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            async def login(token: str, kind: str):
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post("/auth/login", json={"credential": token})
+                    latencies[kind].append(time.perf_counter() - started)
+                    assert response.status_code == 200, response.text
+
+            await asyncio.gather(*(login(token, "first") for token in tokens))
+            for _ in range(logins - 1):
+                await asyncio.gather(*(login(token, "repeat") for token in tokens))
+
+            bad = await client.post("/auth/login", json={"credential": tokens[0][:-4] + "AAAA"})
+
+    for kind, samples in latencies.items():
+        if samples:
+            print(json.dumps({"logins": kind, **summarize(samples)}))
+    print(json.dumps({
+        "jwks_fetches": len(fetches),
+        "token_cache": google_verifier.token_cache.stats(),
+        "profiles": profile_cache.stats(),
+        "tampered_token_status": bad.status_code,
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--logins", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.logins, args.concurrency))
@@ -0,0 +1,90 @@
+"""
+Cost of the Prometheus instrumentation on chat throughput.
+
+Runs the same message flood with ``METRICS_ENABLED`` true and false (each in
+a fresh interpreter, alternating, ``--rounds`` times) and reports the best
+messages/sec of each. Every sender floods ``--messages`` messages to its
+partner without pausing; the run ends when every partner has received them.
+
+    python -m benchmarks.metrics_overhead --pairs 20 --messages 200 --rounds 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.common import configure_database, free_port, running_app, seed_users
+
+
+async def flood(pairs: int, messages: int) -> float:
+    import websockets
+
+    configure_database()
+    ids = seed_users(pairs * 2)
+    async with running_app(free_port()) as host:
+        async def pair(sender_id: int, receiver_id: int):
+            async with websockets.connect(f"ws://{host}/ws/chat/{sender_id}") as sender, \
+                    websockets.connect(f"ws://{host}/ws/chat/{receiver_id}") as receiver:
+                async def drain_sender():
+                    try:
+                        while True:
+                            await sender.recv()
+                    except Exception:
+                        pass
+
+                # Sending before the receiver is registered would queue the messages as pending
+                while json.loads(await receiver.recv())["event"] != "connected_users":
+                    pass
+                drain = asyncio.create_task(drain_sender())
+                for i in range(messages):
+                    await sender.send(json.dumps({"event": "message", "to": str(receiver_id), "message": f"m {i}"}))
+                received = 0
+                while received < messages:
+                    if json.loads(await receiver.recv())["event"] == "new_message":
+                        received += 1
+                drain.cancel()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(pair(ids[i], ids[i + 1]) for i in range(0, len(ids), 2)))
+        return pairs * messages / (time.perf_counter() - started)
+
+
+def run_child(enabled: bool, pairs: int, messages: int) -> float:
+    # The flood never pauses; keep the per-user message limits out of it
+    env = {"WS_RATE_LIMITS": "", **os.environ, "METRICS_ENABLED": "true" if enabled else "false"}
+    env.pop("DATABASE_URL", None)
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.metrics_overhead", "--child",
+         "--pairs", str(pairs), "--messages", str(messages)],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main(pairs: int, messages: int, rounds: int):
+    best = {True: 0.0, False: 0.0}
+    for _ in range(rounds):
+        for enabled in (False, True):
+            best[enabled] = max(best[enabled], run_child(enabled, pairs, messages))
+    overhead = (best[False] - best[True]) / best[False] * 100
+    print(json.dumps({
+        "messages_per_sec_metrics_off": round(best[False]),
+        "messages_per_sec_metrics_on": round(best[True]),
+        "overhead_pct": round(overhead, 2),
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(asyncio.run(flood(args.pairs, args.messages)))
+    else:
+        main(args.pairs, args.messages, args.rounds)
@@ -0,0 +1,97 @@
+"""
+Connect time for a user returning to a backlog of undelivered messages.
+
+Seeds ``--pending`` messages addressed to one user (from ``--senders``
+distinct senders, all connected), then opens the receiver's socket and
+measures the time until every pending message has arrived, along with the
+number of frames the receiver and the senders had to read.
+
+    python -m benchmarks.pending --pending 10000 --senders 4
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, UTC
+
+from benchmarks.common import configure_database, free_port, running_app, seed_users
+
+
+def seed_pending(receiver: int, senders, count: int):
+    from app.db.database import SessionLocal
+    from app.models.message import Message
+
+    base = datetime.now(UTC) - timedelta(days=7)
+    with SessionLocal() as db:
+        db.bulk_insert_mappings(Message, [
+            {
+                "from_id": senders[i % len(senders)],
+                "to_id": receiver,
+                "content": f"pending {i}",
+                "timestamp": base + timedelta(milliseconds=i),
+            }
+            for i in range(count)
+        ])
+        db.commit()
+
+
+async def count_frames(ws, counts: dict, key: str):
+    try:
+        while True:
+            await ws.recv()
+            counts[key] += 1
+    except Exception:
+        pass
+
+
+async def main(pending: int, senders: int):
+    import websockets
+
+    configure_database()
+    import app.main  # noqa: F401  registers every model before migrating
+    receiver, *sender_ids = seed_users(senders + 1)
+    seed_pending(receiver, sender_ids, pending)
+
+    async with running_app(free_port()) as host:
+        counts = {"sender_frames": 0}
+        sender_sockets = [await websockets.connect(f"ws://{host}/ws/chat/{s}") for s in sender_ids]
+        readers = [asyncio.create_task(count_frames(ws, counts, "sender_frames")) for ws in sender_sockets]
+        await asyncio.sleep(0.2)
+        counts["sender_frames"] = 0
+
+        received = frames = 0
+        started = time.perf_counter()
+        async with websockets.connect(f"ws://{host}/ws/chat/{receiver}", max_queue=None) as ws:
+            while received < pending:
+                frame = json.loads(await asyncio.wait_for(ws.recv(), timeout=120))
+                frames += 1
+                if frame["event"] == "pending_messages":
+                    received += len(frame["messages"])
+                elif frame["event"] == "new_message":
+                    received += 1
+            elapsed = time.perf_counter() - started
+            # Give the sender notifications a moment to land
+            await asyncio.sleep(0.5)
+
+        for ws in sender_sockets:
+            await ws.close()
+        for task in readers:
+            task.cancel()
+
+    row = {
+        "pending": pending,
+        "senders": senders,
+        "connect_to_drained_ms": round(elapsed * 1000, 1),
+        "receiver_frames": frames,
+        "sender_frames": counts["sender_frames"],
+    }
+    print(json.dumps(row))
+    return row
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pending", type=int, default=10000)
+    parser.add_argument("--senders", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.pending, args.senders))
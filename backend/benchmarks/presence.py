@@ -0,0 +1,89 @@
+"""
+Bytes sent across the fleet for a single connect, as the online count grows.
+
+Registers N simulated sockets with a ``ConnectionManager`` and then measures the bytes written to every socket for one additional connect. With
+delta presence this grows linearly in N (one small frame per socket plus a
+single snapshot for the newcomer); the previous full-list broadcast is
+reported alongside for comparison and grows quadratically.
+
+    python -m benchmarks.presence --users 100 500 1000 2000
+"""
+import argparse
+import asyncio
+import json
+
+from app.chat.manager import ConnectionManager
+from app.chat.protocol import decode
+
+
+class CountingWebSocket:
+    def __init__(self):
+        self.bytes_sent = 0
+        self.frames = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, payload: str):
+        self.bytes_sent += len(payload.encode())
+        self.frames += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def user_info(i: int) -> dict:
+    return {
+        "id": i,
+        "name": f"Student {i}",
+        "avatar_url": f"https://lh3.googleusercontent.com/a/avatar-{i}=s96-c",
+        "google_id": f"10{i:019d}",
+    }
+
+
+async def drain(manager: ConnectionManager):
+    while any(c.queue_depth for c in manager.active_connections.values()):
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+
+async def measure(users: int) -> dict:
+    manager = ConnectionManager()
+    sockets = []
+    # Populate the registry directly; replaying N connects would only measure setup
+    for i in range(users):
+        websocket = CountingWebSocket()
+        sockets.append(websocket)
+        manager.register(str(i), websocket, user_info={**user_info(i), "status": "online"})
+
+    newcomer = CountingWebSocket()
+    sockets.append(newcomer)
+    await manager.connect(str(users), newcomer, user_info(users))
+    await drain(manager)
+
+    legacy_frame = len(json.dumps({
+        "event": "user_connected",
+        "user_id": str(users),
+        "user_info": decode(manager.active_connections[str(users)].presence),
+        "connected_users": manager.get_connected_users(),
+    }).encode())
+    for user_id in list(manager.active_connections):
+        manager.disconnect(user_id)
+    return {
+        "online_before": users,
+        "delta_bytes": sum(ws.bytes_sent for ws in sockets),
+        "delta_frames": sum(ws.frames for ws in sockets),
+        "full_list_bytes": legacy_frame * (users + 1),
+        "presence_version": manager.presence_version,
+    }
+
+
+async def main(levels):
+    for users in levels:
+        print(json.dumps(await measure(users)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 500, 1000, 2000])
+    asyncio.run(main(parser.parse_args().users))
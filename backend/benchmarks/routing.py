@@ -0,0 +1,108 @@
+"""
+Cross-worker message routing throughput through ``RedisRoutingBackend``.
+
+Simulates 1, 2 and 4 workers, each with its own ``ConnectionManager`` and
+Redis connection, with users spread round-robin across them. Every message
+goes from a random user to a random other user, so with K workers roughly
+(K-1)/K of the traffic crosses Redis. Uses a real server when ``REDIS_URL``
+is set and fakeredis otherwise (fakeredis numbers only show the relative
+overhead of routing, since all workers share one event loop).
+
+    REDIS_URL=redis://localhost:6379 python -m benchmarks.routing --workers 1 2 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from app.chat.manager import ConnectionManager
+from app.chat.routing import RedisRoutingBackend
+
+
+class CountingWebSocket:
+    def __init__(self):
+        self.received = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, payload: str):
+        if '"new_message"' in payload:
+            self.received += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def redis_client_factory():
+    url = os.getenv("REDIS_URL")
+    if url:
+        import redis.asyncio as redis
+        return lambda: redis.from_url(url)
+    import fakeredis
+    server = fakeredis.FakeServer()
+    return lambda: fakeredis.FakeAsyncRedis(server=server)
+
+
+async def run(workers: int, users: int, messages: int) -> dict:
+    new_client = redis_client_factory()
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    managers = [
+        ConnectionManager(backend=RedisRoutingBackend(prefix=prefix, client=new_client()))
+        for _ in range(workers)
+    ]
+    for manager in managers:
+        await manager.start()
+
+    sockets = {}
+    for i in range(users):
+        sockets[str(i)] = CountingWebSocket()
+        await managers[i % workers].connect(str(i), sockets[str(i)], {"id": i, "name": f"User {i}"})
+    while any(m.get_connected_users_count() < users for m in managers):
+        await asyncio.sleep(0.01)
+
+    rng = random.Random(42)
+    pairs = []
+    for _ in range(messages):
+        sender, receiver = rng.sample(range(users), 2)
+        pairs.append((sender, str(receiver)))
+    frame = json.dumps({"event": "new_message", "from": "0", "message_id": 1, "message": "hello"})
+
+    started = time.perf_counter()
+    routed = 0
+    for sender, receiver in pairs:
+        if await managers[sender % workers].send_personal_message(frame, receiver):
+            routed += 1
+    while sum(ws.received for ws in sockets.values()) < routed:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - started
+
+    for manager in managers:
+        for user_id in list(manager.active_connections):
+            manager.disconnect(user_id)
+        await manager.stop()
+    return {
+        "workers": workers,
+        "users": users,
+        "messages": messages,
+        "delivered": routed,
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_s": round(routed / elapsed, 1) if elapsed else None,
+        "redis": "real" if os.getenv("REDIS_URL") else "fakeredis",
+    }
+
+
+async def main(args):
+    for workers in args.workers:
+        print(json.dumps(await run(workers, args.users, args.messages)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5000)
+    asyncio.run(main(parser.parse_args()))
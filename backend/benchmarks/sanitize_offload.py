@@ -0,0 +1,81 @@
+"""
+Event-loop lag while sanitizing HTML-heavy messages, executor off vs on.
+
+``--producers`` tasks stand in for sockets, each validating ``--messages``
+large messages full of markup through ``SanitizerPool``. A probe task sleeps
+1 ms in a loop and records how late it wakes up; that overshoot is the delay
+every other socket on the worker would see.
+
+    python -m benchmarks.sanitize_offload --producers 20 --messages 50
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import summarize
+
+HEAVY = (
+    "<p>Notes for <b>Friday</b>: read <a href='https://example.com/ch3'>chapter 3</a> "
+    "&amp; do <i>exercises</i> 1-5 <script>x()</script> <span style='color:red'>due</span></p> "
+) * 5
+
+
+async def probe(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - started - 0.001)
+
+
+async def run(mode: str, producers: int, messages: int, workers: int) -> dict:
+    from app.utils.sanitizer_pool import SanitizerPool
+
+    pool = SanitizerPool(mode=mode, workers=workers)
+    pool.start()
+    # Warm the executor up so process start-up is not measured
+    await pool.check_batch([HEAVY] * workers)
+
+    async def producer(i: int):
+        for n in range(messages):
+            await pool.check(f"{HEAVY} {i}-{n}")
+            # Yield like a socket awaiting its next frame would
+            await asyncio.sleep(0)
+
+    lags, stop = [], asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(producer(i) for i in range(producers)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+    pool.stop()
+
+    lag = summarize(lags)
+    return {
+        "mode": mode,
+        "messages_per_sec": round(producers * messages / elapsed),
+        "loop_lag_p50_ms": lag["p50_ms"],
+        "loop_lag_p99_ms": lag["p99_ms"],
+        "loop_lag_max_ms": lag["max_ms"],
+        "batches": pool.batches,
+    }
+
+
+async def main(modes, producers: int, messages: int, workers: int):
+    results = []
+    for mode in modes:
+        row = await run(mode, producers, messages, workers)
+        results.append(row)
+        print(json.dumps(row))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", nargs="+", default=["off", "thread", "process"])
+    parser.add_argument("--producers", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.modes, args.producers, args.messages, args.workers))
@@ -0,0 +1,124 @@
+"""
+Cold-start time of a worker: importing ``app.main``, then serving until ``/ready``.
+
+``import`` runs ``python -X importtime -c "import app.main"`` ``--runs``
+times in fresh interpreters. It reports the wall time (interpreter start
+included), the import time ``app.main`` itself accounts for, and which of
+its direct imports cost the most.
+
+``boot`` starts ``uvicorn app.main:app`` ``--runs`` times. For each start
+it records when ``/ready`` first returns 200, measured from process spawn
+(uvicorn only accepts connections once startup is done), and how long
+the lifespan startup took (``chat_startup_seconds``). Two modes are compared:
+``migrated`` (migrations applied beforehand, the normal deploy) and
+``migrate_on_startup`` (``DB_MIGRATE_ON_STARTUP=true``). On the default SQLite
+database, the latter gets a fresh file per start, so the worker builds the
+whole schema itself.
+
+    python -m benchmarks.startup --runs 5
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import configure_database, free_port, summarize
+
+MODES = {"migrated": "false", "migrate_on_startup": "true"}
+
+
+def measure_imports(runs: int, top: int) -> dict:
+    wall, own, children = [], [], {}
+    for _ in range(runs):
+        started = time.perf_counter()
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app.main"],
+            env=os.environ, capture_output=True, text=True, check=True,
+        ).stderr
+        wall.append(time.perf_counter() - started)
+        for line in stderr.splitlines():
+            match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+            if not match:
+                continue
+            cumulative, depth, name = int(match[2]) / 1e6, len(match[3]), match[4]
+            if name == "app.main":
+                own.append(cumulative)
+            elif depth == 3:
+                # Direct imports of app.main, skipping what an earlier one already loaded
+                children.setdefault(name, []).append(cumulative)
+    heaviest = sorted(children.items(), key=lambda item: -statistics.median(item[1]))[:top]
+    return {
+        "wall": summarize(wall),
+        "app_main": summarize(own),
+        "heaviest_imports_ms": {name: round(statistics.median(times) * 1000, 1) for name, times in heaviest},
+    }
+
+
+def boot_once(env: dict) -> dict:
+    import httpx
+
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    ready = None
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1) as client:
+            while ready is None and time.perf_counter() - started < 60:
+                try:
+                    status = client.get("/ready").status_code
+                except httpx.TransportError:
+                    time.sleep(0.005)
+                    continue
+                if status == 200:
+                    ready = time.perf_counter() - started
+                else:
+                    time.sleep(0.005)
+            metrics = client.get("/metrics").text if ready is not None else ""
+    finally:
+        server.terminate()
+        server.wait()
+    lifespan = re.search(r"^chat_startup_seconds (\S+)", metrics, re.M)
+    return {
+        "ready": ready,
+        "lifespan": float(lifespan[1]) if lifespan else None,
+    }
+
+
+def measure_boot(mode: str, runs: int) -> dict:
+    env = dict(os.environ, DB_MIGRATE_ON_STARTUP=MODES[mode], LOG_LEVEL="WARNING")
+    samples = []
+    for _ in range(runs):
+        if mode == "migrate_on_startup" and env["DATABASE_URL"].startswith("sqlite"):
+            env["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="teachly-bench-"), "boot.db")
+        samples.append(boot_once(env))
+    failed = sum(1 for sample in samples if sample["ready"] is None)
+    samples = [sample for sample in samples if sample["ready"] is not None]
+    return {
+        "mode": mode,
+        "failed": failed,
+        **{key: summarize([sample[key] for sample in samples if sample[key] is not None])
+           for key in ("ready", "lifespan")},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="heaviest direct imports listed")
+    args = parser.parse_args()
+
+    configure_database()
+    from app.db.migrations import upgrade
+
+    upgrade()
+    print(json.dumps({"import": measure_imports(args.runs, args.top)}))
+    for mode in MODES:
+        print(json.dumps(measure_boot(mode, args.runs)))
@@ -0,0 +1,118 @@
+"""
+Messages/sec through ``validate_user_input`` over realistic chat corpora.
+
+Each corpus is a mix typical of one kind of traffic: short plain chatter
+(the fast path), pasted links, messages with markup or entities, non-ASCII
+text and long paragraphs. ``mixed`` interleaves all of them.
+
+The corpora repeat, so with the URL and message caches on nearly every
+lookup is a hit and the numbers measure the caches rather than validation.
+Each corpus is therefore run twice, in separate interpreters: ``"caches":
+"off"`` (``MESSAGE_CACHE_SIZE=0 URL_CACHE_SIZE=0``) is the cost of validating
+every message, comparable with the numbers from before the caches existed,
+and ``"caches": "on"`` is the cost on repeated traffic. ``--caches`` runs
+only one of them.
+
+``--adversarial N`` then feeds N unique short messages and links to show the
+memoization caches stay bounded (caches on only).
+
+    python -m benchmarks.validation --seconds 1 --adversarial 100000
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+PLAIN = [
+    "ok", "thanks!", "see you tomorrow", "lol", "sounds good to me",
+    "Can you send me the notes from today's lesson?", "on my way",
+    "What time is the exam on Friday", "yes", "I'll be 5 minutes late, sorry",
+]
+LINKS = [
+    "check this out https://example.com/articles/42",
+    "https://docs.python.org/3/library/asyncio.html",
+    "slides are here: https://drive.example.com/file/d/abc123/view?usp=sharing",
+    "http://localhost:8000/health is down again",
+]
+MARKUP = [
+    "this is <b>really</b> important",
+    "use a < b && b > c in the condition",
+    "<script>alert('x')</script> hello",
+    "Tom &amp; Jerry at 5pm",
+]
+UNICODE = [
+    "merci beaucoup 🙏", "¿qué tal la clase?", "大丈夫です", "très bien, à demain 😊",
+]
+LONG = [
+    " ".join(random.Random(seed).choice(PLAIN) for _ in range(60))[:990]
+    for seed in range(4)
+]
+
+CORPORA = {
+    "plain": PLAIN,
+    "links": LINKS,
+    "markup": MARKUP,
+    "unicode": UNICODE,
+    "long": LONG,
+    "mixed": PLAIN * 6 + LINKS + MARKUP + UNICODE + LONG,
+}
+
+
+def measure(messages, seconds: float) -> float:
+    from app.utils.security import validate_user_input
+
+    frames = [{"event": "message", "to": "2", "message": m} for m in messages]
+    count = 0
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for frame in frames:
+            validate_user_input(frame)
+        count += len(frames)
+    return count / (time.perf_counter() - started)
+
+
+def adversarial(count: int) -> dict:
+    from app.utils.security import cache_stats, check_message_content
+
+    for i in range(count):
+        check_message_content(f"<b>{i}</b> https://spam{i}.example.com/{i}")
+    return cache_stats()
+
+
+def run(caches: str, seconds: float, adversarial_count: int):
+    from app.utils.security import cache_stats
+
+    for name, messages in CORPORA.items():
+        print(json.dumps({"caches": caches, "corpus": name, "messages_per_sec": round(measure(messages, seconds))}))
+    print(json.dumps({"caches": caches, "cache_stats": cache_stats()}))
+    if adversarial_count and caches == "on":
+        print(json.dumps({"adversarial": adversarial_count, "cache_stats": adversarial(adversarial_count)}))
+
+
+def run_child(caches: str, args):
+    env = dict(os.environ)
+    if caches == "off":
+        env.update(MESSAGE_CACHE_SIZE="0", URL_CACHE_SIZE="0")
+    subprocess.run(
+        [sys.executable, "-m", "benchmarks.validation", "--child", caches,
+         "--seconds", str(args.seconds), "--adversarial", str(args.adversarial)],
+        env=env, check=True,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=1.0)
+    parser.add_argument("--adversarial", type=int, default=0)
+    parser.add_argument("--caches", choices=("off", "on", "both"), default="both")
+    parser.add_argument("--child", choices=("off", "on"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run(args.child, args.seconds, args.adversarial)
+    else:
+        for caches in (("off", "on") if args.caches == "both" else (args.caches,)):
+            run_child(caches, args)
@@ -0,0 +1,166 @@
+"""
+Bytes on the wire and server CPU per wire format, replayed from recorded traffic.
+
+First a session is recorded against a live server: ``--users`` clients
+connect one after another (each gets a presence snapshot, everyone already
+online gets a delta), send ``--messages`` messages with typing indicators to
+random peers, and ``--offline`` more users connect last to a backlog of
+``--pending`` queued messages each. Every frame each client receives is
+kept, per socket, as JSON text (``--save`` writes it as JSON lines and
+``--traffic`` replays a saved recording instead).
+
+The recording is then re-encoded as JSON text and as MessagePack, each
+with and without ``permessage-deflate`` (raw deflate with context takeover
+per socket, as uvicorn negotiates it by default), reporting total bytes and
+the server's encode and compress time per frame.
+
+    python -m benchmarks.wire_format --users 50 --messages 10 --offline 5 --pending 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import zlib
+from collections import defaultdict
+
+from benchmarks.common import configure_database, free_port, running_app, seed_users
+
+# Emulates permessage-deflate: raw deflate, sync-flushed per message, minus the 4-byte tail
+DEFLATE_TAIL = b"\x00\x00\xff\xff"
+
+
+async def record(users: int, messages: int, offline: int, pending: int) -> list:
+    """(socket, frame text) for every frame the clients of one session received"""
+    import websockets
+
+    configure_database()
+    # The session is scripted, not abusive; keep the per-user limits out of it
+    os.environ.setdefault("WS_RATE_LIMITS", "")
+    import app.main  # noqa: F401  (creates every table before seeding)
+
+    ids = seed_users(users + offline)
+    online_ids, offline_ids = ids[:users], ids[users:]
+    traffic = []
+    rng = random.Random(0)
+
+    async with running_app(free_port()) as host:
+        async def drain(socket: int, ws):
+            try:
+                async for frame in ws:
+                    traffic.append((socket, frame))
+            except Exception:
+                pass
+
+        sockets, drains = [], []
+        for user_id in online_ids:
+            ws = await websockets.connect(f"ws://{host}/ws/chat/{user_id}", compression=None, max_queue=None)
+            sockets.append(ws)
+            drains.append(asyncio.create_task(drain(user_id, ws)))
+            await asyncio.sleep(0.01)
+
+        for _ in range(messages):
+            for user_id, ws in zip(online_ids, sockets):
+                to_id = rng.choice([other for other in online_ids if other != user_id])
+                await ws.send(json.dumps({"event": "typing", "to": str(to_id), "is_typing": True}))
+                await ws.send(json.dumps({
+                    "event": "message", "to": str(to_id),
+                    "message": f"message {rng.randrange(10 ** 6)} about lesson {rng.randrange(100)}",
+                }))
+                await ws.send(json.dumps({"event": "typing", "to": str(to_id), "is_typing": False}))
+            await asyncio.sleep(0.05)
+
+        for user_id in offline_ids:
+            for i in range(pending):
+                ws = sockets[i % len(sockets)]
+                await ws.send(json.dumps({"event": "message", "to": str(user_id), "message": f"while you were out {i}"}))
+        await asyncio.sleep(1)
+
+        for user_id in offline_ids:
+            ws = await websockets.connect(f"ws://{host}/ws/chat/{user_id}", compression=None, max_queue=None)
+            sockets.append(ws)
+            drains.append(asyncio.create_task(drain(user_id, ws)))
+        await asyncio.sleep(1)
+
+        for ws in sockets:
+            await ws.close()
+        for task in drains:
+            task.cancel()
+    return traffic
+
+
+def replay(traffic: list) -> list:
+    from app.chat.protocol import Frame, decode
+
+    by_socket = defaultdict(list)
+    for socket, text in traffic:
+        by_socket[socket].append(decode(text))
+
+    results = []
+    for wire_format in ("json", "msgpack"):
+        for deflate in (False, True):
+            payload_bytes = wire_bytes = frames = 0
+            encode_seconds = compress_seconds = 0.0
+            for values in by_socket.values():
+                compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+                for value in values:
+                    started = time.perf_counter()
+                    frame = Frame(value)
+                    data = frame.text.encode() if wire_format == "json" else frame.binary
+                    encoded = time.perf_counter()
+                    encode_seconds += encoded - started
+                    if deflate:
+                        data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                        data = data[:-len(DEFLATE_TAIL)]
+                        compress_seconds += time.perf_counter() - encoded
+                    payload_bytes += len(data)
+                    # Server-to-client frame header: 2 bytes, +2 past 125 bytes, +8 past 64 KiB
+                    wire_bytes += len(data) + 2 + (2 if len(data) > 125 else 0) + (6 if len(data) > 65535 else 0)
+                    frames += 1
+            results.append({
+                "format": wire_format + ("+deflate" if deflate else ""),
+                "frames": frames,
+                "payload_bytes": payload_bytes,
+                "wire_bytes": wire_bytes,
+                "encode_us_per_frame": round(encode_seconds / max(frames, 1) * 1e6, 2),
+                "compress_us_per_frame": round(compress_seconds / max(frames, 1) * 1e6, 2),
+            })
+    baseline = results[0]["wire_bytes"]
+    for result in results:
+        result["vs_json"] = round(result["wire_bytes"] / baseline, 3) if baseline else None
+    return results
+
+
+def by_event(traffic: list) -> dict:
+    """Frames and JSON bytes per event type, to show where the bytes go"""
+    counts = defaultdict(lambda: [0, 0])
+    for _, text in traffic:
+        event = json.loads(text).get("event", "?")
+        counts[event][0] += 1
+        counts[event][1] += len(text.encode())
+    return {event: {"frames": n, "json_bytes": size} for event, (n, size) in sorted(counts.items())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=10, help="messages sent by each online user")
+    parser.add_argument("--offline", type=int, default=5)
+    parser.add_argument("--pending", type=int, default=200, help="messages queued for each offline user")
+    parser.add_argument("--traffic", help="replay this recording (JSON lines) instead of recording one")
+    parser.add_argument("--save", help="write the recording here as JSON lines")
+    args = parser.parse_args()
+
+    if args.traffic:
+        with open(args.traffic) as f:
+            traffic = [tuple(json.loads(line)) for line in f]
+    else:
+        traffic = asyncio.run(record(args.users, args.messages, args.offline, args.pending))
+    if args.save:
+        with open(args.save, "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in traffic)
+
+    print(json.dumps({"recorded": by_event(traffic)}))
+    for result in replay(traffic):
+        print(json.dumps(result))
@@ -0,0 +1,73 @@
+"""
+Messages/sec per worker: per-message transactions vs the batched write pipeline.
+
+Each of ``--producers`` concurrent tasks stands in for one socket and writes
+``--messages`` chat lines the way the handler does: insert the message, then
+mark it delivered. The ``direct`` mode uses one session and commit per step
+(the previous handler code); ``pipeline`` goes through ``WritePipeline``.
+
+    python -m benchmarks.write_pipeline --producers 50 --messages 40
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, UTC
+
+from benchmarks.common import configure_database, seed_users
+
+
+async def direct_writer(session_factory, sender: int, receiver: int, messages: int):
+    from app.models.message import Message
+
+    for i in range(messages):
+        new_msg = Message(from_id=sender, to_id=receiver, content=f"direct {i}")
+        async with session_factory() as db:
+            db.add(new_msg)
+            await db.commit()
+            await db.refresh(new_msg)
+        async with session_factory() as db:
+            db.add(new_msg)
+            new_msg.delivered_at = datetime.now(UTC)
+            await db.commit()
+
+
+async def pipeline_writer(pipeline, sender: int, receiver: int, messages: int):
+    for i in range(messages):
+        stored = await pipeline.insert_message(sender, receiver, f"pipeline {i}")
+        await pipeline.mark_delivered([stored], datetime.now(UTC))
+
+
+async def main(args):
+    configure_database()
+    from app.db.database import AsyncSessionLocal
+    from app.db.write_pipeline import WritePipeline
+
+    users = seed_users(args.producers * 2)
+    pairs = [(users[i], users[i + 1]) for i in range(0, len(users), 2)]
+    total = len(pairs) * args.messages
+
+    started = time.perf_counter()
+    await asyncio.gather(*(direct_writer(AsyncSessionLocal, a, b, args.messages) for a, b in pairs))
+    elapsed = time.perf_counter() - started
+    print(json.dumps({"mode": "direct", "producers": len(pairs), "messages": total,
+                      "elapsed_s": round(elapsed, 3), "messages_per_s": round(total / elapsed, 1)}))
+
+    pipeline = WritePipeline(max_batch=args.batch_size, max_delay=args.batch_delay_ms / 1000)
+    started = time.perf_counter()
+    await asyncio.gather(*(pipeline_writer(pipeline, a, b, args.messages) for a, b in pairs))
+    elapsed = time.perf_counter() - started
+    await pipeline.stop()
+    print(json.dumps({"mode": "pipeline", "producers": len(pairs), "messages": total,
+                      "elapsed_s": round(elapsed, 3), "messages_per_s": round(total / elapsed, 1),
+                      "batches": pipeline.batches,
+                      "avg_batch": round(pipeline.operations / max(1, pipeline.batches), 1)}))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--producers", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--batch-delay-ms", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
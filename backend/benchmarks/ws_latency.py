@@ -0,0 +1,108 @@
+"""
+Send -> deliver latency of ``/ws/chat/{user_id}`` as concurrent sockets grow.
+
+Sockets are opened in sender/receiver pairs; every sender sends
+``--messages`` messages to its partner, one per ``--interval`` seconds, and
+the time until the partner sees ``new_message`` is recorded. Every socket is
+connected, and is being read by the server, before any pair starts sending,
+so connection setup is not counted as message latency.
+
+A socket's messages do not wait for each other's commits, so one sender is
+not limited to a commit per message, and p99 should not grow with the
+number of DB round-trips queued on the event loop. The clients share the
+server's process, so ``offered_per_s`` (pairs / interval) has to stay within
+what one core can serve; hold it constant to see the effect of the socket
+count alone:
+
+    python -m benchmarks.ws_latency --sockets 10 50 100 200 --messages 20
+    python -m benchmarks.ws_latency --sockets 100 --messages 10 --interval 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from benchmarks.common import configure_database, free_port, running_app, seed_users, summarize
+
+
+async def run_pair(host: str, sender_id: int, receiver_id: int, messages: int, interval: float,
+                   latencies: list, connected: asyncio.Barrier):
+    import websockets
+
+    async with websockets.connect(f"ws://{host}/ws/chat/{sender_id}") as sender, \
+            websockets.connect(f"ws://{host}/ws/chat/{receiver_id}") as receiver:
+        # Sending before the receiver is registered would queue the messages as pending
+        while json.loads(await receiver.recv())["event"] != "connected_users":
+            pass
+        # The sender's snapshot comes with its registration; the second one is the
+        # answer to a request, so the server is reading its frames by then
+        await sender.send(json.dumps({"event": "get_connected_users"}))
+        snapshots = 0
+        while snapshots < 2:
+            snapshots += json.loads(await sender.recv())["event"] == "connected_users"
+        await connected.wait()
+        sent_at = {}
+
+        async def receive():
+            while len(sent_at) < messages or any(v is not None for v in sent_at.values()):
+                frame = json.loads(await receiver.recv())
+                if frame.get("event") == "new_message":
+                    started = sent_at.get(frame["message"])
+                    if started is not None:
+                        latencies.append(time.perf_counter() - started)
+                        sent_at[frame["message"]] = None
+                if len(sent_at) == messages and all(v is None for v in sent_at.values()):
+                    return
+
+        async def drain_sender():
+            try:
+                while True:
+                    await sender.recv()
+            except Exception:
+                pass
+
+        drain = asyncio.create_task(drain_sender())
+        reader = asyncio.create_task(receive())
+        for i in range(messages):
+            text = f"bench {sender_id} {i}"
+            sent_at[text] = time.perf_counter()
+            await sender.send(json.dumps({"event": "message", "to": str(receiver_id), "message": text}))
+            await asyncio.sleep(interval)
+        await asyncio.wait_for(reader, timeout=60)
+        drain.cancel()
+
+
+async def main(levels, messages, interval=0.01):
+    configure_database()
+    # Bursts above the per-user message limit would be throttled, not measured
+    os.environ.setdefault("WS_RATE_LIMITS", "")
+    results = []
+    port = free_port()
+    user_ids = seed_users(sum(levels))
+    async with running_app(port) as host:
+        offset = 0
+        for sockets in levels:
+            ids = user_ids[offset:offset + sockets]
+            offset += sockets
+            latencies = []
+            started = time.perf_counter()
+            pairs = range(0, len(ids) - 1, 2)
+            connected = asyncio.Barrier(len(pairs))
+            await asyncio.gather(*(
+                run_pair(host, ids[i], ids[i + 1], messages, interval, latencies, connected) for i in pairs
+            ))
+            elapsed = time.perf_counter() - started
+            row = {"sockets": sockets, "offered_per_s": round(len(pairs) / interval), "elapsed_s": round(elapsed, 3), **summarize(latencies)}
+            results.append(row)
+            print(json.dumps(row))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sockets", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between a sender's messages")
+    args = parser.parse_args()
+    asyncio.run(main(args.sockets, args.messages, args.interval))
@@ -21,12 +21,15 @@ export const ChatBox = () => {
     isConnected,
     connectedUsers,
     isLoadingHistory,
+    hasOlderHistory,
+    loadOlderMessages,
     usersTyping,
     isCurrentlyTyping,
     setIsCurrentlyTyping,
   } = useWebSocketContext();
 
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  const lastMessageIdRef = useRef<number | undefined>(undefined);
   const [linkWarningModal, setLinkWarningModal] = useState<{
     isOpen: boolean;
     url: string;
@@ -95,11 +98,13 @@ export const ChatBox = () => {
     }
   }, [selectedChatUser, chatMessages, user?.id, markMessagesSeen]);
 
-  // Auto-scroll to bottom when new messages arrive
+  // Auto-scroll to bottom when new messages arrive, but not when older ones are prepended
   useEffect(() => {
-    if (messagesEndRef.current) {
+    const lastMessageId = chatMessages[chatMessages.length - 1]?.id;
+    if (lastMessageId !== lastMessageIdRef.current && messagesEndRef.current) {
       messagesEndRef.current.scrollIntoView({ behavior: "smooth" });
     }
+    lastMessageIdRef.current = lastMessageId;
   }, [chatMessages]);
 
   return (
@@ -156,6 +161,12 @@ export const ChatBox = () => {
           <div className="text-center text-muted">Loading chat history...</div>
         )}
 
+        {selectedChatUser && hasOlderHistory && !isLoadingHistory && (
+          <Button type="button" onClick={loadOlderMessages}>
+            Load older messages
+          </Button>
+        )}
+
         {!selectedChatUser && (
           <div className="text-center text-muted">
             Select a user to start chatting
@@ -6,6 +6,7 @@ import type {
   UserConnectionEvent, 
   MessageSentEvent, 
   MessageDeliveredEvent, 
+  MessagesDeliveredEvent, 
   MessageSeenEvent 
 } from '../hooks/useWebSocket';
 
@@ -32,6 +33,7 @@ export interface WebSocketContextType {
   }>;
   newMessage: string;
   isLoadingHistory: boolean;
+  hasOlderHistory: boolean;
   usersTyping: Set<string>;
   isCurrentlyTyping: boolean;
   
@@ -47,6 +49,7 @@ export interface WebSocketContextType {
   
   // Chat management
   selectChatUser: (connectedUser: ConnectedUser) => Promise<void>;
+  loadOlderMessages: () => Promise<void>;
   setNewMessage: (message: string) => void;
   setIsCurrentlyTyping: (isTyping: boolean) => void;
   closeChat: () => void;
@@ -59,6 +62,7 @@ export interface WebSocketContextType {
   onConnectedUsersUpdate?: (users: ConnectedUser[]) => void;
   onMessageSent?: (event: MessageSentEvent) => void;
   onMessageDelivered?: (event: MessageDeliveredEvent) => void;
+  onMessagesDelivered?: (event: MessagesDeliveredEvent) => void;
   onMessageSeen?: (event: MessageSeenEvent) => void;
 }
 
@@ -2,6 +2,8 @@ import { useEffect, useRef, useState, useCallback } from 'react';
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 const WS_URL = API_URL.replace(/^https?:\/\//, '');
+// A snapshot request still unanswered after this long is assumed lost
+const PRESENCE_RESYNC_TIMEOUT_MS = 5000;
 
 export interface ConnectedUser {
   user_id: string;
@@ -35,14 +37,24 @@ export interface TypingEvent {
 
 export interface ConnectedUsersEvent {
   event: 'connected_users';
+  version: number;
   users: ConnectedUser[];
 }
 
+// Presence deltas carry a monotonically increasing version; a gap means an
+// update was missed and the client re-syncs from a connected_users snapshot.
 export interface UserConnectionEvent {
-  event: 'user_connected' | 'user_disconnected';
+  event: 'user_connected' | 'user_disconnected' | 'users_updated';
+  version: number;
   user_id: string;
   user_info?: ConnectedUser;
-  connected_users: ConnectedUser[];
+}
+
+// A frame the server rejected; it may be sent again after retry_after seconds
+export interface RateLimitedEvent {
+  event: 'rate_limited';
+  for: string;
+  retry_after: number;
 }
 
 export interface MessageSentEvent {
@@ -60,9 +72,28 @@ export interface MessageDeliveredEvent {
   delivered_at: string;
 }
 
+// Sent to a sender once per connect of the recipient, covering every queued
+// message that was just handed over
+export interface MessagesDeliveredEvent {
+  event: 'messages_delivered';
+  message_ids: number[];
+  delivered_at: string;
+}
+
+// Messages queued while the user was offline, delivered in chunks on connect
+export interface PendingMessagesEvent {
+  event: 'pending_messages';
+  messages: Omit<ChatMessage, 'event'>[];
+  delivered_at: string;
+}
+
+// Either a single message, or a high-water mark: every message to reader_id
+// with an id up to and including up_to has now been seen
 export interface MessageSeenEvent {
   event: 'message_seen';
-  message_id: number;
+  message_id?: number;
+  up_to?: number;
+  reader_id?: string;
   seen_at: string;
 }
 
@@ -93,6 +124,7 @@ export interface UseWebSocketReturn {
   onConnectedUsersUpdate?: (users: ConnectedUser[]) => void;
   onMessageSent?: (event: MessageSentEvent) => void;
   onMessageDelivered?: (event: MessageDeliveredEvent) => void;
+  onMessagesDelivered?: (event: MessagesDeliveredEvent) => void;
   onMessageSeen?: (event: MessageSeenEvent) => void;
   
   // Methods for message status
@@ -108,6 +140,9 @@ export const useWebSocket = (): UseWebSocketReturn => {
   
   const wsRef = useRef<WebSocket | null>(null);
   const currentUserId = useRef<string | null>(null);
+  const presenceVersionRef = useRef(0);
+  // When the pending snapshot request was sent, 0 if none is pending
+  const presenceResyncRef = useRef(0);
   
   // Event handlers
   const onMessageRef = useRef<((message: ChatMessage) => void) | undefined>(undefined);
@@ -117,8 +152,50 @@ export const useWebSocket = (): UseWebSocketReturn => {
   const onConnectedUsersUpdateRef = useRef<((users: ConnectedUser[]) => void) | undefined>(undefined);
   const onMessageSentRef = useRef<((event: MessageSentEvent) => void) | undefined>(undefined);
   const onMessageDeliveredRef = useRef<((event: MessageDeliveredEvent) => void) | undefined>(undefined);
+  const onMessagesDeliveredRef = useRef<((event: MessagesDeliveredEvent) => void) | undefined>(undefined);
   const onMessageSeenRef = useRef<((event: MessageSeenEvent) => void) | undefined>(undefined);
 
+  useEffect(() => {
+    setConnectedUsersCount(connectedUsers.length);
+    onConnectedUsersUpdateRef.current?.(connectedUsers);
+  }, [connectedUsers]);
+
+  const requestPresenceSnapshot = useCallback(() => {
+    const pending = presenceResyncRef.current;
+    if (pending && Date.now() - pending < PRESENCE_RESYNC_TIMEOUT_MS) {
+      return; // Already asked
+    }
+    if (wsRef.current?.readyState === WebSocket.OPEN) {
+      presenceResyncRef.current = Date.now();
+      wsRef.current.send(JSON.stringify({ event: 'get_connected_users' }));
+    }
+  }, []);
+
+  const applyPresenceDelta = useCallback((delta: UserConnectionEvent) => {
+    if (delta.version <= presenceVersionRef.current) {
+      return; // Already reflected in our list
+    }
+    if (delta.version !== presenceVersionRef.current + 1) {
+      // Missed an update: ask for a snapshot once and ignore deltas until it arrives
+      requestPresenceSnapshot();
+      return;
+    }
+    presenceVersionRef.current = delta.version;
+    setConnectedUsers((prev) => {
+      const others = prev.filter((u) => u.user_id !== delta.user_id);
+      if (delta.event === 'user_disconnected' || !delta.user_info) {
+        return others;
+      }
+      const index = prev.findIndex((u) => u.user_id === delta.user_id);
+      if (index === -1) {
+        return [...others, delta.user_info];
+      }
+      const next = [...prev];
+      next[index] = delta.user_info;
+      return next;
+    });
+  }, [requestPresenceSnapshot]);
+
   const connect = useCallback((userId: string) => {
     if (wsRef.current?.readyState === WebSocket.OPEN) {
       return; // Already connected
@@ -148,6 +225,12 @@ export const useWebSocket = (): UseWebSocketReturn => {
             onMessageRef.current?.(data as unknown as ChatMessage);
             break;
             
+          case 'pending_messages':
+            for (const message of (data as unknown as PendingMessagesEvent).messages) {
+              onMessageRef.current?.({ event: 'new_message', ...message });
+            }
+            break;
+            
           case 'message_sent':
             console.log('Message sent:', data);
             onMessageSentRef.current?.(data as unknown as MessageSentEvent);
@@ -158,6 +241,10 @@ export const useWebSocket = (): UseWebSocketReturn => {
             onMessageDeliveredRef.current?.(data as unknown as MessageDeliveredEvent);
             break;
             
+          case 'messages_delivered':
+            onMessagesDeliveredRef.current?.(data as unknown as MessagesDeliveredEvent);
+            break;
+            
           case 'message_seen':
             console.log('Message seen:', data);
             onMessageSeenRef.current?.(data as unknown as MessageSeenEvent);
@@ -169,28 +256,32 @@ export const useWebSocket = (): UseWebSocketReturn => {
             
           case 'user_connected':
             onUserConnectRef.current?.(data as unknown as UserConnectionEvent);
-            setConnectedUsers((data as unknown as UserConnectionEvent).connected_users);
-            setConnectedUsersCount((data as unknown as UserConnectionEvent).connected_users.length);
-            onConnectedUsersUpdateRef.current?.((data as unknown as UserConnectionEvent).connected_users);
+            applyPresenceDelta(data as unknown as UserConnectionEvent);
             break;
             
           case 'user_disconnected':
             onUserDisconnectRef.current?.(data as unknown as UserConnectionEvent);
-            setConnectedUsers((data as unknown as UserConnectionEvent).connected_users);
-            setConnectedUsersCount((data as unknown as UserConnectionEvent).connected_users.length);
-            onConnectedUsersUpdateRef.current?.((data as unknown as UserConnectionEvent).connected_users);
+            applyPresenceDelta(data as unknown as UserConnectionEvent);
             break;
             
           case 'connected_users':
+            presenceVersionRef.current = (data as unknown as ConnectedUsersEvent).version;
+            presenceResyncRef.current = 0;
             setConnectedUsers((data as unknown as ConnectedUsersEvent).users);
-            setConnectedUsersCount((data as unknown as ConnectedUsersEvent).users.length);
-            onConnectedUsersUpdateRef.current?.((data as unknown as ConnectedUsersEvent).users);
             break;
+
+          case 'rate_limited': {
+            const limited = data as unknown as RateLimitedEvent;
+            if (limited.for === 'get_connected_users' && presenceResyncRef.current) {
+              // The snapshot request was rejected: ask again once the limit allows it
+              presenceResyncRef.current = 0;
+              setTimeout(requestPresenceSnapshot, limited.retry_after * 1000);
+            }
+            break;
+          }
             
           case 'users_updated':
-            setConnectedUsers((data as unknown as { connected_users: ConnectedUser[] }).connected_users);
-            setConnectedUsersCount((data as unknown as { connected_users: ConnectedUser[] }).connected_users.length);
-            onConnectedUsersUpdateRef.current?.((data as unknown as { connected_users: ConnectedUser[] }).connected_users);
+            applyPresenceDelta(data as unknown as UserConnectionEvent);
             break;
             
           default:
@@ -215,7 +306,7 @@ export const useWebSocket = (): UseWebSocketReturn => {
       setError('WebSocket connection error');
       console.error('WebSocket error:', error);
     };
-  }, []);
+  }, [applyPresenceDelta, requestPresenceSnapshot]);
 
   const disconnect = useCallback(() => {
     if (wsRef.current) {
@@ -225,7 +316,8 @@ export const useWebSocket = (): UseWebSocketReturn => {
     setIsConnected(false);
     setIsConnecting(false);
     setConnectedUsers([]);
-    setConnectedUsersCount(0);
+    presenceVersionRef.current = 0;
+    presenceResyncRef.current = 0;
     currentUserId.current = null;
   }, []);
 
@@ -319,6 +411,9 @@ export const useWebSocket = (): UseWebSocketReturn => {
     get onMessageDelivered() { return onMessageDeliveredRef.current; },
     set onMessageDelivered(handler) { onMessageDeliveredRef.current = handler; },
     
+    get onMessagesDelivered() { return onMessagesDeliveredRef.current; },
+    set onMessagesDelivered(handler) { onMessagesDeliveredRef.current = handler; },
+    
     get onMessageSeen() { return onMessageSeenRef.current; },
     set onMessageSeen(handler) { onMessageSeenRef.current = handler; }
   };
@@ -1,11 +1,23 @@
 import React, { useState, useEffect, useCallback } from "react";
 import { useAuth } from "../hooks/useAuth";
 import { useWebSocket } from "../hooks/useWebSocket";
-import type { ChatMessage, MessageSentEvent, MessageDeliveredEvent, MessageSeenEvent, ConnectedUser } from "../hooks/useWebSocket";
+import type { ChatMessage, MessageSentEvent, MessageDeliveredEvent, MessagesDeliveredEvent, MessageSeenEvent, ConnectedUser } from "../hooks/useWebSocket";
 import { validateMessageInput } from "../utils/messageSecurity";
 import { WebSocketContext } from "../contexts/WebSocketContext";
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+// Messages per /history request; older pages are fetched with ?before=<oldest id>
+const HISTORY_PAGE_SIZE = 100;
+
+type HistoryMessage = {
+  id: number;
+  from: number;
+  to: number;
+  message: string;
+  timestamp: string;
+  delivered_at?: string | null;
+  seen_at?: string | null;
+};
 
 interface WebSocketProviderProps {
   children: React.ReactNode;
@@ -17,19 +29,10 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
   const { user } = useAuth();
   const webSocketHook = useWebSocket();
   const [selectedChatUser, setSelectedChatUser] = useState<ConnectedUser | null>(null);
-  const [chatMessages, setChatMessages] = useState<
-    Array<{
-      id: number;
-      from: number;
-      to: number;
-      message: string;
-      timestamp: string;
-      delivered_at?: string | null;
-      seen_at?: string | null;
-    }>
-  >([]);
+  const [chatMessages, setChatMessages] = useState<HistoryMessage[]>([]);
   const [newMessage, setNewMessage] = useState("");
   const [isLoadingHistory, setIsLoadingHistory] = useState(false);
+  const [hasOlderHistory, setHasOlderHistory] = useState(false);
   const [usersTyping, setUsersTyping] = useState<Set<string>>(new Set());
   const [isCurrentlyTyping, setIsCurrentlyTyping] = useState(false);
 
@@ -102,17 +105,32 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
     );
   }, []);
 
-  const handleMessageSeen = useCallback((event: MessageSeenEvent) => {
-    console.log("Message seen:", event);
+  const handleMessagesDelivered = useCallback((event: MessagesDeliveredEvent) => {
+    console.log("Messages delivered:", event);
+    const delivered = new Set(event.message_ids);
     setChatMessages((prev) => 
       prev.map((msg) => 
-        msg.id === event.message_id 
-          ? { ...msg, seen_at: event.seen_at }
+        delivered.has(msg.id) 
+          ? { ...msg, delivered_at: event.delivered_at }
           : msg
       )
     );
   }, []);
 
+  const handleMessageSeen = useCallback((event: MessageSeenEvent) => {
+    console.log("Message seen:", event);
+    const upTo = event.up_to;
+    const readerId = event.reader_id !== undefined ? parseInt(event.reader_id) : undefined;
+    setChatMessages((prev) => 
+      prev.map((msg) => {
+        const seen = upTo !== undefined
+          ? msg.to === readerId && msg.id <= upTo && !msg.seen_at
+          : msg.id === event.message_id;
+        return seen ? { ...msg, seen_at: event.seen_at } : msg;
+      })
+    );
+  }, []);
+
   const handleTyping = useCallback((event: { from: string; is_typing: boolean }) => {
     console.log("Typing event:", event);
     setUsersTyping((prev) => {
@@ -131,6 +149,7 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
     webSocketHook.onMessage = handleMessage;
     webSocketHook.onMessageSent = handleMessageSent;
     webSocketHook.onMessageDelivered = handleMessageDelivered;
+    webSocketHook.onMessagesDelivered = handleMessagesDelivered;
     webSocketHook.onMessageSeen = handleMessageSeen;
     webSocketHook.onTyping = handleTyping;
 
@@ -138,10 +157,50 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
       webSocketHook.onMessage = undefined;
       webSocketHook.onMessageSent = undefined;
       webSocketHook.onMessageDelivered = undefined;
+      webSocketHook.onMessagesDelivered = undefined;
       webSocketHook.onMessageSeen = undefined;
       webSocketHook.onTyping = undefined;
     };
-  }, [webSocketHook, handleMessage, handleMessageSent, handleMessageDelivered, handleMessageSeen, handleTyping]);
+  }, [webSocketHook, handleMessage, handleMessageSent, handleMessageDelivered, handleMessagesDelivered, handleMessageSeen, handleTyping]);
+
+  // One page of history, oldest first; `before` is the id of the oldest message already shown
+  const fetchHistoryPage = async (otherUserId: string, before?: number): Promise<HistoryMessage[]> => {
+    const params = new URLSearchParams({ limit: String(HISTORY_PAGE_SIZE) });
+    if (before !== undefined) {
+      params.set("before", String(before));
+    }
+    const response = await fetch(`${API_URL}/history/${user?.id}/${otherUserId}?${params}`);
+    if (!response.ok) {
+      throw new Error(`History request failed: ${response.status}`);
+    }
+    const history = await response.json();
+    return history.map((msg: HistoryMessage) => ({
+      id: msg.id,
+      from: msg.from,
+      to: msg.to,
+      message: msg.message,
+      timestamp: msg.timestamp,
+      delivered_at: msg.delivered_at,
+      seen_at: msg.seen_at,
+    }));
+  };
+
+  const loadOlderMessages = async () => {
+    if (!selectedChatUser || isLoadingHistory || !hasOlderHistory || chatMessages.length === 0) {
+      return;
+    }
+    const otherUserId = selectedChatUser.user_id;
+    setIsLoadingHistory(true);
+    try {
+      const page = await fetchHistoryPage(otherUserId, chatMessages[0].id);
+      setHasOlderHistory(page.length === HISTORY_PAGE_SIZE);
+      setChatMessages((prev) => [...page, ...prev]);
+    } catch (error) {
+      console.error('Error loading older messages:', error);
+    } finally {
+      setIsLoadingHistory(false);
+    }
+  };
 
   const selectChatUser = async (connectedUser: ConnectedUser) => {
     // Send typing stop to previous user if currently typing
@@ -149,6 +208,7 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
       setSelectedChatUser(null);
       setChatMessages([]);
       setIsLoadingHistory(false);
+      setHasOlderHistory(false);
       setIsCurrentlyTyping(false);
       return;
     }
@@ -161,26 +221,15 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
     setSelectedChatUser(connectedUser);
     setChatMessages([]);
     setIsLoadingHistory(true);
+    setHasOlderHistory(false);
     setIsCurrentlyTyping(false);
     
-    // Load chat history
+    // Load the latest page of chat history; older pages load on demand
     if (user?.id) {
       try {
-        const response = await fetch(
-          `${API_URL}/history/${user.id}/${connectedUser.user_id}`
-        );
-        if (response.ok) {
-          const history = await response.json();
-          setChatMessages(history.map((msg: {id: number, from: number, to: number, message: string, timestamp: string, delivered_at?: string | null, seen_at?: string | null}) => ({
-            id: msg.id,
-            from: msg.from,
-            to: msg.to,
-            message: msg.message,
-            timestamp: msg.timestamp,
-            delivered_at: msg.delivered_at,
-            seen_at: msg.seen_at,
-          })));
-        }
+        const history = await fetchHistoryPage(connectedUser.user_id);
+        setHasOlderHistory(history.length === HISTORY_PAGE_SIZE);
+        setChatMessages(history);
       } catch (error) {
         console.error('Error loading chat history:', error);
       } finally {
@@ -212,6 +261,7 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
     
     setSelectedChatUser(null);
     setChatMessages([]);
+    setHasOlderHistory(false);
     setIsCurrentlyTyping(false);
     setNewMessage("");
   };
@@ -231,6 +281,7 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
     chatMessages,
     newMessage,
     isLoadingHistory,
+    hasOlderHistory,
     usersTyping,
     isCurrentlyTyping,
     
@@ -246,6 +297,7 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
     
     // Chat management
     selectChatUser,
+    loadOlderMessages,
     setNewMessage,
     setIsCurrentlyTyping,
     closeChat,
@@ -258,6 +310,7 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({
     onConnectedUsersUpdate: webSocketHook.onConnectedUsersUpdate,
     onMessageSent: webSocketHook.onMessageSent,
     onMessageDelivered: webSocketHook.onMessageDelivered,
+    onMessagesDelivered: webSocketHook.onMessagesDelivered,
     onMessageSeen: webSocketHook.onMessageSeen,
   };
 